@@ -0,0 +1,277 @@
+"""Минимальный S3-совместимый сервер в памяти для бенчмарков.
+
+Поддерживает ровно то подмножество API, которое использует miniopy_async
+в этом сервисе: бакеты, PUT/GET/HEAD/DELETE объектов (включая Range и If-Match),
+multipart-загрузку, множественное удаление и ListObjectsV2.
+Подписи запросов не проверяются.
+"""
+
+import asyncio
+import hashlib
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Optional
+from urllib.parse import unquote
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+XML = "application/xml"
+ISO_TIME = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+@dataclass
+class _Object:
+    body: bytes
+    content_type: str
+    etag: str
+    last_modified: datetime
+    metadata: dict = field(default_factory=dict)
+
+
+class FakeS3:
+    """Хранилище объектов в памяти с HTTP интерфейсом S3."""
+
+    def __init__(self):
+        self.buckets: dict[str, dict[str, _Object]] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.requests = 0
+        self.log: list[tuple[str, str]] = []
+        self.runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_route("*", "/{bucket}", self.handle_bucket)
+        app.router.add_route("*", "/{bucket}/", self.handle_bucket)
+        app.router.add_route("*", "/{bucket}/{key:.+}", self.handle_object)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        body: bytes,
+        content_type: str = "application/octet-stream",
+    ):
+        """Кладёт объект напрямую, минуя HTTP, - для подготовки данных."""
+        self.buckets.setdefault(bucket, {})[key] = _Object(
+            body=body,
+            content_type=content_type,
+            etag=hashlib.md5(body).hexdigest(),
+            last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+        )
+
+    @staticmethod
+    def _error(status: int, code: str, resource: str = "") -> web.Response:
+        body = (
+            f"<?xml version='1.0' encoding='UTF-8'?><Error><Code>{code}</Code>"
+            f"<Message>{code}</Message><Resource>{escape(resource)}</Resource>"
+            "<RequestId>fake</RequestId><HostId>fake</HostId></Error>"
+        )
+        return web.Response(status=status, text=body, content_type=XML)
+
+    async def handle_bucket(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        bucket = request.match_info["bucket"]
+        self.log.append((request.method, bucket))
+        query = request.query
+        if "location" in query:
+            return web.Response(
+                text="<LocationConstraint>us-east-1</LocationConstraint>",
+                content_type=XML,
+            )
+        if request.method == "PUT":
+            self.buckets.setdefault(bucket, {})
+            return web.Response()
+        objects = self.buckets.get(bucket)
+        if objects is None:
+            return self._error(404, "NoSuchBucket", bucket)
+        if request.method == "HEAD":
+            return web.Response()
+        if request.method == "POST" and "delete" in query:
+            return self._delete_objects(objects, await request.read())
+        if request.method == "GET":
+            return self._list_objects(bucket, objects, query)
+        return self._error(405, "MethodNotAllowed", bucket)
+
+    def _delete_objects(self, objects: dict, body: bytes) -> web.Response:
+        root = ET.fromstring(body)
+        for key in root.iter():
+            if key.tag.endswith("Key"):
+                objects.pop(key.text, None)
+        return web.Response(text="<DeleteResult></DeleteResult>", content_type=XML)
+
+    @staticmethod
+    def _list_objects(bucket: str, objects: dict, query) -> web.Response:
+        prefix = query.get("prefix", "")
+        start_after = query.get("start-after") or query.get("continuation-token")
+        max_keys = int(query.get("max-keys", 1000))
+        keys = sorted(
+            k for k in objects if k.startswith(prefix) and k > (start_after or "")
+        )
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        items = "".join(
+            f"<Contents><Key>{escape(k)}</Key>"
+            f"<LastModified>{objects[k].last_modified.strftime(ISO_TIME)}"
+            f"</LastModified><ETag>&quot;{objects[k].etag}&quot;</ETag>"
+            f"<Size>{len(objects[k].body)}</Size>"
+            "<StorageClass>STANDARD</StorageClass></Contents>"
+            for k in page
+        )
+        token = (
+            f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>"
+            if truncated
+            else ""
+        )
+        body = (
+            "<?xml version='1.0' encoding='UTF-8'?>"
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+            f"<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+            f"{token}{items}</ListBucketResult>"
+        )
+        return web.Response(text=body, content_type=XML)
+
+    async def handle_object(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        bucket = request.match_info["bucket"]
+        key = unquote(request.match_info["key"])
+        self.log.append((request.method, f"{bucket}/{key}"))
+        objects = self.buckets.get(bucket)
+        if objects is None:
+            return self._error(404, "NoSuchBucket", bucket)
+        query = request.query
+        method = request.method
+        if method == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            return web.Response(
+                text=(
+                    "<InitiateMultipartUploadResult>"
+                    f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                    f"<UploadId>{upload_id}</UploadId>"
+                    "</InitiateMultipartUploadResult>"
+                ),
+                content_type=XML,
+            )
+        if method == "PUT" and "uploadId" in query:
+            data = await request.read()
+            self.uploads[query["uploadId"]][int(query["partNumber"])] = data
+            return web.Response(headers={"ETag": f'"{hashlib.md5(data).hexdigest()}"'})
+        if method == "POST" and "uploadId" in query:
+            parts = self.uploads.pop(query["uploadId"])
+            body = b"".join(parts[n] for n in sorted(parts))
+            obj = self._store(objects, key, body, request)
+            return web.Response(
+                text=(
+                    "<CompleteMultipartUploadResult>"
+                    f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                    f"<ETag>&quot;{obj.etag}&quot;</ETag>"
+                    "</CompleteMultipartUploadResult>"
+                ),
+                content_type=XML,
+            )
+        if method == "DELETE" and "uploadId" in query:
+            self.uploads.pop(query["uploadId"], None)
+            return web.Response(status=204)
+        if method == "PUT" and "x-amz-copy-source" in request.headers:
+            source = unquote(request.headers["x-amz-copy-source"]).lstrip("/")
+            src_bucket, _, src_key = source.partition("/")
+            src = self.buckets.get(src_bucket, {}).get(src_key)
+            if src is None:
+                return self._error(404, "NoSuchKey", source)
+            obj = self._store(objects, key, src.body, request, src.content_type)
+            return web.Response(
+                text=(
+                    f"<CopyObjectResult><ETag>&quot;{obj.etag}&quot;</ETag>"
+                    f"<LastModified>{obj.last_modified.strftime(ISO_TIME)}"
+                    "</LastModified></CopyObjectResult>"
+                ),
+                content_type=XML,
+            )
+        if method == "PUT":
+            obj = self._store(objects, key, await request.read(), request)
+            return web.Response(headers={"ETag": f'"{obj.etag}"'})
+        if method == "DELETE":
+            objects.pop(key, None)
+            return web.Response(status=204)
+        obj = objects.get(key)
+        if obj is None:
+            if method == "HEAD":
+                return web.Response(status=404)
+            return self._error(404, "NoSuchKey", key)
+        if_match = request.headers.get("If-Match")
+        if if_match and if_match.strip('"') != obj.etag:
+            return self._error(412, "PreconditionFailed", key)
+        headers = {
+            "ETag": f'"{obj.etag}"',
+            "Last-Modified": format_datetime(obj.last_modified, usegmt=True),
+            "Content-Type": obj.content_type,
+            "Accept-Ranges": "bytes",
+            **obj.metadata,
+        }
+        if method == "HEAD":
+            headers["Content-Length"] = str(len(obj.body))
+            return web.Response(headers=headers)
+        body = obj.body
+        status = 200
+        if range_header := request.headers.get("Range"):
+            start, _, end = range_header.removeprefix("bytes=").partition("-")
+            start, end = int(start), int(end) if end else len(body) - 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            body, status = body[start : end + 1], 206
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = len(body)
+        await response.prepare(request)
+        for i in range(0, len(body), 64 * 1024):
+            await response.write(body[i : i + 64 * 1024])
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _store(
+        objects: dict,
+        key: str,
+        body: bytes,
+        request: web.Request,
+        content_type: Optional[str] = None,
+    ) -> _Object:
+        obj = _Object(
+            body=body,
+            content_type=content_type
+            or request.headers.get("Content-Type", "application/octet-stream"),
+            etag=hashlib.md5(body).hexdigest(),
+            last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+            metadata={
+                k: v
+                for k, v in request.headers.items()
+                if k.lower().startswith("x-amz-meta-")
+            },
+        )
+        objects[key] = obj
+        return obj
+
+
+async def main(port: int = 9000):
+    server = FakeS3()
+    await server.start(port=port)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
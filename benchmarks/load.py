@@ -0,0 +1,353 @@
+"""Нагрузочный бенчмарк сервиса с S3 в памяти.
+
+Запуск из корня репозитория:
+
+    python benchmarks/load.py [--scenarios download mixed] [--concurrency 1 16 64]
+        [--requests 2000] [--size-kb 64] [--output results.json]
+
+В одном процессе запускаются сервер S3 из `fake_s3.py`, приложение
+`core.setup:setup_app` под uvicorn на локальном порту и клиент на aiohttp,
+поэтому для запуска не нужны ни MinIO, ни сеть. Каждый сценарий выполняется
+при каждом уровне конкурентности: `--concurrency` клиентов по очереди
+забирают запросы, пока не будет отправлено `--requests` штук. Первые
+`--warmup` запросов не учитываются.
+
+Сценарии:
+
+    upload         POST /upload, форма с файлом - проверка через UploadFileSchema
+    upload_stream  POST /upload/{bucket}/{object_name}, тело - файл
+    download       GET /download/{bucket}/{object_name}
+    update         PUT /update/{bucket}/{object_name}
+    delete         DELETE /delete/{bucket}/{object_name}
+    mixed          60% download, 20% upload, 10% update, 10% delete
+
+Результат - JSON: задержки p50/p95/p99 в миллисекундах, запросы в секунду,
+ошибки и пиковый RSS процесса для каждой пары сценарий/конкурентность.
+Пиковый RSS сбрасывается перед каждым прогоном через /proc/self/clear_refs;
+если это недоступно, `peak_rss_bytes` - пик с начала работы процесса.
+В RSS входят и объекты, накопленные в S3 в памяти за предыдущие прогоны.
+Клиент и сервер делят один цикл событий, поэтому абсолютные числа ниже, чем
+у отдельно запущенного сервиса; бенчмарк предназначен для сравнения версий
+на одной и той же машине.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "meme_storage"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_s3 import FakeS3  # noqa: E402
+
+BUCKET = "bench"
+SEEDED = 100
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+MIX = (("download", 60), ("upload", 20), ("update", 10), ("delete", 10))
+
+Scenario = Callable[[aiohttp.ClientSession, int], Awaitable[int]]
+
+
+class Load:
+    """Запросы сценариев и объекты, которые им нужны.
+
+    Args:
+        s3 (FakeS3): Хранилище, в которое заранее кладутся объекты.
+        body (bytes): Содержимое загружаемых и скачиваемых файлов.
+        total (int): Сколько запросов будет отправлено за все прогоны.
+    """
+
+    def __init__(self, s3: FakeS3, body: bytes, total: int):
+        self.s3 = s3
+        self.body = body
+        self.total = total
+        self.run = 0
+
+    def prepare(self, run: int):
+        """Объекты прогона: скачиваемые, обновляемые и удаляемые."""
+        self.run = run
+        for i in range(SEEDED):
+            self.s3.put(BUCKET, f"download-{i}", self.body, "image/jpeg")
+            self.s3.put(BUCKET, f"update-{i}", self.body, "image/jpeg")
+        for i in range(self.total):
+            self.s3.put(BUCKET, f"delete-{run}-{i}", self.body, "image/jpeg")
+
+    def form(self, object_name: str) -> aiohttp.FormData:
+        data = aiohttp.FormData()
+        data.add_field(
+            "file", self.body, filename=f"{object_name}.jpg", content_type="image/jpeg"
+        )
+        data.add_field("bucket", BUCKET)
+        data.add_field("object_name", object_name)
+        return data
+
+    async def upload(self, session: aiohttp.ClientSession, i: int) -> int:
+        async with session.post(
+            "/upload", data=self.form(f"upload-{self.run}-{i}")
+        ) as response:
+            await response.read()
+            return response.status
+
+    async def upload_stream(self, session: aiohttp.ClientSession, i: int) -> int:
+        async with session.post(
+            f"/upload/{BUCKET}/stream-{self.run}-{i}", data=self.body
+        ) as response:
+            await response.read()
+            return response.status
+
+    async def download(self, session: aiohttp.ClientSession, i: int) -> int:
+        async with session.get(
+            f"/download/{BUCKET}/download-{i % SEEDED}"
+        ) as response:
+            await response.read()
+            return response.status
+
+    async def update(self, session: aiohttp.ClientSession, i: int) -> int:
+        object_name = f"update-{i % SEEDED}"
+        async with session.put(
+            f"/update/{BUCKET}/{object_name}", data=self.form(object_name)
+        ) as response:
+            await response.read()
+            return response.status
+
+    async def delete(self, session: aiohttp.ClientSession, i: int) -> int:
+        async with session.delete(
+            f"/delete/{BUCKET}/delete-{self.run}-{i}"
+        ) as response:
+            await response.read()
+            return response.status
+
+    def mixed(self) -> Scenario:
+        names = [name for name, weight in MIX for _ in range(weight)]
+        order = random.Random(0).choices(names, k=self.total)
+
+        async def scenario(session: aiohttp.ClientSession, i: int) -> int:
+            return await getattr(self, order[i % len(order)])(session, i)
+
+        return scenario
+
+    def scenario(self, name: str) -> Scenario:
+        return self.mixed() if name == "mixed" else getattr(self, name)
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss() -> Optional[int]:
+    """Пиковый RSS процесса в байтах (VmHWM)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу, `values` отсортированы."""
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def measure(
+    session: aiohttp.ClientSession,
+    scenario: Scenario,
+    concurrency: int,
+    requests: int,
+    offset: int = 0,
+) -> tuple[list[float], int, float]:
+    """Выполняет `requests` запросов `concurrency` клиентами.
+
+    Returns:
+        tuple[list[float], int, float]: Задержки в секундах, число ошибок
+            и общее время.
+    """
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(offset, offset + requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                status = await scenario(session, i)
+            except aiohttp.ClientError:
+                status = 0
+            latencies.append(time.perf_counter() - start)
+            if not 200 <= status < 300:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def summary(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(ms, 50), 3),
+            "p95": round(percentile(ms, 95), 3),
+            "p99": round(percentile(ms, 99), 3),
+            "mean": round(sum(ms) / len(ms), 3),
+            "max": round(ms[-1], 3),
+        },
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def serve(s3_port: int, size: int):
+    """Запускает приложение под uvicorn на свободном локальном порту."""
+    os.environ.update(
+        {
+            "MINIO_ENDPOINT": f"127.0.0.1:{s3_port}",
+            "MINIO_SECURE": "False",
+            "MINIO_BUCKETS": json.dumps([BUCKET]),
+            "CONFIG_RELOAD_INTERVAL": "0",
+        }
+    )
+    for name, value in (
+        ("LEVEL", "WARNING"),
+        ("GURU", "False"),
+        ("TRACEBACK", "False"),
+        ("SIZE", str(max(size, 1024 * 1024))),
+    ):
+        os.environ.setdefault(name, value)
+
+    import uvicorn
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            "core.setup:setup_app",
+            factory=True,
+            host="127.0.0.1",
+            port=0,
+            log_level="warning",
+            access_log=False,
+            lifespan="on",
+        )
+    )
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+            raise RuntimeError("uvicorn stopped during startup")
+        await asyncio.sleep(0.01)
+    return server, task, server.servers[0].sockets[0].getsockname()[1]
+
+
+async def main(args: argparse.Namespace) -> dict:
+    s3 = FakeS3()
+    s3_port = await s3.start()
+    body = JPEG_HEADER + random.Random(0).randbytes(args.size_kb * 1024)
+    server, task, port = await serve(s3_port, len(body))
+    load = Load(s3, body, args.warmup + args.requests)
+    results = []
+    try:
+        for run, (name, concurrency) in enumerate(
+            (name, concurrency)
+            for name in args.scenarios
+            for concurrency in args.concurrency
+        ):
+            load.prepare(run)
+            async with aiohttp.ClientSession(
+                f"http://127.0.0.1:{port}",
+                connector=aiohttp.TCPConnector(limit=concurrency),
+            ) as session:
+                scenario = load.scenario(name)
+                await measure(session, scenario, concurrency, args.warmup)
+                reset_peak_rss()
+                latencies, errors, elapsed = await measure(
+                    session, scenario, concurrency, args.requests, args.warmup
+                )
+            results.append(
+                {
+                    "scenario": name,
+                    "concurrency": concurrency,
+                    **summary(latencies, errors, elapsed),
+                    "peak_rss_bytes": peak_rss(),
+                }
+            )
+            print(
+                f"{name:>14} c={concurrency:<4} "
+                f"{results[-1]['rps']:>9} rps  "
+                f"p99 {results[-1]['latency_ms']['p99']} ms",
+                file=sys.stderr,
+            )
+    finally:
+        server.should_exit = True
+        await task
+        await s3.stop()
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "object_bytes": len(body),
+            "requests": args.requests,
+            "warmup": args.warmup,
+        },
+        "results": results,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=["upload", "upload_stream", "download", "update", "delete", "mixed"],
+        choices=["upload", "upload_stream", "download", "update", "delete", "mixed"],
+    )
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 16, 64])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--size-kb", type=int, default=64)
+    parser.add_argument("--output", help="файл для JSON, по умолчанию stdout")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    report = json.dumps(asyncio.run(main(arguments)), indent=2)
+    if arguments.output:
+        Path(arguments.output).write_text(report + "\n")
+    else:
+        print(report)
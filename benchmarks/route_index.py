@@ -0,0 +1,76 @@
+"""Стоимость проверки маршрута на запрос: линейный перебор и RouteIndex.
+
+Запуск из корня репозитория:
+
+    python benchmarks/route_index.py
+
+Для 10, 100 и 1000 маршрутов измеряется время одной проверки для пути
+последнего маршрута (200), несуществующего пути (404) и пути с
+неподдерживаемым методом (405).
+"""
+
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "meme_storage"))
+
+from core.routing import RouteIndex  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+ROUTE_COUNTS = (10, 100, 1000)
+REPEAT = 5
+
+
+def make_routes(count: int) -> list:
+    app = FastAPI()
+    for i in range(count):
+        app.add_api_route(f"/r{i}/download/{{bucket}}/{{object_name}}", endpoint)
+    return app.routes
+
+
+async def endpoint():
+    return None
+
+
+def linear_scan(routes: list, method: str, path: str) -> int:
+    """Проверка в том виде, в каком она была в ErrorHandlingMiddleware."""
+    result = 404
+    for route in routes:
+        if re.match(route.path_regex, path):
+            if method.upper() in route.methods:
+                return 200
+            result = 405
+    return result
+
+
+def measure(func, *args) -> float:
+    timer = timeit.Timer(lambda: func(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, number)) / number * 1e6
+
+
+def main():
+    print(f"{'routes':>6} {'case':>4} {'linear, us':>11} {'index, us':>10} {'x':>7}")
+    for count in ROUTE_COUNTS:
+        routes = make_routes(count)
+        index = RouteIndex()
+        cases = {
+            200: ("GET", f"/r{count - 1}/download/bucket/object.jpg"),
+            404: ("GET", "/missing/bucket/object.jpg"),
+            405: ("POST", f"/r{count - 1}/download/bucket/object.jpg"),
+        }
+        for expected, (method, path) in cases.items():
+            assert linear_scan(routes, method, path) == expected
+            assert index.status(routes, method, path) == expected
+            linear = measure(linear_scan, routes, method, path)
+            indexed = measure(index.status, routes, method, path)
+            print(
+                f"{count:>6} {expected:>4} {linear:>11.2f} {indexed:>10.2f}"
+                f" {linear / indexed:>7.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
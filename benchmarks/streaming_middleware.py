@@ -0,0 +1,125 @@
+"""Пропускная способность потоковой отдачи через ErrorHandlingMiddleware.
+
+Запуск из корня репозитория:
+
+    python benchmarks/streaming_middleware.py [--size-mb 512] [--chunk-kb 64]
+
+Приложение с одним маршрутом отдаёт StreamingResponse заданного размера.
+Запросы выполняются напрямую через ASGI, без сети, поэтому разница между
+вариантами - это накладные расходы самого middleware: прежней реализации
+на `BaseHTTPMiddleware` и текущей ASGI реализации.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "meme_storage"))
+for name, value in (("LEVEL", "WARNING"), ("GURU", "False"), ("TRACEBACK", "False")):
+    os.environ.setdefault(name, value)
+
+from core.middelware import ErrorHandlingMiddleware  # noqa: E402
+from core.settings import LogSettings  # noqa: E402
+from fastapi import FastAPI, Request  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.responses import StreamingResponse  # noqa: E402
+
+REPEAT = 5
+
+
+class BaseHTTPErrorHandlingMiddleware(BaseHTTPMiddleware):
+    """Прежняя реализация: та же проверка маршрута поверх BaseHTTPMiddleware."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.handler = ErrorHandlingMiddleware(app)
+
+    async def dispatch(self, request: Request, call_next):
+        try:
+            self.handler.is_endpoint(request)
+            return await call_next(request)
+        except Exception as error:
+            return self.handler.exception_handler(request.scope)(
+                error, request.url, request.app.logger, False
+            )
+
+
+def make_app(middleware, size: int, chunk_size: int) -> FastAPI:
+    app = FastAPI()
+    app.settings = SimpleNamespace(app_host="127.0.0.1", app_port=8000)
+    app.config = SimpleNamespace(log=LogSettings())
+    app.logger = logging.getLogger("benchmark")
+    chunk = b"\0" * chunk_size
+
+    async def body():
+        for _ in range(size // chunk_size):
+            yield chunk
+
+    @app.get("/download")
+    async def download():
+        return StreamingResponse(body(), media_type="image/jpeg")
+
+    app.add_middleware(middleware)
+    return app
+
+
+async def run(app: FastAPI) -> int:
+    received = 0
+
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received
+        if message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/download",
+        "raw_path": b"/download",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"127.0.0.1")],
+        "client": ("127.0.0.1", 1),
+        "server": ("127.0.0.1", 8000),
+    }
+    await app(scope, receive, send)
+    return received
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--chunk-kb", type=int, default=64)
+    args = parser.parse_args()
+    size, chunk_size = args.size_mb * 1024 * 1024, args.chunk_kb * 1024
+    print(f"{'middleware':>16} {'MB/s':>9} {'chunks/s':>10}")
+    for name, middleware in (
+        ("BaseHTTP", BaseHTTPErrorHandlingMiddleware),
+        ("ASGI", ErrorHandlingMiddleware),
+    ):
+        app = make_app(middleware, size, chunk_size)
+        best = float("inf")
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            assert await run(app) == size
+            best = min(best, time.perf_counter() - start)
+        print(
+            f"{name:>16} {size / best / 1024 / 1024:>9.0f}"
+            f" {size // chunk_size / best:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
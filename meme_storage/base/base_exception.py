@@ -1,14 +1,21 @@
+from starlette import status
+
+
 class ExceptionBase(Exception):
     """Базовый класс исключений"""
 
     args = "Неизвестная ошибка"
     exception = None
+    status_code = status.HTTP_400_BAD_REQUEST
+    headers = None
 
-    def __init__(self, *args, exception: Exception = None):
+    def __init__(self, *args, exception: Exception = None, headers: dict = None):
         if args:
             self.args = args
         if exception:
             self.exception = exception
+        if headers:
+            self.headers = headers
 
     def __str__(self):
         return f"Ошибка: {self.args[0]}"
@@ -1,5 +1,7 @@
 import logging
 
+from core.config import Config
+from core.metrics import Metrics
 from core.settings import AppSettings
 from fastapi import FastAPI
 from fastapi import Request as FastAPIRequest
@@ -14,16 +16,24 @@ class Application(FastAPI):
 
     Attributes:
         store (Store): Экземпляр хранилища.
-        settings (AppSettings): Настройки приложения.
+        config (Config): Реестр настроек приложения.
+        metrics (Metrics): Метрики приложения.
+        settings (AppSettings): Настройки приложения из текущего снимка
+            `config`.
         logger (logging.Logger): Экземпляр логгера.
         docs_url (str): URL-адрес документации.
     """
 
     store: Store
-    settings: AppSettings
+    config: Config
+    metrics: Metrics
     logger: logging.Logger
     docs_url: str
 
+    @property
+    def settings(self) -> AppSettings:
+        return self.config.app
+
 
 class Request(FastAPIRequest):
     """Request переопределение.
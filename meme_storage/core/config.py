@@ -0,0 +1,185 @@
+"""Реестр настроек приложения с перечитыванием без перезапуска."""
+
+import asyncio
+import contextlib
+import os
+import signal
+from logging import Logger
+from typing import Callable, NamedTuple, Optional
+
+from pydantic import ValidationError
+
+from core.settings import (
+    AppSettings,
+    Base,
+    CacheSettings,
+    DownloadSettings,
+    FileSettings,
+    ImageSettings,
+    IndexSettings,
+    LogSettings,
+    MetricsSettings,
+    MinioSettings,
+)
+
+
+class Settings(NamedTuple):
+    """Снимок всех настроек, прочитанных за один раз."""
+
+    app: AppSettings
+    log: LogSettings
+    file: FileSettings
+    download: DownloadSettings
+    cache: CacheSettings
+    minio: MinioSettings
+    image: ImageSettings
+    metrics: MetricsSettings
+    index: IndexSettings
+
+
+Listener = Callable[[Settings, Settings], None]
+
+
+class Config:
+    """Настройки приложения, прочитанные один раз и общие для всех его частей.
+
+    Реестр создаётся в `setup_app` и хранится в `app.config`, так что
+    импорт модулей не читает окружение, а у каждого приложения свой реестр.
+    Переменные среды и файл `.env` разбираются при создании реестра и при
+    перечитывании, а не при каждом обращении. Перечитывание собирает новый
+    снимок целиком и подменяет ссылку на него, поэтому читатель всегда видит
+    либо старые, либо новые настройки, но не их смесь. Если новые значения
+    не проходят проверку, остаётся старый снимок.
+
+    Настройки перечитываются по сигналу SIGHUP и при изменении `.env`,
+    который проверяется раз в `config_reload_interval` секунд. Значения,
+    которые читаются при каждом запросе (лимиты размеров, уровень
+    логирования, параметры кэша и отдачи), начинают действовать сразу.
+    Параметры подключений и пулов, созданных при старте, - после перезапуска.
+    """
+
+    def __init__(self):
+        self._settings = self._load()
+        self._listeners: list[Listener] = []
+        self._mtime = self._env_mtime()
+        self._watcher: Optional[asyncio.Task] = None
+        self.logger: Optional[Logger] = None
+
+    @property
+    def settings(self) -> Settings:
+        return self._settings
+
+    @property
+    def app(self) -> AppSettings:
+        return self._settings.app
+
+    @property
+    def log(self) -> LogSettings:
+        return self._settings.log
+
+    @property
+    def file(self) -> FileSettings:
+        return self._settings.file
+
+    @property
+    def download(self) -> DownloadSettings:
+        return self._settings.download
+
+    @property
+    def cache(self) -> CacheSettings:
+        return self._settings.cache
+
+    @property
+    def minio(self) -> MinioSettings:
+        return self._settings.minio
+
+    @property
+    def image(self) -> ImageSettings:
+        return self._settings.image
+
+    @property
+    def metrics(self) -> MetricsSettings:
+        return self._settings.metrics
+
+    @property
+    def index(self) -> IndexSettings:
+        return self._settings.index
+
+    def subscribe(self, listener: Listener):
+        """Вызывать `listener(old, new)` после каждого перечитывания."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Listener):
+        with contextlib.suppress(ValueError):
+            self._listeners.remove(listener)
+
+    def reload(self) -> bool:
+        """Перечитывает настройки.
+
+        Returns:
+            bool: True, если новый снимок применён.
+        """
+        try:
+            settings = self._load()
+        except ValidationError as e:
+            if self.logger:
+                self.logger.error(f"{self.__class__.__name__}: не применены {e}")
+            return False
+        old, self._settings = self._settings, settings
+        for listener in self._listeners:
+            listener(old, settings)
+        if self.logger:
+            changed = [
+                name
+                for name, value in settings._asdict().items()
+                if getattr(old, name) != value
+            ]
+            self.logger.info(f"{self.__class__.__name__}: перечитаны {changed}")
+        return True
+
+    async def start(self, logger: Logger):
+        """Включает перечитывание по SIGHUP и по изменению `.env`."""
+        self.logger = logger
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+        if self.app.config_reload_interval > 0:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.app.config_reload_interval)
+            if (mtime := self._env_mtime()) != self._mtime:
+                self._mtime = mtime
+                self.reload()
+
+    @staticmethod
+    def _env_mtime() -> Optional[int]:
+        try:
+            return os.stat(Base.Config.env_file).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _load() -> Settings:
+        return Settings(
+            AppSettings(),
+            LogSettings(),
+            FileSettings(),
+            DownloadSettings(),
+            CacheSettings(),
+            MinioSettings(),
+            ImageSettings(),
+            MetricsSettings(),
+            IndexSettings(),
+        )
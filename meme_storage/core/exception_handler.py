@@ -1,32 +1,113 @@
+import json
+import time
 import traceback
+from dataclasses import dataclass
 from logging import Logger
+from typing import Any, Optional
 
+from base.base_exception import ExceptionBase
 from base.base_helper import HTTP_EXCEPTION, LOG_LEVEL
 from httpcore import URL
 from starlette import status
-from starlette.responses import JSONResponse
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+
+UNKNOWN_MESSAGE = "Неизвестная ошибка..."
+
+
+def encode_error(status_code: int, message: Any) -> bytes:
+    """Тело ответа с ошибкой в том виде, в каком его записал бы JSONResponse."""
+    return json.dumps(
+        {"detail": HTTP_EXCEPTION.get(status_code), "message": message},
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+        default=str,
+    ).encode("utf-8")
+
+
+@dataclass(slots=True)
+class _Window:
+    start: float
+    count: int = 0
+    skipped: int = 0
+
+
+class TracebackLimiter:
+    """Ограничение числа трассировок в журнале.
+
+    Для каждого класса исключения пишется не больше `limit` трассировок за
+    `window` секунд, остальные ошибки логируются одной строкой. Так серия
+    одинаковых ошибок S3 не превращается в форматирование и запись тысяч
+    одинаковых трассировок.
+
+    Args:
+        limit (int): Трассировок одного класса исключения за окно.
+        window (float): Длина окна в секундах.
+    """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._windows: dict[type, _Window] = {}
+
+    def allow(self, exception_class: type) -> Optional[int]:
+        """Можно ли записать трассировку.
+
+        Returns:
+            Optional[int]: None, если трассировку нужно пропустить, иначе
+                число трассировок, пропущенных в предыдущем окне.
+        """
+        now = time.monotonic()
+        window = self._windows.get(exception_class)
+        if window is None or now - window.start >= self.window:
+            skipped = window.skipped if window is not None else 0
+            self._windows[exception_class] = _Window(now, 1)
+            return skipped
+        if window.count < self.limit:
+            window.count += 1
+            return 0
+        window.skipped += 1
+        return None
 
 
 class ExceptionHandler:
     """Этот класс используется для обработки всех исключений, возникающих в приложении.
     Он предоставляет стандартный способ регистрации ошибок и возврата их пользователю
 
+    Один обработчик используется всеми одновременными запросами, поэтому он
+    не хранит состояние обрабатываемого исключения. Тела ответов для
+    исключений `ExceptionBase` с сообщением по умолчанию кодируются один раз
+    на класс и дальше берутся из таблицы.
+
     Args:
         log_level (LOG_LEVEL, optional): Используемый уровень логирования. По умолчанию "INFO".
         is_traceback (bool, optional): Включать ли трассировку в ответ. По умолчанию "False".
+        traceback_limit (int, optional): Трассировок одного класса исключения
+            за окно. По умолчанию 10.
+        traceback_window (float, optional): Длина окна в секундах.
+            По умолчанию 60.
     """
 
-    def __init__(self, log_level: LOG_LEVEL = "INFO", is_traceback: bool = False):
-        """Инициализирует обработчик исключений.
-        С заданным уровнем ведения журнала и параметрами обратной трассировки.
-
-        """
-        self.exception = Exception("Неизвестная ошибка...")
+    def __init__(
+        self,
+        log_level: LOG_LEVEL = "INFO",
+        is_traceback: bool = False,
+        traceback_limit: int = 10,
+        traceback_window: float = 60.0,
+    ):
         self.level = log_level
-        self.logger = Logger(__name__)
-        self.message = "Неизвестная ошибка..."
-        self.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         self.is_traceback = is_traceback
+        self.tracebacks = TracebackLimiter(traceback_limit, traceback_window)
+        self.bodies: dict[type, bytes] = {}
+        classes = ExceptionBase.__subclasses__()
+        while classes:
+            exception_class = classes.pop()
+            classes.extend(exception_class.__subclasses__())
+            if isinstance(exception_class.args, tuple) and exception_class.args:
+                self.bodies[exception_class] = encode_error(
+                    exception_class.status_code, exception_class.args[0]
+                )
 
     def __call__(
         self,
@@ -34,7 +115,7 @@ class ExceptionHandler:
         url: URL,
         logger: Logger = None,
         is_traceback: bool = True,
-    ) -> JSONResponse:
+    ) -> Response:
         """Этот метод Используется для обработки исключения.
 
         Args:
@@ -44,57 +125,66 @@ class ExceptionHandler:
             is_traceback (bool, optional): Включать ли трассировку в ответ. По умолчанию True.
 
         Returns:
-            JSONResponse: Ответ с деталями об исключении.
+            Response: Ответ с деталями об исключении.
         """
-        self.exception = exception
-        self.logger = logger
-        self.is_traceback = is_traceback
-        self.handler_exception()
-        return self.error_response(url)
+        status_code, message, headers = self.describe(exception)
+        if logger is not None:
+            self.log(exception, url, logger, is_traceback)
+        return Response(
+            content=self.body(exception, status_code, message),
+            status_code=status_code,
+            headers=headers,
+            media_type="application/json",
+        )
 
-    def error_response(self, url: URL) -> JSONResponse:
-        """Этот метод используется для создания ответа с деталями об исключении.
+    @staticmethod
+    def describe(exception: Exception) -> tuple[int, Any, Optional[dict]]:
+        """Код статуса, сообщение и заголовки ответа для исключения."""
+        if isinstance(exception, ExceptionBase):
+            return exception.status_code, exception.args[0], exception.headers
+        if isinstance(exception, HTTPException):
+            return exception.status_code, exception.detail, exception.headers
+        message = exception.args[0] if exception.args else UNKNOWN_MESSAGE
+        return status.HTTP_400_BAD_REQUEST, message, None
 
-        Args:
-            url (URL): URL запроса, вызвавшего исключение.
+    def body(self, exception: Exception, status_code: int, message: Any) -> bytes:
+        """Тело ответа, для сообщений по умолчанию - из таблицы."""
+        exception_class = type(exception)
+        if isinstance(exception, ExceptionBase) and (
+            exception.args is exception_class.args
+        ):
+            if (body := self.bodies.get(exception_class)) is None:
+                body = self.bodies[exception_class] = encode_error(status_code, message)
+            return body
+        return encode_error(status_code, message)
 
-        Returns:
-            JSONResponse: Ответ с деталями об исключении.
-        """
-        content_data = {
-            "detail": HTTP_EXCEPTION.get(self.status_code),
-            "message": self.message,
-        }
-        if self.is_traceback:
-            msg = traceback.format_exc()
-        else:
-            msg = f"url={url}, exception={self.exception.__class__}, message_to_user={self.exception}"
+    def log(self, exception: Exception, url: URL, logger: Logger, is_traceback: bool):
+        """Запись исключения в журнал с ограничением числа трассировок."""
+        critical = self.level in ("CRITICAL", 50)
+        trace = None
+        if is_traceback or critical:
+            skipped = self.tracebacks.allow(type(exception))
+            if skipped is not None:
+                trace = traceback.format_exc()
+                if skipped:
+                    trace += f"Пропущено трассировок {exception.__class__}: {skipped}\n"
+        summary = (
+            f"url={url}, exception={exception.__class__}, message_to_user={exception}"
+        )
+        msg = trace if is_traceback and trace is not None else summary
         match self.level:
             case "CRITICAL" | 50:
                 msg = (
                     f" \n_____________\n "
                     f"Внимание: Произошла ошибка, на которую приложение не отреагировало корректно.."
                     f" НАМ НУЖНО СРОЧНО ОТРЕАГИРОВАТЬ"
-                    f" \nExceptionHandler:  {str(self.exception)}\n"
-                    f" _____________\n" + traceback.format_exc()
+                    f" \nExceptionHandler:  {str(exception)}\n"
+                    f" _____________\n" + (trace or summary)
                 )
-                self.logger.critical(msg)
+                logger.critical(msg)
             case "ERROR" | 40:
-                self.logger.error(msg)
+                logger.error(msg)
             case "WARNING" | 30:
-                self.logger.warning(msg)
+                logger.warning(msg)
             case _:
-                self.logger.info(msg)
-        return JSONResponse(content=content_data, status_code=self.status_code)
-
-    def handler_exception(self):
-        """Этот метод используется для обработки исключения.
-
-        Он устанавливает код статуса и сообщение об ошибке.
-        """
-        if self.exception.args:
-            self.message = self.exception.args[0]
-        self.status_code = status.HTTP_400_BAD_REQUEST
-        message = self.exception.__class__.__name__
-        if ex := getattr(self.exception, "исключение", False):
-            message += f" реальное исключение={ex.args}"
+                logger.info(msg)
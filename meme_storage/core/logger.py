@@ -1,32 +1,49 @@
 import logging
 import sys
 
+from core.config import Settings
 from core.settings import LogSettings
 from loguru import logger
 
 
-def setup_logging() -> logging.Logger:
+def setup_logging(settings: LogSettings) -> logging.Logger:
     """Настройка логирования.
 
     В этом случае есть возможность использовать "logoru".
     https://github.com/Delgan/loguru
     """
-    settings = LogSettings()
     if settings.guru:
-        logger.configure(
-            **{
-                "handlers": [
-                    {
-                        "sink": sys.stderr,
-                        "level": settings.level,
-                        "backtrace": settings.traceback,
-                    },
-                ],
-            }
-        )
+        _configure_guru(settings)
         logger.info("Ведение журнала с использованием 'logoru'")
         return logger
-    logging.basicConfig(level=settings.log_level)
+    logging.basicConfig(level=settings.level)
     loger = logging.getLogger(__name__)
     logging.info("Ведение журнала с использованием logging.basicConfig")
     return loger
+
+
+def configure_logging(old: Settings, new: Settings):
+    """Применение уровня логирования после перечитывания настроек.
+
+    Выбор между "logoru" и logging делается только при старте.
+    """
+    if old.log == new.log:
+        return
+    if old.log.guru:
+        _configure_guru(new.log)
+    else:
+        logging.getLogger().setLevel(new.log.level)
+
+
+def _configure_guru(settings: LogSettings):
+    logger.configure(
+        **{
+            "handlers": [
+                {
+                    "sink": sys.stderr,
+                    "level": settings.level,
+                    "backtrace": settings.traceback,
+                },
+            ],
+        }
+    )
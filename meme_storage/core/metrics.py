@@ -0,0 +1,393 @@
+"""Метрики приложения в текстовом формате Prometheus.
+
+Метрики изменяются только из потока цикла событий, поэтому обходятся без
+блокировок: наблюдение - это поиск ряда в словаре и несколько сложений.
+Значения, которые проще посчитать в момент запроса метрик (статистика
+кэшей и пулов), задаются функциями и вычисляются при формировании ответа.
+"""
+
+import bisect
+import time
+from typing import Callable, Iterable, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DURATION_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+UNMATCHED_ROUTE = "<unmatched>"
+
+Labels = tuple[str, ...]
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    ]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """Метрика с набором меток.
+
+    Args:
+        name (str): Имя метрики.
+        documentation (str): Описание для строки `# HELP`.
+        labels (tuple[str, ...]): Имена меток.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Labels = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+    def samples(self) -> list[str]:
+        return []
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Labels = ()):
+        super().__init__(name, documentation, labels)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Labels = (), value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - value
+
+    def set(self, labels: Labels = (), value: float = 0):
+        self.values[labels] = value
+
+
+class CollectedMetric(Metric):
+    """Метрика, значения которой вычисляются при запросе метрик.
+
+    Args:
+        collect (Callable[[], dict[Labels, float]]): Значения по меткам.
+        kind (str): Тип метрики, "gauge" или "counter".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Labels,
+        collect: Callable[[], dict[Labels, float]],
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+            for labels, value in self.collect().items()
+        ]
+
+
+class Histogram(Metric):
+    """Гистограмма с накопительными корзинами, как в клиентах Prometheus.
+
+    Для каждого ряда хранится число наблюдений в каждой корзине без
+    накопления, сумма и количество. Накопительные значения считаются только
+    при формировании ответа.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Labels = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        self.values: dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float):
+        if (series := self.values.get(labels)) is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        bounds = [*map(_format_value, self.buckets), "+Inf"]
+        names = (*self.labels, "le")
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                label_text = _format_labels(names, (*labels, bound))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Metrics:
+    """Метрики приложения.
+
+    Attributes:
+        request_duration (Histogram): Длительность запроса по маршрутам,
+            от получения до отправки последнего байта ответа.
+        requests_in_flight (Gauge): Обрабатываемые сейчас запросы.
+        received_bytes (Counter): Байты тел запросов по маршрутам.
+        sent_bytes (Counter): Байты тел ответов по маршрутам.
+        s3_duration (Histogram): Длительность запросов к S3 по операциям,
+            до получения заголовков ответа.
+        s3_errors (Counter): Ошибки запросов к S3 по операциям и кодам.
+        s3_retries (Counter): Повторы запросов к S3 по операциям.
+        s3_hedges (Counter): Дублированные медленные запросы к S3.
+    """
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            "http_request_duration_seconds",
+            "HTTP request latency by route.",
+            ("method", "route", "status"),
+        )
+        self.requests_in_flight = Gauge(
+            "http_requests_in_flight", "HTTP requests being processed."
+        )
+        self.received_bytes = Counter(
+            "http_request_body_bytes_total", "Request body bytes.", ("route",)
+        )
+        self.sent_bytes = Counter(
+            "http_response_body_bytes_total", "Response body bytes.", ("route",)
+        )
+        self.s3_duration = Histogram(
+            "s3_request_duration_seconds",
+            "S3 request latency by operation.",
+            ("operation",),
+        )
+        self.s3_errors = Counter(
+            "s3_request_errors_total",
+            "Failed S3 requests by operation and error code.",
+            ("operation", "code"),
+        )
+        self.s3_retries = Counter(
+            "s3_request_retries_total", "Retried S3 requests.", ("operation",)
+        )
+        self.s3_hedges = Counter(
+            "s3_hedged_requests_total",
+            "Slow S3 requests sent a second time.",
+            ("operation",),
+        )
+        self._metrics: list[Metric] = [
+            self.request_duration,
+            self.requests_in_flight,
+            self.received_bytes,
+            self.sent_bytes,
+            self.s3_duration,
+            self.s3_errors,
+            self.s3_retries,
+            self.s3_hedges,
+        ]
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode()
+
+
+class MetricsMiddleware:
+    """Сбор метрик HTTP запросов и отдача метрик по `metrics_path`.
+
+    Маршрут в метках - шаблон пути из `scope["route"]`, который выставляет
+    маршрутизатор, поэтому число рядов не зависит от имён объектов.
+
+    Args:
+        app (ASGIApp): Следующее ASGI приложение.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        settings = scope["app"].config.metrics
+        metrics: Metrics = scope["app"].metrics
+        if not settings.metrics_enabled:
+            return await self.app(scope, receive, send)
+        if scope["path"] == settings.metrics_path and scope["method"] == "GET":
+            return await self.respond(metrics, send)
+
+        received = 0
+        sent = 0
+        status_code: Optional[int] = None
+
+        async def counted_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counted_send(message: Message):
+            nonlocal sent, status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        metrics.requests_in_flight.inc()
+        try:
+            await self.app(scope, counted_receive, counted_send)
+        finally:
+            metrics.requests_in_flight.dec()
+            route = getattr(scope.get("route"), "path_format", UNMATCHED_ROUTE)
+            metrics.request_duration.observe(
+                (scope["method"], route, str(status_code or 500)),
+                time.perf_counter() - start,
+            )
+            metrics.received_bytes.inc((route,), received)
+            metrics.sent_bytes.inc((route,), sent)
+
+    @staticmethod
+    async def respond(metrics: Metrics, send: Send):
+        body = metrics.render()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", CONTENT_TYPE.encode()),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def setup_metrics(app):
+    """Метрики приложения и статистика кэшей и пулов.
+
+    Args:
+        app: Приложение, хранилище которого уже настроено.
+    """
+    app.metrics = metrics = Metrics()
+    store = app.store
+    caches = {
+        "memory": store.memory_cache,
+        "disk": store.disk_cache,
+        "metadata": store.metadata_cache,
+    }
+    for stat, kind in (
+        ("entries", "gauge"),
+        ("bytes", "gauge"),
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+    ):
+        metrics.register(
+            CollectedMetric(
+                f"cache_{stat}_total" if kind == "counter" else f"cache_{stat}",
+                f"Object cache {stat} by tier.",
+                ("tier",),
+                lambda stat=stat: {
+                    (tier,): value
+                    for tier, cache in caches.items()
+                    if (value := cache.stats().get(stat)) is not None
+                },
+                kind,
+            )
+        )
+    metrics.register(
+        CollectedMetric(
+            "image_pool_workers",
+            "Worker processes of the image pool.",
+            (),
+            lambda: {(): store.images.settings.image_workers},
+        )
+    )
+    metrics.register(
+        CollectedMetric(
+            "image_pool_tasks",
+            "Image tasks submitted to the pool and not finished yet.",
+            (),
+            lambda: {(): store.images.tasks},
+        )
+    )
+    metrics.register(
+        CollectedMetric(
+            "image_phash_hashes",
+            "Perceptual hashes in the near-duplicate index.",
+            (),
+            lambda: {(): store.duplicates.count},
+        )
+    )
+    metrics.register(
+        CollectedMetric(
+            "s3_circuit_open",
+            "Whether S3 requests are rejected until the backend recovers.",
+            (),
+            lambda: {(): int(store.minio.circuit_open)},
+        )
+    )
+    metrics.register(
+        CollectedMetric(
+            "s3_download_flights",
+            "Shared S3 reads of concurrently downloaded objects.",
+            (),
+            lambda: {(): len(store.s3.flights)},
+        )
+    )
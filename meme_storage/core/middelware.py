@@ -1,68 +1,106 @@
-import re
+from typing import Optional
 
+from base.base_exception import ExceptionBase
 from core.app import Application
 from core.exception_handler import ExceptionHandler
-from core.settings import LogSettings
+from core.metrics import MetricsMiddleware
+from core.routing import RouteIndex
+from core.settings import FileSettings, LogSettings
 from fastapi import Request as FastApiRequest
-from fastapi import Response, status
+from fastapi import status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import HTTPException, RequestValidationError
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.types import ASGIApp
+from image.exceptions import FileTooLargeException
+from image.schemas import SIGNATURE_SIZE, check_signature
+from multipart.multipart import parse_options_header
+from starlette.datastructures import URL, Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+MULTIPART_OVERHEAD = 64 * 1024
+SNIFF_LIMIT = 64 * 1024
 
-class ErrorHandlingMiddleware(BaseHTTPMiddleware):
+
+def create_exception_handler(settings: LogSettings) -> ExceptionHandler:
+    return ExceptionHandler(
+        settings.level,
+        settings.traceback,
+        settings.traceback_limit,
+        settings.traceback_window,
+    )
+
+
+class LogSettingsMixin:
+    """Обработчик исключений по настройкам логирования приложения запроса.
+
+    Настройки читаются из `scope["app"].config` при каждом запросе, а
+    обработчик пересоздаётся, только когда перечитывание подменило снимок.
+    Подписываться на перечитывание middleware не нужно: Starlette может
+    создать стек middleware заново, и подписки старых экземпляров остались
+    бы в реестре настроек навсегда.
+    """
+
+    _log: Optional[LogSettings] = None
+    _exception_handler: Optional[ExceptionHandler] = None
+
+    def log_settings(self, scope: Scope) -> LogSettings:
+        return scope["app"].config.log
+
+    def exception_handler(self, scope: Scope) -> ExceptionHandler:
+        settings = self.log_settings(scope)
+        if settings is not self._log:
+            self._exception_handler = create_exception_handler(settings)
+            self._log = settings
+        return self._exception_handler
+
+
+class ErrorHandlingMiddleware(LogSettingsMixin):
     """Пользовательское промежуточное программное обеспечение
      для обработки исключений и ошибок в приложении Fast API.
 
+    Реализовано как ASGI middleware, а не через `BaseHTTPMiddleware`:
+    сообщения ответа уходят серверу напрямую, без промежуточной задачи и
+    потока в памяти, что важно для потоковой отдачи больших объектов.
+    Если исключение возникло, когда ответ уже начат, отправить ответ
+    с ошибкой нельзя, и исключение пробрасывается дальше.
+
     Args:
         app (ASGIApp): Экземпляр приложения Fast API.
 
     Attributes:
-        settings (LogSettings): Настройки логирования.
-        exception_handler (ExceptionHandler): Обработчик исключений.
+        routes (RouteIndex): Индекс маршрутов приложения.
     """
 
-    def __init__(self, app: ASGIApp, *args, **kwargs):
-        super().__init__(app, *args, **kwargs)
-        self.settings = LogSettings()
-        self.exception_handler = ExceptionHandler(
-            self.settings.level,
-            self.settings.traceback,
-        )
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.routes = RouteIndex()
 
-    async def dispatch(
-        self, request: FastApiRequest, call_next: RequestResponseEndpoint
-    ) -> Response:
-        """.
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        response_started = False
 
-        Args:
-            request (FastApiRequest): The incoming request.
-            call_next (RequestResponseEndpoint): The next middleware or the
-                application.
+        async def tracked_send(message: Message):
+            nonlocal response_started
+            response_started = True
+            await send(message)
 
-        Raises:
-            Exception: Any exception raised by the next middleware or the
-                application.
-
-        Returns:
-            Response: The response from the next middleware or the application.
-        """
+        request = FastApiRequest(scope)
         try:
             self.is_endpoint(request)
-            response = await call_next(request)
-            return response
+            await self.app(scope, receive, tracked_send)
         except Exception as error:
-            return self.exception_handler(
+            if response_started:
+                raise
+            response = self.exception_handler(scope)(
                 error,
                 request.url,
                 request.app.logger,
-                self.settings.traceback,
+                self.log_settings(scope).traceback,
             )
+            await response(scope, receive, send)
 
-    @staticmethod
-    def is_endpoint(request: FastApiRequest) -> bool:
+    def is_endpoint(self, request: FastApiRequest) -> bool:
         """Проверьте, является ли запрос конечной точкой.
 
         Args:
@@ -74,15 +112,15 @@ class ErrorHandlingMiddleware(BaseHTTPMiddleware):
         Returns:
             bool: True, если запрос является конечной точкой.
         """
+        status_code = self.routes.status(
+            request.app.routes, request.method, request.url.path
+        )
+        if status_code == status.HTTP_200_OK:
+            return True
         detail = "{message}, См. документацию: http://{host}:{port}{uri}"  # noqa
         message = "Не найдено"
-        status_code = status.HTTP_404_NOT_FOUND
-        for route in request.app.routes:
-            if re.match(route.path_regex, request.url.path):
-                if request.method.upper() in route.methods:
-                    return True
-                status_code = status.HTTP_405_METHOD_NOT_ALLOWED
-                message = "Метод не поддерживается"
+        if status_code == status.HTTP_405_METHOD_NOT_ALLOWED:
+            message = "Метод не поддерживается"
         raise HTTPException(
             status_code,
             detail.format(
@@ -94,6 +132,174 @@ class ErrorHandlingMiddleware(BaseHTTPMiddleware):
         )
 
 
+class MultipartSniffer:
+    """Поиск начала первого файла в теле multipart/form-data.
+
+    Тело накапливается, пока не найдено `SIGNATURE_SIZE` байт первой части
+    с `filename` в заголовках, но не больше `SNIFF_LIMIT` байт. Если файл
+    так и не найден, проверка остаётся за валидацией формы.
+
+    Args:
+        boundary (bytes): Разделитель частей из заголовка Content-Type.
+    """
+
+    def __init__(self, boundary: bytes):
+        self.delimiter = b"--" + boundary
+        self.buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> tuple[bool, Optional[bytes]]:
+        """Добавляет фрагмент тела.
+
+        Returns:
+            tuple[bool, Optional[bytes]]: Закончен ли поиск и начало файла,
+                если он найден.
+        """
+        self.buffer += chunk
+        position = self.buffer.find(self.delimiter)
+        while position != -1:
+            start = position + len(self.delimiter)
+            if self.buffer[start : start + 2] == b"--":
+                return True, None
+            headers_end = self.buffer.find(b"\r\n\r\n", start)
+            if headers_end == -1:
+                break
+            headers = bytes(self.buffer[start:headers_end]).lower()
+            content_start = headers_end + 4
+            position = self.buffer.find(b"\r\n" + self.delimiter, content_start)
+            if b"filename=" in headers:
+                end = len(self.buffer) if position == -1 else position
+                if position != -1 or end - content_start >= SIGNATURE_SIZE:
+                    head = bytes(self.buffer[content_start:end][:SIGNATURE_SIZE])
+                    return True, head
+                break
+            if position != -1:
+                position += 2
+        return len(self.buffer) > SNIFF_LIMIT, None
+
+
+class UploadGuardMiddleware(LogSettingsMixin):
+    """Отклонение неподходящих загрузок до того, как тело прочитано целиком.
+
+    Для запросов на загрузку проверяется Content-Length, а затем по мере
+    поступления тела - его размер и сигнатура файла по первым байтам.
+    Нарушение сразу завершает запрос ответом 413 или 415, приложение
+    при этом получает `http.disconnect`, а его собственный ответ
+    отбрасывается. Для multipart к лимиту добавляется `MULTIPART_OVERHEAD`
+    на заголовки частей и поля формы, точный размер файла проверяет
+    обработчик формы. Лимиты берутся из настроек приложения запроса,
+    `scope["app"].config`.
+
+    Args:
+        app (ASGIApp): Следующее ASGI приложение.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.routes = RouteIndex()
+
+    @staticmethod
+    def limits(settings: FileSettings) -> dict[str, tuple[int, bool]]:
+        """Максимальный размер тела и нужна ли проверка сигнатуры.
+
+        Ключ - шаблон пути маршрута, который обработает запрос, так что
+        лимит выбирается так же, как маршрутизатор выбирает обработчик.
+        Пакетная загрузка проверяет каждый файл сама, поэтому для неё
+        проверяется только размер.
+        """
+        return {
+            "/upload": (settings.size, True),
+            "/upload/batch": (settings.upload_batch_size, False),
+            "/upload/{bucket}/{object_name}": (settings.size, True),
+            "/update/{bucket}/{object_name}": (settings.size, True),
+        }
+
+    def limit(
+        self, settings: FileSettings, scope: Scope
+    ) -> Optional[tuple[int, bool]]:
+        route = self.routes.match(scope["app"].routes, scope["method"], scope["path"])
+        if route is None:
+            return None
+        return self.limits(settings).get(route.path_format)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+        settings = scope["app"].config.file
+        if (guard := self.limit(settings, scope)) is None:
+            return await self.app(scope, receive, send)
+        limit, sniffing = guard
+        headers = Headers(scope=scope)
+        sniffer = None
+        content_type, options = parse_options_header(
+            headers.get("content-type", "")
+        )
+        if content_type == b"multipart/form-data" and b"boundary" in options:
+            limit += MULTIPART_OVERHEAD
+            sniffer = MultipartSniffer(options[b"boundary"])
+        content_length = headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > limit:
+            return await self.reject(FileTooLargeException(), scope, send)
+
+        received = 0
+        head = bytearray()
+        rejected = False
+        response_started = False
+
+        async def guarded_receive() -> Message:
+            nonlocal received, sniffing, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            body = message.get("body", b"")
+            received += len(body)
+            try:
+                if received > limit:
+                    raise FileTooLargeException()
+                if sniffing:
+                    if sniffer is not None:
+                        done, file_head = sniffer.feed(body)
+                    else:
+                        head.extend(body)
+                        file_head = bytes(head[:SIGNATURE_SIZE])
+                        more = message.get("more_body", False)
+                        done = len(head) >= SIGNATURE_SIZE or not more
+                    if done:
+                        sniffing = False
+                        if file_head is not None:
+                            check_signature(file_head)
+            except ExceptionBase as error:
+                rejected = True
+                if not response_started:
+                    await self.reject(error, scope, send)
+                return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message: Message):
+            nonlocal response_started
+            if rejected:
+                return
+            response_started = True
+            await send(message)
+
+        await self.app(scope, guarded_receive, guarded_send)
+
+    async def reject(self, error: ExceptionBase, scope: Scope, send: Send):
+        response = self.exception_handler(scope)(
+            error,
+            URL(scope=scope),
+            scope["app"].logger,
+            self.log_settings(scope).traceback,
+        )
+        response.headers["Connection"] = "close"
+        await response(scope, self._disconnected, send)
+
+    @staticmethod
+    async def _disconnected() -> Message:
+        return {"type": "http.disconnect"}
+
+
 async def validation_exception_handler(
     _: FastApiRequest, exc: RequestValidationError
 ) -> JSONResponse:
@@ -125,3 +331,5 @@ def setup_middleware(app: Application):
     """
     app.exception_handler(RequestValidationError)(validation_exception_handler)
     app.add_middleware(ErrorHandlingMiddleware)
+    app.add_middleware(UploadGuardMiddleware)
+    app.add_middleware(MetricsMiddleware)
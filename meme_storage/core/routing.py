@@ -0,0 +1,117 @@
+"""Индекс маршрутов приложения для быстрой проверки пути и метода."""
+
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+from fastapi import status
+from starlette.routing import BaseRoute
+
+
+@dataclass(slots=True)
+class _Node:
+    static: dict[str, "_Node"] = field(default_factory=dict)
+    param: Optional["_Node"] = None
+    routes: list[BaseRoute] = field(default_factory=list)
+    tail: list[BaseRoute] = field(default_factory=list)
+
+
+class RouteIndex:
+    """Дерево сегментов пути, построенное по шаблонам маршрутов.
+
+    Статические сегменты шаблона ищутся по словарю, параметр `{name}`
+    совпадает с любым сегментом, а параметр `{name:path}` - с любым
+    остатком пути. Так поиск перебирает только маршруты, подходящие по
+    форме пути, а не все маршруты приложения. Окончательно путь проверяется
+    регулярным выражением маршрута, поэтому конвертеры параметров и
+    сегменты вида `file.{ext}` работают так же, как в маршрутизаторе.
+
+    Индекс перестраивается, если список маршрутов приложения заменён
+    или изменилась его длина.
+    """
+
+    def __init__(self):
+        self._key: Optional[tuple[int, int]] = None
+        self._root = _Node()
+        self._order: dict[int, int] = {}
+
+    def status(self, routes: Sequence[BaseRoute], method: str, path: str) -> int:
+        """Статус, который маршрутизатор вернёт на запрос.
+
+        Args:
+            routes (Sequence[BaseRoute]): Маршруты приложения.
+            method (str): Метод запроса.
+            path (str): Путь запроса.
+
+        Returns:
+            int: 200, если маршрут найден, 405, если путь есть, но метод
+                не поддерживается, иначе 404.
+        """
+        if self.match(routes, method, path) is not None:
+            return status.HTTP_200_OK
+        if self._candidates(path, None):
+            return status.HTTP_405_METHOD_NOT_ALLOWED
+        return status.HTTP_404_NOT_FOUND
+
+    def match(
+        self, routes: Sequence[BaseRoute], method: str, path: str
+    ) -> Optional[BaseRoute]:
+        """Маршрут, который обработает запрос.
+
+        Как и маршрутизатор, из подходящих маршрутов выбирается объявленный
+        первым, поэтому `/upload/batch/x` достаётся `/upload/{bucket}/{name}`,
+        а не `/upload/batch`.
+
+        Returns:
+            Optional[BaseRoute]: Маршрут или None, если путь и метод
+                не подходят ни к одному маршруту.
+        """
+        if self._key != (id(routes), len(routes)):
+            self._build(routes)
+        found = self._candidates(path, method.upper())
+        return min(found, key=lambda route: self._order[id(route)], default=None)
+
+    def _build(self, routes: Sequence[BaseRoute]):
+        root = _Node()
+        self._order = {id(route): order for order, route in enumerate(routes)}
+        for route in routes:
+            if getattr(route, "methods", None) is None:
+                continue
+            node = root
+            for segment in route.path.strip("/").split("/"):
+                if ":path}" in segment:
+                    node.tail.append(route)
+                    break
+                if "{" in segment:
+                    node.param = node.param or _Node()
+                    node = node.param
+                else:
+                    node = node.static.setdefault(segment, _Node())
+            else:
+                node.routes.append(route)
+        self._root = root
+        self._key = (id(routes), len(routes))
+
+    def _candidates(self, path: str, method: Optional[str]) -> list[BaseRoute]:
+        """Маршруты, которые совпадают с путём и принимают метод.
+
+        Если метод не задан, подходят маршруты с любым методом.
+        """
+        segments = path.strip("/").split("/")
+        found: list[BaseRoute] = []
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            found.extend(node.tail)
+            if depth == len(segments):
+                found.extend(node.routes)
+                continue
+            if (child := node.static.get(segments[depth])) is not None:
+                stack.append((child, depth + 1))
+            if node.param is not None:
+                stack.append((node.param, depth + 1))
+        return [
+            route
+            for route in found
+            if (method is None or method in route.methods)
+            and route.path_regex.match(path)
+        ]
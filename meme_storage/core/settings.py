@@ -1,6 +1,8 @@
 """Все настройки приложения."""
 
 import os
+import tempfile
+from typing import Optional
 
 from base.base_helper import LOG_LEVEL
 from pydantic import field_validator
@@ -59,6 +61,8 @@ class AppSettings(Base):
         docs_url (str): The URL for the application's documentation.
         redoc_url (str): The URL for the application's redoc.
         openapi_url (str): The URL for the application's openapi.json.
+        config_reload_interval (float): How often `.env` is checked for
+            changes in seconds, 0 - only on SIGHUP.
     """
 
     title: str = "Image Store"
@@ -74,6 +78,7 @@ class AppSettings(Base):
 
     app_host: str = "0.0.0.0"
     app_port: int = 8005
+    config_reload_interval: float = 5.0
 
     @property
     def base_url(self) -> str:
@@ -91,22 +96,252 @@ class LogSettings(Base):
     level (str, optional): The level of logging. Defaults to "INFO".
     guru (bool, optional): Whether to enable guru mode. Defaults to True.
     traceback (bool, optional): Whether to include tracebacks in logs. Defaults to True.
+    traceback_limit (int, optional): Tracebacks logged per exception class
+        in a window. Defaults to 10.
+    traceback_window (float, optional): Window length in seconds. Defaults to 60.
     """
 
     level: LOG_LEVEL
     guru: bool
     traceback: bool
+    traceback_limit: int = 10
+    traceback_window: float = 60.0
 
 
 class FileSettings(Base):
+    """Settings for uploaded files.
+
+    Args:
+        size (int): Maximum size of an uploaded file in bytes.
+        upload_part_size (int): Multipart upload part size, at least 5 MiB.
+        upload_parts_in_flight (int): Parts uploaded to S3 concurrently.
+        upload_batch_size (int): Maximum body size of a batch upload.
+        upload_batch_concurrency (int): Files of one batch uploaded
+            to S3 concurrently.
+        upload_dedup (bool): Store each distinct content once under its
+            SHA-256 and keep object names as references to it. Only affects
+            new uploads: existing references are followed either way.
+        upload_dedup_blob_prefix (str): Key prefix of deduplicated contents.
+        upload_dedup_ref_prefix (str): Key prefix of reference markers.
+    """
+
     size: int = 1024 * 1024 * 1
+    upload_part_size: int = 5 * 1024 * 1024
+    upload_parts_in_flight: int = 4
+    upload_batch_size: int = 256 * 1024 * 1024
+    upload_batch_concurrency: int = 8
+    upload_dedup: bool = False
+    upload_dedup_blob_prefix: str = "_blobs"
+    upload_dedup_ref_prefix: str = "_refs"
+
+
+class DownloadSettings(Base):
+    """Settings for serving objects.
+
+    Args:
+        download_cache_control (str): Cache-Control header sent with objects.
+        download_coalescing (bool): Share one S3 read between concurrent
+            downloads of the same object.
+        download_coalescing_replay_bytes (int): Head of the object kept so that
+            late requests can still join a shared read.
+        download_coalescing_queue_size (int): Chunks a client may lag behind
+            before it falls back to its own read.
+        download_archive_read_ahead (int): Objects opened ahead of the one
+            being written into a ZIP archive.
+        download_redirect_buckets (list[str]): Buckets whose objects are
+            served by a redirect to a presigned S3 URL instead of through
+            the service.
+        download_redirect_expires (int): Lifetime of presigned URLs in seconds,
+            at most 7 days.
+        download_redirect_margin (int): A cached URL is replaced when fewer
+            seconds than this remain before it expires.
+        download_redirect_host (Optional[str]): S3 address clients are
+            redirected to, e.g. "https://s3.example.com", if it differs
+            from `minio_endpoint`.
+    """
+
+    download_cache_control: str = "public, max-age=86400"
+    download_coalescing: bool = True
+    download_coalescing_replay_bytes: int = 1024 * 1024
+    download_coalescing_queue_size: int = 32
+    download_archive_read_ahead: int = 4
+    download_redirect_buckets: list[str] = []
+    download_redirect_expires: int = 3600
+    download_redirect_margin: int = 300
+    download_redirect_host: Optional[str] = None
+
+
+class CacheSettings(Base):
+    """Settings for the object cache tiers.
+
+    Args:
+        memory_cache_enabled (bool): Whether to keep hot objects in memory.
+        memory_cache_max_bytes (int): Total memory budget of the cache.
+        memory_cache_max_object_size (int): Larger objects are never cached.
+        disk_cache_enabled (bool): Whether to keep objects on the local disk.
+        disk_cache_path (str): Directory of the disk cache.
+        disk_cache_max_bytes (int): Total disk budget of the cache.
+        disk_cache_max_object_size (int): Larger objects are never cached.
+        metadata_cache_enabled (bool): Whether to keep object metadata
+            in memory.
+        metadata_cache_ttl (float): Lifetime of cached metadata in seconds.
+        metadata_cache_negative_ttl (float): How long a missing object is
+            remembered in seconds.
+        metadata_cache_max_entries (int): Most objects the cache holds.
+    """
+
+    memory_cache_enabled: bool = False
+    memory_cache_max_bytes: int = 64 * 1024 * 1024
+    memory_cache_max_object_size: int = 1024 * 1024
+    disk_cache_enabled: bool = False
+    disk_cache_path: str = os.path.join(tempfile.gettempdir(), "meme_storage")
+    disk_cache_max_bytes: int = 1024 * 1024 * 1024
+    disk_cache_max_object_size: int = 64 * 1024 * 1024
+    metadata_cache_enabled: bool = False
+    metadata_cache_ttl: float = 5.0
+    metadata_cache_negative_ttl: float = 1.0
+    metadata_cache_max_entries: int = 100_000
+
+
+class ImageSettings(Base):
+    """Settings for image processing.
+
+    Images are decoded and encoded in a process pool so that the event loop
+    is never blocked by CPU-bound work.
+
+    Args:
+        image_workers (int): Worker processes of the pool.
+        image_max_dimension (int): Largest width or height of a variant.
+        image_default_quality (int): JPEG quality of variants by default.
+        image_variant_sizes (list[int]): Widths and heights variants are
+            rendered at. A requested side is rounded up to the nearest of
+            them, or to `image_max_dimension` above the largest, so that
+            only a bounded set of variants can be rendered and stored.
+        image_variant_qualities (list[int]): JPEG qualities variants and
+            memes are rendered at. A requested quality is rounded to the
+            nearest of them.
+        image_variant_prefix (str): Prefix of keys variants are stored under.
+            Keys include the version of the original, so variants of
+            overwritten originals are left behind for a bucket lifecycle
+            rule to expire.
+        image_meme_prefix (str): Prefix of keys rendered memes are stored under.
+            Keys include the version of the template, as variant keys do.
+        image_meme_font (Optional[str]): TrueType font of captions,
+            Pillow's bundled font if not set.
+        image_meme_max_text (int): Longest caption in characters.
+        image_meme_max_per_template (int): Most memes stored for one
+            template, new captions are rejected once it is reached.
+            Concurrent renders may exceed it slightly. 0 - no limit.
+        image_phash_enabled (bool): Whether to index perceptual hashes of
+            uploaded images to find near-duplicates. Streamed and batch
+            uploads are then spooled whole before they are written, so
+            that they are hashed and checked like form uploads.
+        image_phash_path (str): Directory of the perceptual hash index.
+        image_phash_distance (int): Most differing bits of the hashes of
+            near-duplicates by default.
+        image_phash_reject (bool): Whether to reject uploads of images that
+            have a near-duplicate in the index.
+    """
+
+    image_workers: int = 2
+    image_max_dimension: int = 2048
+    image_default_quality: int = 80
+    image_variant_sizes: list[int] = [64, 128, 256, 512, 1024, 2048]
+    image_variant_qualities: list[int] = [60, 80, 95]
+    image_variant_prefix: str = "_variants"
+    image_meme_prefix: str = "_memes"
+    image_meme_font: Optional[str] = None
+    image_meme_max_text: int = 200
+    image_meme_max_per_template: int = 1000
+    image_phash_enabled: bool = False
+    image_phash_path: str = os.path.join(tempfile.gettempdir(), "meme_storage_phash")
+    image_phash_distance: int = 8
+    image_phash_reject: bool = False
+
+
+class IndexSettings(Base):
+    """Settings for the local index objects are listed from.
+
+    Args:
+        index_enabled (bool): Whether to keep the index and serve listings.
+        index_path (str): SQLite database file of the index.
+        index_page_size (int): Objects per listing page by default.
+        index_max_page_size (int): Most objects per listing page.
+        index_reconcile_interval (float): Pause between listing pages of
+            the bucket while the index is resynced, in seconds.
+        index_reconcile_pass_interval (float): Pause between full resyncs
+            of a bucket in seconds.
+    """
+
+    index_enabled: bool = False
+    index_path: str = os.path.join(tempfile.gettempdir(), "meme_storage.sqlite3")
+    index_page_size: int = 100
+    index_max_page_size: int = 1000
+    index_reconcile_interval: float = 1.0
+    index_reconcile_pass_interval: float = 300.0
+
+
+class MetricsSettings(Base):
+    """Settings for the metrics endpoint.
+
+    Args:
+        metrics_enabled (bool): Whether to collect and serve metrics.
+        metrics_path (str): Path metrics are served on in Prometheus
+            text format.
+    """
+
+    metrics_enabled: bool = True
+    metrics_path: str = "/metrics"
 
 
 class MinioSettings(Base):
-    """Settings for Minio database connections."""
+    """Settings for Minio database connections.
+
+    The connection pool is created once per application and shared by all
+    S3 operations.
+
+    Args:
+        minio_pool_limit (int): Total number of simultaneous connections.
+        minio_pool_limit_per_host (int): Connections per host, 0 - no limit.
+        minio_keepalive_timeout (float): Idle keep-alive time in seconds.
+        minio_dns_cache_ttl (int): DNS cache TTL in seconds.
+        minio_secure (bool): Connect to the endpoint over HTTPS.
+        minio_connect_timeout (float): TCP connect timeout in seconds.
+        minio_read_timeout (float): Longest wait for data from S3 in seconds.
+        minio_retries (int): Retries of idempotent requests that failed with
+            a network error or 5xx response.
+        minio_retry_backoff (float): Upper bound of the first retry delay
+            in seconds, doubled on each retry.
+        minio_retry_backoff_max (float): Largest retry delay in seconds.
+        minio_breaker_threshold (int): Failed requests in a row that open
+            the circuit, 0 - never open it.
+        minio_breaker_reset_timeout (float): Seconds the circuit stays open
+            before a trial request.
+        minio_hedge_reads (bool): Send a second GetObject when the first
+            one is slower than usual.
+        minio_hedge_quantile (float): Quantile of recent GetObject latencies
+            after which the second request is sent.
+        minio_hedge_min_delay (float): Shortest delay before the second
+            request in seconds.
+    """
 
     minio_endpoint: str = "play.min.io"
     minio_access_key: str = "Q3AM3UQ867SPQQA43P2F"
     minio_secret_key: str = "zuf+tfteSlswRu7BJ86wekitnifILbZam1KYY3TG"
     minio_port: int = 9000
     minio_buckets: list[str] = ["helloworld"]
+    minio_pool_limit: int = 100
+    minio_pool_limit_per_host: int = 0
+    minio_keepalive_timeout: float = 30.0
+    minio_dns_cache_ttl: int = 300
+    minio_secure: bool = True
+    minio_connect_timeout: float = 5.0
+    minio_read_timeout: float = 60.0
+    minio_retries: int = 2
+    minio_retry_backoff: float = 0.05
+    minio_retry_backoff_max: float = 1.0
+    minio_breaker_threshold: int = 5
+    minio_breaker_reset_timeout: float = 10.0
+    minio_hedge_reads: bool = False
+    minio_hedge_quantile: float = 0.95
+    minio_hedge_min_delay: float = 0.01
@@ -1,10 +1,13 @@
 """Модуль для настройки приложения."""
 
+import functools
+
 from core.app import Application
-from core.logger import setup_logging
+from core.config import Config
+from core.logger import configure_logging, setup_logging
+from core.metrics import setup_metrics
 from core.middelware import setup_middleware
 from core.routes import setup_routes
-from core.settings import AppSettings
 from store.store import setup_store
 
 
@@ -14,7 +17,8 @@ def setup_app(*_, **__) -> "Application":
     Returns:
         Application: Основное FastAPI приложение.
     """
-    settings = AppSettings()
+    config = Config()
+    settings = config.app
     app = Application(
         docs_url=settings.docs_url,
         redoc_url=settings.redoc_url,
@@ -23,9 +27,14 @@ def setup_app(*_, **__) -> "Application":
         title=settings.title,
         description=settings.description,
     )
-    app.settings = settings
-    app.logger = setup_logging()
+    app.config = config
+    app.logger = setup_logging(config.log)
+    config.subscribe(configure_logging)
+    app.on_event("startup")(functools.partial(config.start, app.logger))
+    app.on_event("shutdown")(config.stop)
+    app.on_event("shutdown")(functools.partial(config.unsubscribe, configure_logging))
     setup_store(app)
+    setup_metrics(app)
     setup_middleware(app)
     setup_routes(app)
     app.logger.info(f"Swagger link: {app.settings.base_url}{app.docs_url}")
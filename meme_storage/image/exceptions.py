@@ -0,0 +1,16 @@
+from base.base_exception import ExceptionBase
+from starlette import status
+
+
+class FileTooLargeException(ExceptionBase):
+    args = ("Размер файла превышает допустимый.",)
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
+class UnsupportedFileTypeException(ExceptionBase):
+    args = ("Неподдерживаемый тип файла. Поддерживаемые типы: jpg.",)
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+class MultipartParseException(ExceptionBase):
+    args = ("Некорректное тело запроса multipart/form-data.",)
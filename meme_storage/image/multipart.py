@@ -0,0 +1,139 @@
+"""Потоковый разбор тела multipart/form-data."""
+
+import asyncio
+from typing import AsyncIterator, Optional, Union
+
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+from .exceptions import MultipartParseException
+
+QUEUE_SIZE = 16
+_ABORTED = object()
+
+
+class FilePart:
+    """Файл из тела multipart/form-data.
+
+    Содержимое передаётся через ограниченную очередь, поэтому разбор тела
+    ждёт, пока потребитель не заберёт уже прочитанное. Если потребитель
+    прекратил чтение, остаток файла пропускается. Если тело запроса
+    оборвалось посреди файла, чтение содержимого завершается ошибкой.
+
+    Attributes:
+        filename (str): Имя файла из заголовка Content-Disposition.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.discarded = False
+        self._queue: asyncio.Queue[Union[bytes, object]] = asyncio.Queue(QUEUE_SIZE)
+
+    async def put(self, data: Optional[bytes]):
+        if not self.discarded:
+            await self._queue.put(data)
+
+    def abort(self):
+        self._drain()
+        self._queue.put_nowait(_ABORTED)
+
+    async def content(self) -> AsyncIterator[bytes]:
+        try:
+            while (chunk := await self._queue.get()) is not None:
+                if chunk is _ABORTED:
+                    raise MultipartParseException()
+                yield chunk
+        finally:
+            self._drain()
+
+    def _drain(self):
+        self.discarded = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+
+class MultipartReader:
+    """Разбор тела multipart/form-data по мере его поступления.
+
+    В отличие от `Request.form()` файлы не сохраняются во временные файлы,
+    а отдаются потребителю сразу, как только пришли заголовки части.
+    Части без имени файла пропускаются.
+
+    Args:
+        content_type (str): Значение заголовка Content-Type.
+        stream (AsyncIterator[bytes]): Тело запроса.
+
+    Raises:
+        MultipartParseException: Тело не является multipart/form-data.
+    """
+
+    def __init__(self, content_type: str, stream: AsyncIterator[bytes]):
+        media_type, options = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or b"boundary" not in options:
+            raise MultipartParseException()
+        self._stream = stream
+        self._events: list[tuple[str, bytes]] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._parser = MultipartParser(
+            options[b"boundary"],
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    async def files(self) -> AsyncIterator[FilePart]:
+        """Файлы в порядке их следования в теле запроса."""
+        part: Optional[FilePart] = None
+        try:
+            async for chunk in self._stream:
+                self._parser.write(chunk)
+                for event, data in self._events:
+                    if event == "file":
+                        part = FilePart(data.decode())
+                        yield part
+                    elif part is not None and event == "data":
+                        await part.put(data)
+                    elif part is not None and event == "end":
+                        await part.put(None)
+                        part = None
+                self._events.clear()
+            self._parser.finalize()
+        except MultipartParseError as e:
+            raise MultipartParseException(exception=e)
+        finally:
+            if part is not None:
+                part.abort()
+
+    def _on_part_begin(self):
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if filename := options.get(b"filename"):
+            self._events.append(("file", filename))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self._events.append(("data", data[start:end]))
+
+    def _on_part_end(self):
+        self._events.append(("end", b""))
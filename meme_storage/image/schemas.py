@@ -1,14 +1,20 @@
-from typing import Any, Callable, Type
+import contextlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Optional, Type
 
 import filetype
-from core.settings import FileSettings
 from fastapi import File
-from pydantic import BaseModel, GetJsonSchemaHandler
+from pydantic import BaseModel, GetJsonSchemaHandler, model_validator
 from pydantic.json_schema import JsonSchemaValue
 from pydantic_core import CoreSchema
 from pydantic_core.core_schema import with_info_plain_validator_function
 from starlette.datastructures import UploadFile
 
+from .exceptions import FileTooLargeException, UnsupportedFileTypeException
+
+SIGNATURE_SIZE = 261
+SUPPORTED_EXTENSIONS = ["jpg"]
+
 
 class UploadFileSchema(UploadFile):
     """Pydantic модель для проверки и разбора загружаемого входящего файла.
@@ -31,8 +37,10 @@ class UploadFileSchema(UploadFile):
 
             1. входящий файл является экземпляром
                starlette.datastructures.UploadFile.
-            2. Размер файла не превышает максимальное значение.
-            3. Тип файла поддерживается.
+            2. Тип файла поддерживается.
+
+        Размер файла зависит от настроек приложения и проверяется
+        в обработчике, см. `check_file_size`.
 
         Args:
             file (File): Входящий файл.
@@ -51,11 +59,6 @@ class UploadFileSchema(UploadFile):
                 f"Использован неподдерживаемый тип UploadFile, получен: {type(file)}"
             )
 
-        file_size = FileSettings().size
-        if file.size > file_size:
-            max_size = file_size // 1024 // 1024
-            raise ValueError(f"Размер файла не должен превышать {max_size} MB")
-
         if type_file := filetype.guess(file.file):
             if type_file.extension in ["jpg"]:
                 return file
@@ -98,6 +101,174 @@ class UploadFileSchema(UploadFile):
         return with_info_plain_validator_function(cls.validate)
 
 
+def check_file_size(file: UploadFile, max_size: int):
+    """Проверка размера файла, полученного формой.
+
+    Raises:
+        FileTooLargeException: Размер файла превышает максимальный.
+    """
+    if file.size is None or file.size > max_size:
+        raise FileTooLargeException()
+
+
+async def validate_stream(
+    content: AsyncIterator[bytes], max_size: int
+) -> AsyncIterator[bytes]:
+    """Проверка загружаемого файла, поступающего потоком.
+
+    Тип файла определяется по первым байтам, поэтому они накапливаются
+    до проверки и только после неё передаются дальше. Размер проверяется
+    по мере чтения, так что слишком большой файл отклоняется, не будучи
+    прочитанным целиком.
+
+    Args:
+        content (AsyncIterator[bytes]): Тело запроса.
+        max_size (int): Максимальный размер файла в байтах.
+
+    Returns:
+        AsyncIterator[bytes]: То же содержимое.
+
+    Raises:
+        FileTooLargeException: Размер файла превышает максимальный.
+        UnsupportedFileTypeException: Тип файла не поддерживается.
+    """
+    head: Optional[bytearray] = bytearray()
+    size = 0
+    async with contextlib.aclosing(content):
+        async for chunk in content:
+            size += len(chunk)
+            if size > max_size:
+                raise FileTooLargeException()
+            if head is None:
+                yield chunk
+                continue
+            head += chunk
+            if len(head) >= SIGNATURE_SIZE:
+                check_signature(head)
+                yield bytes(head)
+                head = None
+    if head is not None:
+        check_signature(head)
+        yield bytes(head)
+
+
+def check_signature(head: bytes):
+    """Проверка типа файла по его первым `SIGNATURE_SIZE` байтам.
+
+    Raises:
+        UnsupportedFileTypeException: Тип файла не поддерживается.
+    """
+    type_file = filetype.guess(bytes(head))
+    if type_file is None or type_file.extension not in SUPPORTED_EXTENSIONS:
+        raise UnsupportedFileTypeException()
+
+
+class ObjectResultSchema(BaseModel):
+    """
+    Pydantic модель результата операции над одним объектом из пакета.
+
+    Attributes:
+        object_name (str): Имя объекта.
+        status (str): Статус загрузки.
+        message (str): Сообщение о статусе.
+    """
+
+    object_name: str
+    status: str
+    message: str
+
+
+class BatchUploadSchema(BaseModel):
+    """
+    Pydantic модель ответа на пакетную загрузку.
+
+    Attributes:
+        results (list[ObjectResultSchema]): Результаты по каждому файлу
+            в порядке их следования в запросе.
+    """
+
+    results: list[ObjectResultSchema]
+
+
+class ObjectSelectionSchema(BaseModel):
+    """
+    Pydantic модель выбора объектов для пакетной операции.
+
+    Должен быть задан ровно один из параметров.
+
+    Attributes:
+        object_names (Optional[list[str]]): Имена удаляемых объектов.
+        prefix (Optional[str]): Префикс имён удаляемых объектов.
+    """
+
+    object_names: Optional[list[str]] = None
+    prefix: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_target(self) -> "ObjectSelectionSchema":
+        if (self.object_names is None) == (self.prefix is None):
+            raise ValueError("Необходимо указать либо object_names, либо prefix.")
+        return self
+
+
+class DuplicateSchema(BaseModel):
+    """
+    Pydantic модель похожего изображения.
+
+    Attributes:
+        bucket (str): Имя бакета.
+        object_name (str): Имя объекта.
+        distance (int): Число различающихся бит перцептивных хэшей.
+    """
+
+    bucket: str
+    object_name: str
+    distance: int
+
+
+class DuplicatesSchema(BaseModel):
+    """
+    Pydantic модель результата поиска похожих изображений.
+
+    Attributes:
+        phash (str): Перцептивный хэш изображения, 16 шестнадцатеричных цифр.
+        duplicates (list[DuplicateSchema]): Похожие изображения от самых
+            близких к самым далёким.
+    """
+
+    phash: str
+    duplicates: list[DuplicateSchema]
+
+
+class ObjectInfoSchema(BaseModel):
+    """
+    Pydantic модель объекта в списке объектов бакета.
+
+    Attributes:
+        object_name (str): Имя объекта.
+        size (int): Размер объекта в байтах.
+        uploaded (datetime): Время загрузки объекта.
+    """
+
+    object_name: str
+    size: int
+    uploaded: datetime
+
+
+class ObjectListSchema(BaseModel):
+    """
+    Pydantic модель страницы списка объектов бакета.
+
+    Attributes:
+        objects (list[ObjectInfoSchema]): Объекты страницы.
+        next_cursor (Optional[str]): Курсор следующей страницы или None,
+            если страница последняя.
+    """
+
+    objects: list[ObjectInfoSchema]
+    next_cursor: Optional[str] = None
+
+
 class OkSchema(BaseModel):
     """
     Pydantic модель для возврата ответа о статусе "успешно".
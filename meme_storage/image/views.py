@@ -1,14 +1,57 @@
-from typing import Any
+from typing import Any, AsyncIterator, Literal, Optional
 from uuid import uuid4
 
+from base.base_exception import ExceptionBase
+from base.base_helper import HTTP_EXCEPTION
 from core.app import Request
 from fastapi import APIRouter, Form
+from starlette.responses import StreamingResponse
+from store.images.duplicates import Duplicate
 
-from .schemas import OkSchema, UploadFileSchema
+from .multipart import MultipartReader
+from .schemas import (
+    BatchUploadSchema,
+    DuplicateSchema,
+    DuplicatesSchema,
+    ObjectInfoSchema,
+    ObjectListSchema,
+    ObjectResultSchema,
+    ObjectSelectionSchema,
+    OkSchema,
+    UploadFileSchema,
+    check_file_size,
+    validate_stream,
+)
 
 image_route = APIRouter()
 
 
+def object_result(
+    object_name: str, error: Optional[ExceptionBase]
+) -> ObjectResultSchema:
+    """Результат операции над одним объектом из пакета."""
+    if error is None:
+        return ObjectResultSchema(object_name=object_name, **OkSchema().model_dump())
+    return ObjectResultSchema(
+        object_name=object_name,
+        status=HTTP_EXCEPTION.get(error.status_code),
+        message=error.args[0],
+    )
+
+
+def duplicates_result(value: int, duplicates: list[Duplicate]) -> DuplicatesSchema:
+    """Ответ поиска похожих изображений."""
+    return DuplicatesSchema(
+        phash=f"{value:016x}",
+        duplicates=[
+            DuplicateSchema(
+                bucket=item.bucket, object_name=item.name, distance=item.distance
+            )
+            for item in duplicates
+        ],
+    )
+
+
 @image_route.post(
     "/upload",
     response_model=OkSchema,
@@ -19,14 +62,154 @@ async def upload_image(
         bucket: str = Form(),
         object_name: str = Form(),
 ) -> Any:
-    print(bucket, object_name, file)
+    check_file_size(file, request.app.config.file.size)
     await request.app.store.s3.upload(bucket, object_name, file)
     return OkSchema()
 
 
+@image_route.post(
+    "/upload/batch",
+    response_model=BatchUploadSchema,
+)
+async def upload_image_batch(request: "Request", bucket: str) -> Any:
+    s3 = request.app.store.s3
+    reader = MultipartReader(
+        request.headers.get("content-type", ""), request.stream()
+    )
+
+    async def files():
+        async for part in reader.files():
+            yield part.filename, validate_stream(
+                part.content(), s3.file_settings.size
+            )
+
+    results = await s3.upload_batch(bucket, files())
+    return BatchUploadSchema(results=[object_result(*result) for result in results])
+
+
+@image_route.post(
+    "/upload/{bucket}/{object_name}",
+    response_model=OkSchema,
+)
+async def upload_image_stream(
+        request: "Request",
+        bucket: str,
+        object_name: str,
+) -> Any:
+    s3 = request.app.store.s3
+    content = validate_stream(request.stream(), s3.file_settings.size)
+    await s3.upload_stream(bucket, object_name, content)
+    return OkSchema()
+
+
 @image_route.get("/download/{bucket}/{object_name}")
-async def download(request: "Request", bucket: str, object_name: str) -> Any:
-    return await request.app.store.s3.download(bucket, object_name)
+async def download(
+        request: "Request",
+        bucket: str,
+        object_name: str,
+        redirect: bool = True,
+) -> Any:
+    return await request.app.store.s3.download(
+        bucket, object_name, request.headers, redirect
+    )
+
+
+@image_route.get(
+    "/list/{bucket}",
+    response_model=ObjectListSchema,
+)
+async def list_objects(
+        request: "Request",
+        bucket: str,
+        prefix: str = "",
+        sort: Literal["name", "uploaded", "size"] = "name",
+        order: Literal["asc", "desc"] = "asc",
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+) -> Any:
+    objects, next_cursor = await request.app.store.index.page(
+        bucket, prefix, sort, order == "desc", limit, cursor
+    )
+    return ObjectListSchema(
+        objects=[
+            ObjectInfoSchema(
+                object_name=item.name, size=item.size, uploaded=item.uploaded
+            )
+            for item in objects
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+@image_route.post(
+    "/duplicates",
+    response_model=DuplicatesSchema,
+)
+async def find_duplicates_of_file(
+        request: "Request",
+        file: UploadFileSchema,
+        distance: Optional[int] = None,
+) -> Any:
+    check_file_size(file, request.app.config.file.size)
+    value, duplicates = await request.app.store.duplicates.find(file.file, distance)
+    return duplicates_result(value, duplicates)
+
+
+@image_route.get(
+    "/duplicates/{bucket}/{object_name}",
+    response_model=DuplicatesSchema,
+)
+async def find_duplicates(
+        request: "Request",
+        bucket: str,
+        object_name: str,
+        distance: Optional[int] = None,
+) -> Any:
+    value, duplicates = await request.app.store.s3.find_duplicates(
+        bucket, object_name, distance
+    )
+    return duplicates_result(value, duplicates)
+
+
+@image_route.get("/thumb/{bucket}/{object_name}")
+async def thumbnail(
+        request: "Request",
+        bucket: str,
+        object_name: str,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        quality: Optional[int] = None,
+) -> Any:
+    variant = request.app.store.images.variant(width, height, quality)
+    return await request.app.store.s3.download_variant(
+        bucket, object_name, variant, request.headers
+    )
+
+
+@image_route.get("/meme/{bucket}/{template}")
+async def meme(
+        request: "Request",
+        bucket: str,
+        template: str,
+        top: str = "",
+        bottom: str = "",
+        quality: Optional[int] = None,
+) -> Any:
+    meme = request.app.store.images.meme(top, bottom, quality)
+    return await request.app.store.s3.download_meme(
+        bucket, template, meme, request.headers
+    )
+
+
+@image_route.post("/download/archive/{bucket}")
+async def download_archive(
+        request: "Request",
+        bucket: str,
+        body: ObjectSelectionSchema,
+) -> Any:
+    s3 = request.app.store.s3
+    await s3.is_bucket_exist(bucket)
+    return await s3.download_archive(bucket, body.object_names, body.prefix)
 
 
 @image_route.delete(
@@ -34,11 +217,26 @@ async def download(request: "Request", bucket: str, object_name: str) -> Any:
     response_model=OkSchema,
 )
 async def delete(request: "Request", bucket: str, object_name: str) -> Any:
-    await request.app.store.s3.is_object_exist(bucket, object_name)
     await request.app.store.s3.delete(bucket, object_name)
     return OkSchema()
 
 
+@image_route.post("/delete/batch/{bucket}")
+async def delete_batch(
+        request: "Request",
+        bucket: str,
+        body: ObjectSelectionSchema,
+) -> Any:
+    s3 = request.app.store.s3
+    await s3.is_bucket_exist(bucket)
+
+    async def results() -> AsyncIterator[bytes]:
+        async for result in s3.delete_many(bucket, body.object_names, body.prefix):
+            yield object_result(*result).model_dump_json().encode() + b"\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
 @image_route.put(
     "/update/{bucket}/{object_name}",
     response_model=OkSchema,
@@ -49,6 +247,6 @@ async def update(
         object_name: str,
         file: UploadFileSchema,
 ) -> Any:
-    await request.app.store.s3.is_object_exist(bucket, object_name)
-    await request.app.store.s3.upload(bucket, object_name, file)
+    check_file_size(file, request.app.config.file.size)
+    await request.app.store.s3.upload(bucket, object_name, file, must_exist=True)
     return OkSchema()
@@ -1,95 +1,1184 @@
-import aiohttp
+import asyncio
+import contextlib
+import hashlib
+import io
+import tempfile
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Mapping,
+    Optional,
+    Union,
+)
 
+from aiohttp import ClientResponse
 from base.base_accessor import BaseAccessor
+from base.base_exception import ExceptionBase
+from core.settings import DownloadSettings, FileSettings
 from image.schemas import UploadFileSchema
-from starlette.responses import StreamingResponse
+from miniopy_async.datatypes import Part
+from miniopy_async.deleteobjects import DeleteError, DeleteObject
+from starlette import status
+from starlette.responses import (
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 
 from store.S3.exeptions import (
     S3ConnectionErrorException,
     S3UnknownException,
     S3FileNotFoundException,
     S3BucketNotFoundException,
+    S3RangeNotSatisfiableException,
+    S3DeleteObjectException,
+)
+from store.S3.conditions import (
+    format_http_date,
+    is_conditional,
+    is_not_modified,
+    is_range_fresh,
+    parse_http_date,
 )
+from store.S3.archive import ArchiveFile, ZipStream
+from store.S3.flight import SingleFlight
+from store.S3.presign import PresignedUrls
+from store.S3.ranges import ByteRange, MultipartByteranges, parse_range_header
+from store.cache.disk import DiskFile
+from store.cache.memory import CachedObject
+from store.cache.metadata import NOT_FOUND_CODES, ObjectMetadata
+from store.database.resilience import is_transient
+from store.images import render
+from store.images.accessor import Meme, Variant
+from store.images.duplicates import Duplicate
+from store.images.exceptions import MemeLimitException
+
+DELETE_BATCH_SIZE = 1000
+PRECONDITION_FAILED = "PreconditionFailed"
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """Потоковый ответ, тело которого читается из заранее открытого источника.
+
+    Ответы S3 и файлы дискового кэша из `opened` освобождаются после
+    отправки, даже если тело так и не начали читать, например клиент
+    отключился раньше.
+    """
+
+    def __init__(
+        self, opened: list[Union[ClientResponse, DiskFile]], *args, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.opened = opened
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            for response in self.opened:
+                response.release()
+
+
+class _Generation:
+    """Число записей исходного объекта, пока из него строятся объекты."""
+
+    __slots__ = ("value", "__weakref__")
+
+    def __init__(self):
+        self.value = 0
 
 
 def exception_handler(func):
     async def wrapper(self, *args, **kwargs):
         try:
             return await func(self, *args, **kwargs)
+        except ExceptionBase:
+            raise
         except IOError as e:
-            if e.errno == 111:
+            if e.errno == 111 or is_transient(e):
                 raise S3ConnectionErrorException(exception=e)
         except ValueError as e:
             raise S3BucketNotFoundException(exception=e)
         except KeyError as e:
             raise S3FileNotFoundException(exception=e)
         except Exception as e:
+            if is_transient(e):
+                raise S3ConnectionErrorException(exception=e)
             if code := getattr(e, "code", None):
                 if code == "NoSuchBucket":
                     raise S3BucketNotFoundException()
                 if code == "NoSuchKey":
                     raise S3FileNotFoundException()
+                if code == "InvalidRange":
+                    raise S3RangeNotSatisfiableException()
         raise S3UnknownException()
 
     return wrapper
 
 
 class S3Accessor(BaseAccessor):
+    @property
+    def settings(self) -> DownloadSettings:
+        return self.app.config.download
+
+    @property
+    def file_settings(self) -> FileSettings:
+        return self.app.config.file
+
+    def _init(self):
+        self.flights = SingleFlight(
+            self.settings.download_coalescing_replay_bytes,
+            self.settings.download_coalescing_queue_size,
+        )
+        self.presigned = PresignedUrls()
+        self._renders: dict[tuple[str, str], asyncio.Task] = {}
+        self._generations: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
 
     @exception_handler
-    async def upload(self, bucket: str, object_name: str, file: UploadFileSchema):
-        await self.app.store.minio.client.put_object(
-            bucket_name=bucket,
-            object_name=object_name,
-            data=file.file,
-            length=file.size,
+    async def upload(
+        self,
+        bucket: str,
+        object_name: str,
+        file: UploadFileSchema,
+        must_exist: bool = False,
+    ):
+        """Загрузка объекта из файла формы.
+
+        Args:
+            bucket (str): Имя бакета.
+            object_name (str): Имя объекта.
+            file (UploadFileSchema): Файл.
+            must_exist (bool): Перезаписать только существующий объект.
+                Наличие объекта и его ссылка на блоб берутся из одного HEAD.
+        """
+        dedup = self.app.store.dedup
+        if must_exist:
+            previous = dedup.referenced(
+                (await self._stat(bucket, object_name)).user_metadata
+            )
+        else:
+            previous = await dedup.reference(bucket, object_name)
+        await self._upload_file(
+            bucket, object_name, file.file, file.size, "image/jpeg", previous
         )
 
+    async def _upload_file(
+        self,
+        bucket: str,
+        object_name: str,
+        file: BinaryIO,
+        size: int,
+        content_type: str,
+        previous: Optional[str],
+    ):
+        """Загрузка объекта, всё содержимое которого уже получено.
+
+        До записи в S3 изображение хэшируется для индекса похожих
+        и, если включён `image_phash_reject`, проверяется по нему.
+        """
+        phash = await self.app.store.duplicates.check(bucket, object_name, file)
+        if self.app.store.dedup.enabled:
+            released = await self.app.store.dedup.store_file(
+                bucket, object_name, file, size, content_type, previous
+            )
+        else:
+            await self.app.store.minio.client.put_object(
+                bucket_name=bucket,
+                object_name=object_name,
+                data=file,
+                length=size,
+                content_type=content_type,
+                part_size=self.file_settings.upload_part_size,
+                num_parallel_uploads=self.file_settings.upload_parts_in_flight,
+            )
+            released = await self._detach(bucket, object_name, previous)
+        await self._changed(bucket, object_name, released, size)
+        await self.app.store.duplicates.put(bucket, object_name, phash)
+
+    @exception_handler
+    async def upload_stream(
+        self,
+        bucket: str,
+        object_name: str,
+        content: AsyncIterator[bytes],
+        content_type: str = "image/jpeg",
+    ):
+        """Загрузка объекта из потока без буферизации всего тела.
+
+        Поток режется на части по `upload_part_size` байт, которые
+        загружаются через multipart upload, не больше `upload_parts_in_flight`
+        одновременно. Если весь поток уместился в одну часть, объект
+        загружается одним запросом PutObject. При ошибке или отмене
+        незавершённая multipart загрузка прерывается.
+
+        Если включён индекс похожих изображений, поток сначала копится
+        в памяти, а после `upload_part_size` байт - во временном файле,
+        и загружается как файл формы: хэш нужен до записи в S3, иначе
+        `image_phash_reject` обходился бы потоковой и пакетной загрузкой.
+
+        Args:
+            bucket (str): Имя бакета.
+            object_name (str): Имя объекта.
+            content (AsyncIterator[bytes]): Содержимое объекта.
+            content_type (str): Content-Type объекта.
+        """
+        size = 0
+        part_size = self.file_settings.upload_part_size
+
+        async def counted() -> AsyncIterator[bytes]:
+            nonlocal size
+            async for chunk in content:
+                size += len(chunk)
+                yield chunk
+
+        previous = await self.app.store.dedup.reference(bucket, object_name)
+        if self.app.store.duplicates.enabled:
+            with tempfile.SpooledTemporaryFile(part_size) as spool:
+                async for chunk in counted():
+                    spool.write(chunk)
+                spool.seek(0)
+                return await self._upload_file(
+                    bucket, object_name, spool, size, content_type, previous
+                )
+        if self.app.store.dedup.enabled:
+            released = await self.app.store.dedup.store_stream(
+                bucket, object_name, counted(), content_type, previous
+            )
+            return await self._changed(bucket, object_name, released, size)
+        client = self.app.store.minio.client
+        buffer = bytearray()
+        upload_id = None
+        pending: set[asyncio.Task] = set()
+        parts: list[Part] = []
+
+        async def upload_part(data: bytes, part_number: int) -> Part:
+            etag = await client._upload_part(
+                bucket, object_name, data, None, upload_id, part_number
+            )
+            return Part(part_number, etag)
+
+        async def submit(data: bytes):
+            nonlocal upload_id
+            if upload_id is None:
+                upload_id = await client._create_multipart_upload(
+                    bucket, object_name, {"Content-Type": content_type}
+                )
+            while len(pending) >= self.file_settings.upload_parts_in_flight:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    pending.discard(task)
+                    parts.append(task.result())
+            part_number = len(parts) + len(pending) + 1
+            pending.add(asyncio.create_task(upload_part(data, part_number)))
+
+        try:
+            async for chunk in counted():
+                buffer += chunk
+                while len(buffer) > part_size:
+                    await submit(bytes(buffer[:part_size]))
+                    del buffer[:part_size]
+            if upload_id is None:
+                await client.put_object(
+                    bucket_name=bucket,
+                    object_name=object_name,
+                    data=io.BytesIO(buffer),
+                    length=len(buffer),
+                    content_type=content_type,
+                )
+            else:
+                await submit(bytes(buffer))
+                parts.extend(await asyncio.gather(*pending))
+                pending.clear()
+                await client._complete_multipart_upload(
+                    bucket,
+                    object_name,
+                    upload_id,
+                    sorted(parts, key=lambda part: part.part_number),
+                )
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if upload_id is not None:
+                with contextlib.suppress(Exception):
+                    await asyncio.shield(
+                        client._abort_multipart_upload(bucket, object_name, upload_id)
+                    )
+            raise
+        released = await self._detach(bucket, object_name, previous)
+        await self._changed(bucket, object_name, released, size)
+
+    async def _changed(
+        self,
+        bucket: str,
+        object_name: str,
+        released: Optional[list[str]] = None,
+        size: Optional[int] = None,
+    ):
+        for key in [object_name, *(released or [])]:
+            self._invalidate(bucket, key)
+        if generation := self._generations.get((bucket, object_name)):
+            generation.value += 1
+        await self.app.store.duplicates.remove(bucket, object_name)
+        if size is not None:
+            await self.app.store.index.put(bucket, object_name, size)
+
+    async def upload_batch(
+        self,
+        bucket: str,
+        files: AsyncIterator[tuple[str, AsyncIterator[bytes]]],
+    ) -> list[tuple[str, Optional[ExceptionBase]]]:
+        """Загрузка нескольких объектов из одного потока файлов.
+
+        Одновременно загружается не больше `upload_batch_concurrency`
+        объектов. Пока все слоты заняты, следующий файл не запрашивается,
+        так что чтение тела запроса приостанавливается.
+
+        Args:
+            bucket (str): Имя бакета.
+            files (AsyncIterator[tuple[str, AsyncIterator[bytes]]]): Имена
+                объектов и их содержимое.
+
+        Returns:
+            list[tuple[str, Optional[ExceptionBase]]]: Имя каждого объекта
+                и ошибка его загрузки или None.
+        """
+        semaphore = asyncio.Semaphore(self.file_settings.upload_batch_concurrency)
+        tasks: list[asyncio.Task] = []
+
+        async def upload(object_name: str, content: AsyncIterator[bytes]):
+            try:
+                async with contextlib.aclosing(content):
+                    await self.upload_stream(bucket, object_name, content)
+            except ExceptionBase as e:
+                return object_name, e
+            finally:
+                semaphore.release()
+            return object_name, None
+
+        try:
+            async for object_name, content in files:
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(upload(object_name, content)))
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
     @exception_handler
     async def delete(self, bucket: str, object_name: str):
+        """Удаление объекта.
+
+        Наличие объекта и его ссылка на блоб берутся из одного HEAD.
+
+        Raises:
+            S3FileNotFoundException: Объекта нет.
+        """
+        metadata = await self._stat(bucket, object_name)
         await self.app.store.minio.client.remove_object(
             bucket_name=bucket,
             object_name=object_name,
         )
+        digest = self.app.store.dedup.referenced(metadata.user_metadata)
+        await self._deleted(bucket, object_name, digest)
+
+    async def delete_many(
+        self,
+        bucket: str,
+        object_names: Optional[list[str]] = None,
+        prefix: Optional[str] = None,
+    ) -> AsyncIterator[tuple[str, Optional[ExceptionBase]]]:
+        """Удаление объектов по списку имён или по префиксу.
+
+        Объекты удаляются запросами DeleteObjects по `DELETE_BATCH_SIZE`
+        штук. Пока удаляется одна пачка, запрашивается следующая страница
+        списка объектов. Служебные объекты по префиксу не удаляются: на блобы
+        могут ссылаться другие имена.
+
+        Args:
+            bucket (str): Имя бакета.
+            object_names (Optional[list[str]]): Имена объектов.
+            prefix (Optional[str]): Префикс имён, если список не задан.
+
+        Returns:
+            AsyncIterator[tuple[str, Optional[ExceptionBase]]]: Имя каждого
+                объекта и ошибка его удаления или None.
+        """
+        pending: Optional[asyncio.Task] = None
+        try:
+            async for batch in self._object_name_batches(bucket, object_names, prefix):
+                task = asyncio.create_task(self._delete_batch(bucket, batch))
+                if pending is not None:
+                    for result in await pending:
+                        yield result
+                pending = task
+            if pending is not None:
+                for result in await pending:
+                    yield result
+                pending = None
+            if prefix is not None and object_names is None:
+                derived = self.app.store.images.derived_prefixes(prefix)
+                await self._delete_derived(
+                    bucket, [name.removesuffix("/") for name in derived]
+                )
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def _object_name_batches(
+        self,
+        bucket: str,
+        object_names: Optional[list[str]],
+        prefix: Optional[str],
+        internal: bool = False,
+    ) -> AsyncIterator[dict[str, Optional[int]]]:
+        """Пачки имён по списку или по префиксу.
+
+        Для имён из списка размер неизвестен и равен None, для имён
+        по префиксу он берётся из списка объектов. Служебные объекты (блобы,
+        отметки ссылок, варианты и мемы) в пачки по префиксу попадают,
+        только если `internal` истинно.
+        """
+        if object_names is not None:
+            for start in range(0, len(object_names), DELETE_BATCH_SIZE):
+                yield dict.fromkeys(object_names[start : start + DELETE_BATCH_SIZE])
+            return
+        hidden = self.app.store.index.hidden
+        start_after = None
+        while objects := await self._list_object_sizes(bucket, prefix, start_after):
+            start_after = objects[-1][0]
+            if batch := {
+                name: size for name, size in objects if internal or not hidden(name)
+            }:
+                yield batch
+
+    @exception_handler
+    async def _list_object_sizes(
+        self, bucket: str, prefix: Optional[str], start_after: Optional[str]
+    ) -> list[tuple[str, int]]:
+        objects = await self.app.store.minio.client.list_objects(
+            bucket_name=bucket,
+            prefix=prefix,
+            recursive=True,
+            start_after=start_after,
+        )
+        return [(item.object_name, item.size) for item in objects]
+
+    async def download_archive(
+        self,
+        bucket: str,
+        object_names: Optional[list[str]] = None,
+        prefix: Optional[str] = None,
+    ) -> StreamingResponse:
+        """ZIP архив объектов по списку имён или по префиксу.
+
+        Архив собирается на лету: объекты читаются из S3 по порядку,
+        а следующие `download_archive_read_ahead` объектов открываются
+        заранее, чтобы не ждать S3 между файлами. Тела открытых заранее
+        ответов не читаются, их сдерживает TCP, поэтому память не зависит
+        от размера архива. Отсутствующие объекты пропускаются, служебные
+        объекты в архив по префиксу не попадают.
+
+        Args:
+            bucket (str): Имя бакета.
+            object_names (Optional[list[str]]): Имена объектов.
+            prefix (Optional[str]): Префикс имён, если список не задан.
+        """
+        files = self._archive_files(bucket, object_names, prefix)
+        return StreamingResponse(
+            content=ZipStream().stream(files),
+            media_type="application/zip",
+            headers={"Content-Disposition": f"attachment filename={bucket}.zip"},
+        )
+
+    async def _archive_files(
+        self,
+        bucket: str,
+        object_names: Optional[list[str]],
+        prefix: Optional[str],
+    ) -> AsyncIterator[ArchiveFile]:
+        batches = self._object_name_batches(bucket, object_names, prefix)
+        names = (name async for batch in batches for name in batch)
+        opened: deque[tuple[str, asyncio.Task]] = deque()
+        response: Optional[ClientResponse] = None
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and (
+                    len(opened) < self.settings.download_archive_read_ahead
+                ):
+                    if (name := await anext(names, None)) is None:
+                        exhausted = True
+                    else:
+                        task = asyncio.create_task(self._open_object(bucket, name))
+                        opened.append((name, task))
+                if not opened:
+                    return
+                name, task = opened.popleft()
+                if (response := await task) is None:
+                    continue
+                yield ArchiveFile(
+                    name,
+                    response.content_length,
+                    parse_http_date(response.headers.get("Last-Modified", "")),
+                    self._stream(response),
+                )
+        finally:
+            if response is not None:
+                response.release()
+            for _, task in opened:
+                task.cancel()
+                if task.done() and not task.cancelled() and not task.exception():
+                    if task.result() is not None:
+                        task.result().release()
+
+    async def _open_object(
+        self, bucket: str, object_name: str
+    ) -> Optional[ClientResponse]:
+        try:
+            return await self._get_existing_object(bucket, object_name)
+        except S3FileNotFoundException:
+            self.logger.warning(
+                f"{self.__class__.__name__}: объект {bucket}/{object_name}"
+                " не найден и пропущен"
+            )
+            return None
 
     @exception_handler
-    async def download(self, bucket: str, object_name: str) -> StreamingResponse:
-        session = self._session()
+    async def _get_existing_object(
+        self, bucket: str, object_name: str
+    ) -> ClientResponse:
+        """Ответ S3 с содержимым объекта.
+
+        Ссылка на блоб видна в метаданных ответа GET, поэтому отдельный
+        HEAD за ней не нужен, а для ссылки блоб запрашивается вторым GET.
+        """
+        response = await self._get_object(bucket, object_name)
+        digest = self.app.store.dedup.referenced(response.headers)
+        if not digest or response.content_length:
+            return response
+        response.release()
+        return await self._get_object(bucket, self.app.store.dedup.blob_key(digest))
+
+    async def _delete_batch(
+        self, bucket: str, batch: dict[str, Optional[int]]
+    ) -> list[tuple[str, Optional[ExceptionBase]]]:
+        object_names = list(batch)
         try:
-            response = await self.app.store.minio.client.get_object(
+            digests = await self._references(bucket, batch)
+            errors = await self._remove_objects(bucket, object_names)
+        except ExceptionBase as e:
+            return [(object_name, e) for object_name in object_names]
+        failed = {}
+        for error in errors:
+            exception = S3DeleteObjectException(
+                f"{S3DeleteObjectException.args[0]} Код ошибки: {error.code}.",
+                exception=Exception(error.code, error.message),
+            )
+            if error.name is None:
+                return [(object_name, exception) for object_name in object_names]
+            failed[error.name] = exception
+        deleted = [name for name in object_names if name not in failed]
+        variants = await asyncio.gather(
+            *(self._deleted(bucket, name, digests.get(name)) for name in deleted),
+            return_exceptions=True,
+        )
+        for object_name, error in zip(deleted, variants):
+            if isinstance(error, ExceptionBase):
+                failed[object_name] = error
+            elif isinstance(error, BaseException):
+                raise error
+        return [(object_name, failed.get(object_name)) for object_name in object_names]
+
+    @exception_handler
+    async def _references(
+        self, bucket: str, batch: dict[str, Optional[int]]
+    ) -> dict[str, Optional[str]]:
+        """Ссылки на блобы объектов пачки.
+
+        Ссылка - пустой объект, поэтому объекты, чей размер известен
+        из списка и не равен нулю, не проверяются.
+        """
+        dedup = self.app.store.dedup
+        if not await dedup.in_use(bucket):
+            return {}
+        object_names = [name for name, size in batch.items() if not size]
+        digests = await asyncio.gather(
+            *(dedup.reference(bucket, name) for name in object_names)
+        )
+        return dict(zip(object_names, digests))
+
+    async def _detach(
+        self, bucket: str, object_name: str, previous: Optional[str]
+    ) -> list[str]:
+        """Снимает ссылку на блоб, если объект перезаписан обычным объектом."""
+        if previous is None:
+            return []
+        return await self.app.store.dedup.release(bucket, object_name, previous)
+
+    @exception_handler
+    async def _deleted(self, bucket: str, object_name: str, digest: Optional[str]):
+        released = []
+        if digest:
+            released = await self.app.store.dedup.release(bucket, object_name, digest)
+        await self._changed(bucket, object_name, released)
+        metadata_cache = self.app.store.metadata_cache
+        metadata_cache.put(bucket, object_name, None, metadata_cache.epoch)
+        await self.app.store.index.remove(bucket, object_name)
+
+    @exception_handler
+    async def _remove_objects(
+        self, bucket: str, object_names: list[str]
+    ) -> tuple[DeleteError, ...]:
+        return await self.app.store.minio.client.remove_objects(
+            bucket_name=bucket,
+            delete_object_list=[DeleteObject(name) for name in object_names],
+        )
+
+    @exception_handler
+    async def download(
+        self,
+        bucket: str,
+        object_name: str,
+        headers: Optional[Mapping[str, str]] = None,
+        redirect: bool = True,
+    ) -> Response:
+        """Скачивание объекта.
+
+        Объекты бакетов из `download_redirect_buckets` не проходят через
+        сервис: ответ - перенаправление на подписанную ссылку, по которой
+        объект отдаёт сам S3. Ложный `redirect` отдаёт объект через сервис
+        и для этих бакетов, а включить перенаправление для остальных бакетов
+        запрос не может.
+        """
+        key = await self.app.store.dedup.resolve(bucket, object_name)
+        if redirect and bucket in self.settings.download_redirect_buckets:
+            return await self._redirect(bucket, key, object_name)
+        response = await self._download(bucket, key, headers)
+        if key != object_name and "Content-Disposition" in response.headers:
+            response.headers["Content-Disposition"] = (
+                f"attachment filename={object_name}"
+            )
+        return response
+
+    async def _redirect(self, bucket: str, key: str, object_name: str) -> Response:
+        if entry := self.app.store.metadata_cache.get(bucket, key):
+            if entry.metadata is None:
+                raise S3FileNotFoundException()
+        url = await self.presigned.get(
+            self.app.store.minio.client,
+            bucket,
+            key,
+            {
+                "response-content-disposition": f"attachment filename={object_name}",
+                "response-content-type": "image/jpeg",
+                "response-cache-control": self.settings.download_cache_control,
+            },
+            self.settings.download_redirect_expires,
+            self.settings.download_redirect_margin,
+            self.settings.download_redirect_host,
+        )
+        return RedirectResponse(url, status_code=status.HTTP_302_FOUND)
+
+    @exception_handler
+    async def _download(
+        self,
+        bucket: str,
+        object_name: str,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Response:
+        headers = headers or {}
+        if cached := self.app.store.memory_cache.get(bucket, object_name):
+            return self._download_local(object_name, cached, headers)
+        if opened := await self.app.store.disk_cache.get(bucket, object_name):
+            if self.app.store.memory_cache.admits(opened.size):
+                epoch = self.app.store.memory_cache.epoch
+                try:
+                    body = await asyncio.to_thread(opened.read)
+                finally:
+                    opened.release()
+                cached = CachedObject(body, opened.etag, opened.last_modified)
+                self.app.store.memory_cache.put(bucket, object_name, cached, epoch)
+                return self._download_local(object_name, cached, headers)
+            try:
+                response = self._download_local(object_name, opened, headers)
+            except BaseException:
+                opened.release()
+                raise
+            if not isinstance(response, ReleasingStreamingResponse):
+                opened.release()
+            return response
+        range_header = headers.get("range")
+        if range_header or is_conditional(headers):
+            stat = await self._stat(bucket, object_name)
+            validators = self._validators(
+                stat.etag, format_http_date(stat.last_modified)
+            )
+            if is_not_modified(headers, stat.etag, stat.last_modified):
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED, headers=validators
+                )
+            if range_header and is_range_fresh(headers, stat.etag, stat.last_modified):
+                ranges = parse_range_header(range_header, stat.size)
+                if ranges is not None:
+                    return await self._download_ranges(
+                        bucket, object_name, ranges, stat.size, validators
+                    )
+        elif entry := self.app.store.metadata_cache.get(bucket, object_name):
+            if entry.metadata is None:
+                raise S3FileNotFoundException()
+        return await self._download_object(bucket, object_name)
+
+    @exception_handler
+    async def download_variant(
+        self,
+        bucket: str,
+        object_name: str,
+        variant: Variant,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Response:
+        """Уменьшенная копия изображения.
+
+        Args:
+            bucket (str): Имя бакета.
+            object_name (str): Имя оригинала.
+            variant (Variant): Размеры и качество варианта.
+            headers (Optional[Mapping[str, str]]): Заголовки запроса.
+        """
+        images = self.app.store.images
+        return await self._download_derived(
+            bucket,
+            object_name,
+            lambda version: images.variant_key(object_name, version, variant),
+            lambda data: images.run(render.resize, data, *variant),
+            headers,
+        )
+
+    @exception_handler
+    async def download_meme(
+        self,
+        bucket: str,
+        template: str,
+        meme: Meme,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Response:
+        """Мем из шаблона с подписями.
+
+        Новый мем не рендерится, если из шаблона уже сохранено
+        `image_meme_max_per_template` мемов: подписи - свободный текст,
+        и без этого ограничения рендер и хранилище ничем не ограничены.
+
+        Args:
+            bucket (str): Имя бакета.
+            template (str): Имя объекта шаблона.
+            meme (Meme): Подписи и качество.
+            headers (Optional[Mapping[str, str]]): Заголовки запроса.
+        """
+        images = self.app.store.images
+        font = images.settings.image_meme_font
+        return await self._download_derived(
+            bucket,
+            template,
+            lambda version: images.meme_key(template, version, meme),
+            lambda data: images.run(render.render_meme, data, *meme, font),
+            headers,
+            lambda: self._check_meme_limit(bucket, template),
+        )
+
+    async def _check_meme_limit(self, bucket: str, template: str):
+        """Проверяет, можно ли сохранить ещё один мем из шаблона.
+
+        Мемы считаются по списку объектов, только когда нужен новый рендер.
+
+        Raises:
+            MemeLimitException: Мемов шаблона уже не меньше лимита.
+        """
+        limit = self.app.store.images.settings.image_meme_max_per_template
+        if not limit:
+            return
+        prefix = self.app.store.images.meme_prefix(template)
+        count, start_after = 0, None
+        while objects := await self._list_object_sizes(bucket, prefix, start_after):
+            count += len(objects)
+            if count >= limit:
+                raise MemeLimitException()
+            start_after = objects[-1][0]
+
+    async def _download_derived(
+        self,
+        bucket: str,
+        object_name: str,
+        derived_key: Callable[[str], str],
+        render_object: Callable[[bytes], Awaitable[bytes]],
+        headers: Optional[Mapping[str, str]],
+        check: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> Response:
+        """Объект, построенный из `object_name`, например вариант или мем.
+
+        Объект рендерится один раз: результат сохраняется в тот же бакет
+        под ключом `derived_key(version)` и дальше отдаётся как обычный
+        объект, со всеми уровнями кэша. Одновременные запросы одного
+        отсутствующего объекта ждут один и тот же рендер.
+
+        Версия исходного объекта берётся из кэша метаданных, поэтому после
+        записи исходного объекта строится новый объект, а прежний больше
+        не запрашивается. Прежние версии удаляются при удалении по префиксу,
+        а для остальных подойдёт правило жизненного цикла бакета.
+
+        `check` вызывается перед новым рендером и может его запретить.
+        """
+        version = await self.app.store.dedup.version(bucket, object_name)
+        if version is None:
+            raise S3FileNotFoundException()
+        key = derived_key(version)
+        try:
+            return await self._download(bucket, key, headers)
+        except S3FileNotFoundException:
+            pass
+        if check is not None and (bucket, key) not in self._renders:
+            await check()
+        if (task := self._renders.get((bucket, key))) is None:
+            task = asyncio.create_task(
+                self._render_derived(bucket, object_name, key, render_object)
+            )
+            self._renders[(bucket, key)] = task
+            task.add_done_callback(lambda _: self._renders.pop((bucket, key), None))
+        cached = await asyncio.shield(task)
+        return self._download_local(object_name, cached, headers or {})
+
+    async def _render_derived(
+        self,
+        bucket: str,
+        object_name: str,
+        key: str,
+        render_object: Callable[[bytes], Awaitable[bytes]],
+    ) -> CachedObject:
+        """Рендер объекта и его сохранение под ключом `key`.
+
+        Если исходный объект записали или удалили, пока шёл рендер,
+        результат отдаётся, но не сохраняется. Записи других объектов
+        на рендер не влияют.
+        """
+        source = (bucket, object_name)
+        if (generation := self._generations.get(source)) is None:
+            generation = self._generations[source] = _Generation()
+        start = generation.value
+        body = await render_object(await self._read_object(bucket, object_name))
+        etag = hashlib.md5(body).hexdigest()
+        if start == generation.value:
+            result = await self.app.store.minio.client.put_object(
                 bucket_name=bucket,
-                object_name=object_name,
-                session=session,
+                object_name=key,
+                data=io.BytesIO(body),
+                length=len(body),
+                content_type="image/jpeg",
             )
+            etag = result.etag
+            if start != generation.value:
+                await self.app.store.minio.client.remove_object(bucket, key)
+            self.app.store.metadata_cache.invalidate(bucket, key)
+        return CachedObject(body, f'"{etag}"', datetime.now(timezone.utc))
+
+    @exception_handler
+    async def find_duplicates(
+        self, bucket: str, object_name: str, distance: Optional[int] = None
+    ) -> tuple[int, list[Duplicate]]:
+        """Изображения, похожие на объект.
 
-            async def stream_iterator():
-                async for chunk in response.content:
-                    yield chunk
-                await session.close()
+        Хэш берётся из индекса, а если объект в нём не записан, например
+        загружен до включения индекса, считается по содержимому объекта.
+
+        Returns:
+            tuple[int, list[Duplicate]]: Перцептивный хэш объекта и похожие
+                на него изображения, кроме самого объекта.
+        """
+        duplicates = self.app.store.duplicates
+        value = await duplicates.get(bucket, object_name)
+        if value is None:
+            data = await self._read_object(bucket, object_name)
+            value = await self.app.store.images.run(render.perceptual_hash, data)
+        return value, await duplicates.search(
+            value, distance, exclude=(bucket, object_name)
+        )
 
-            return StreamingResponse(
-                content=stream_iterator(),
-                headers=self._create_headers(object_name),
+    async def _read_object(self, bucket: str, object_name: str) -> bytes:
+        object_name = await self.app.store.dedup.resolve(bucket, object_name)
+        if cached := self.app.store.memory_cache.get(bucket, object_name):
+            return cached.body
+        if opened := await self.app.store.disk_cache.get(bucket, object_name):
+            try:
+                return await asyncio.to_thread(opened.read)
+            finally:
+                opened.release()
+        response = await self._get_object(bucket, object_name)
+        try:
+            return await response.read()
+        finally:
+            response.release()
+
+    async def _delete_derived(self, bucket: str, prefixes: list[str]):
+        """Удаляет построенные объекты с ключами, начинающимися с `prefixes`."""
+        for prefix in prefixes:
+            batches = self._object_name_batches(bucket, None, prefix, internal=True)
+            async for batch in batches:
+                await self._remove_objects(bucket, list(batch))
+                for key in batch:
+                    self._invalidate(bucket, key)
+
+    async def _download_object(self, bucket: str, object_name: str) -> Response:
+        if not self.settings.download_coalescing:
+            content, headers = await self._fetch_object(bucket, object_name)
+            return StreamingResponse(content=content, headers=headers)
+        if flight := self.flights.join(bucket, object_name):
+            resume = self._resume(bucket, object_name, flight.headers)
+            if content := await flight.follow(resume):
+                return StreamingResponse(content=content, headers=flight.headers)
+        flight = self.flights.lead(bucket, object_name)
+        try:
+            content, headers = await self._fetch_object(bucket, object_name)
+        except BaseException as e:
+            flight.fail(e)
+            raise
+        resume = self._resume(bucket, object_name, headers)
+        subscription = flight.subscribe(resume)
+        flight.start(content, headers)
+        return StreamingResponse(content=subscription, headers=headers)
+
+    async def _fetch_object(
+        self, bucket: str, object_name: str
+    ) -> tuple[AsyncIterator[bytes], dict]:
+        memory_epoch = self.app.store.memory_cache.epoch
+        disk_epoch = self.app.store.disk_cache.epoch
+        metadata_epoch = self.app.store.metadata_cache.epoch
+        try:
+            response = await self._get_object(bucket, object_name)
+        except Exception as e:
+            if getattr(e, "code", None) in NOT_FOUND_CODES:
+                self.app.store.metadata_cache.put(
+                    bucket, object_name, None, metadata_epoch
+                )
+            raise
+        self.app.store.metadata_cache.put(
+            bucket,
+            object_name,
+            ObjectMetadata.from_headers(response.headers, response.content_length),
+            metadata_epoch,
+        )
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        content = self._stream(response)
+        if etag and last_modified:
+            modified = parse_http_date(last_modified)
+            if self.app.store.disk_cache.admits(response.content_length):
+                content = self.app.store.disk_cache.fill(
+                    content, bucket, object_name, etag, modified, disk_epoch
+                )
+            if self.app.store.memory_cache.admits(response.content_length):
+                content = self.app.store.memory_cache.fill(
+                    content, bucket, object_name, etag, modified, memory_epoch
+                )
+        headers = self._create_headers(
+            object_name,
+            response.content_length,
+            self._validators(etag, last_modified),
+        )
+        return content, headers
+
+    def _resume(self, bucket: str, object_name: str, headers: Mapping[str, str]):
+        """Дочитывание объекта с той же версией, что в заголовках `headers`.
+
+        ETag читается при вызове: заголовки присоединившегося запроса
+        заполняются, когда ведущий запрос получит ответ S3.
+        """
+
+        async def resume(offset: int) -> AsyncIterator[bytes]:
+            response = await self._get_object(
+                bucket, object_name, etag=headers.get("ETag"), offset=offset
+            )
+            async for chunk in self._stream(response):
+                yield chunk
+
+        return resume
+
+    def _download_local(
+        self,
+        object_name: str,
+        entry: Union[CachedObject, DiskFile],
+        headers: Mapping[str, str],
+    ) -> Response:
+        validators = self._validators(entry.etag, format_http_date(entry.last_modified))
+        opened = [entry] if isinstance(entry, DiskFile) else []
+        if is_not_modified(headers, entry.etag, entry.last_modified):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers=validators
             )
+        range_header = headers.get("range")
+        if range_header and is_range_fresh(headers, entry.etag, entry.last_modified):
+            ranges = parse_range_header(range_header, entry.size)
+            if ranges is not None:
+                return self._range_response(
+                    object_name,
+                    ranges,
+                    entry.size,
+                    validators,
+                    entry.iter_range,
+                    opened,
+                )
+        if isinstance(entry, DiskFile):
+            return ReleasingStreamingResponse(
+                opened,
+                content=entry.iter_range(ByteRange(0, entry.size - 1)),
+                headers=self._create_headers(object_name, entry.size, validators),
+            )
+        return Response(
+            content=entry.body,
+            headers=self._create_headers(object_name, None, validators),
+        )
+
+    async def _download_ranges(
+        self,
+        bucket: str,
+        object_name: str,
+        ranges: list[ByteRange],
+        size: int,
+        validators: dict,
+    ) -> Response:
+        """Ответ 206 с диапазонами объекта из S3.
+
+        Диапазоны сверены с размером объекта, а каждый из них запрашивается
+        с If-Match по его ETag, так что части другой версии объекта в ответ
+        не попадут. Первый диапазон запрашивается до отправки заголовков:
+        если объект уже перезаписан, клиент получит новую версию целиком.
+        Остальные запрашиваются, только когда до них доходит тело ответа,
+        и смена версии к этому времени обрывает ответ.
+        """
+        etag = validators.get("ETag")
+        try:
+            first = await self._get_object(bucket, object_name, ranges[0], etag)
         except Exception as e:
-            await session.close()
-            raise e
+            if getattr(e, "code", None) != PRECONDITION_FAILED:
+                raise
+            self._invalidate(bucket, object_name)
+            return await self._download_object(bucket, object_name)
+        opened = [first]
 
-    @exception_handler
-    async def is_object_exist(self, bucket: str, object_name: str) -> bool:
-        await self.app.store.minio.client.stat_object(
+        async def fetch(byte_range: ByteRange) -> AsyncIterator[bytes]:
+            if opened:
+                response = opened.pop()
+            else:
+                response = await self._get_object(
+                    bucket, object_name, byte_range, etag
+                )
+            async for chunk in self._stream(response):
+                yield chunk
+
+        return self._range_response(
+            object_name, ranges, size, validators, fetch, opened
+        )
+
+    def _range_response(
+        self,
+        object_name: str,
+        ranges: list[ByteRange],
+        size: int,
+        validators: dict,
+        fetch: Callable[[ByteRange], AsyncIterator[bytes]],
+        opened: Optional[list[Union[ClientResponse, DiskFile]]] = None,
+    ) -> StreamingResponse:
+        if len(ranges) == 1:
+            headers = self._create_headers(object_name, ranges[0].length, validators)
+            headers["Content-Range"] = ranges[0].content_range(size)
+            content = fetch(ranges[0])
+        else:
+            multipart = MultipartByteranges(ranges, size, "image/jpeg")
+            headers = self._create_headers(object_name, multipart.length, validators)
+            headers["Content-type"] = multipart.content_type
+            content = multipart.stream(fetch)
+        return ReleasingStreamingResponse(
+            opened or [],
+            content=content,
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            headers=headers,
+        )
+
+    async def _get_object(
+        self,
+        bucket: str,
+        object_name: str,
+        byte_range: Optional[ByteRange] = None,
+        etag: Optional[str] = None,
+        offset: int = 0,
+    ) -> ClientResponse:
+        length = 0
+        if byte_range:
+            offset, length = byte_range.start, byte_range.length
+        return await self.app.store.minio.client.get_object(
             bucket_name=bucket,
             object_name=object_name,
+            session=self.app.store.minio.session,
+            offset=offset,
+            length=length,
+            request_headers={"If-Match": etag} if etag else None,
         )
-        return True
 
     @staticmethod
-    def _session() -> aiohttp.ClientSession:
-        return aiohttp.ClientSession()
+    async def _stream(response: ClientResponse) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in response.content.iter_any():
+                yield chunk
+        finally:
+            response.release()
+
+    @exception_handler
+    async def is_bucket_exist(self, bucket: str) -> bool:
+        if not await self.app.store.minio.client.bucket_exists(bucket):
+            raise S3BucketNotFoundException()
+        return True
+
+    @exception_handler
+    async def is_object_exist(self, bucket: str, object_name: str) -> bool:
+        await self._stat(bucket, object_name)
+        return True
+
+    async def _stat(self, bucket: str, object_name: str) -> ObjectMetadata:
+        metadata = await self.app.store.metadata_cache.stat(bucket, object_name)
+        if metadata is None:
+            raise S3FileNotFoundException()
+        return metadata
+
+    def _invalidate(self, bucket: str, object_name: str):
+        self.flights.forget(bucket, object_name)
+        self.app.store.memory_cache.invalidate(bucket, object_name)
+        self.app.store.disk_cache.invalidate(bucket, object_name)
+        self.app.store.metadata_cache.invalidate(bucket, object_name)
+
+    def _validators(self, etag: Optional[str], last_modified: Optional[str]) -> dict:
+        headers = {"Cache-Control": self.settings.download_cache_control}
+        if etag:
+            headers["ETag"] = etag
+        if last_modified:
+            headers["Last-Modified"] = last_modified
+        return headers
 
     @staticmethod
-    def _create_headers(filename: str) -> dict:
-        return {
+    def _create_headers(
+        filename: str, length: Optional[int] = None, validators: Optional[dict] = None
+    ) -> dict:
+        headers = {
             "Content-Disposition": f"attachment filename={filename}",
             "Content-type": "image/jpeg",
+            "Accept-Ranges": "bytes",
+            **(validators or {}),
         }
+        if length is not None:
+            headers["Content-Length"] = str(length)
+        return headers
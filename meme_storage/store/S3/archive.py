@@ -0,0 +1,206 @@
+"""Потоковая запись ZIP архива (APPNOTE 6.3.9) без сжатия."""
+
+import struct
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, NamedTuple
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_ENTRIES_LIMIT = 0xFFFF
+VERSION_ZIP32 = 20
+VERSION_ZIP64 = 45
+FLAGS = 0x0008 | 0x0800  # data descriptor, имена в UTF-8
+
+
+class ArchiveFile(NamedTuple):
+    """Файл, добавляемый в архив.
+
+    Attributes:
+        name (str): Путь файла в архиве.
+        size (int): Размер содержимого в байтах.
+        last_modified (datetime): Время изменения.
+        content (AsyncIterator[bytes]): Содержимое.
+    """
+
+    name: str
+    size: int
+    last_modified: datetime
+    content: AsyncIterator[bytes]
+
+
+@dataclass(slots=True)
+class _Entry:
+    name: bytes
+    offset: int
+    size: int
+    crc: int
+    time: int
+    date: int
+
+    @property
+    def zip64(self) -> bool:
+        return self.size >= ZIP32_LIMIT or self.offset >= ZIP32_LIMIT
+
+
+def archive_name(object_name: str) -> str:
+    """Путь файла в архиве без абсолютных путей и переходов вверх."""
+    parts = [
+        part for part in object_name.split("/") if part not in ("", ".", "..")
+    ]
+    return "/".join(parts) or "_"
+
+
+def _dos_datetime(value: datetime) -> tuple[int, int]:
+    year = min(max(value.year, 1980), 2107)
+    time = value.hour << 11 | value.minute << 5 | value.second // 2
+    date = (year - 1980) << 9 | value.month << 5 | value.day
+    return time, date
+
+
+class ZipStream:
+    """ZIP архив, который пишется по мере чтения файлов.
+
+    Файлы сохраняются без сжатия. Контрольная сумма и размер каждого файла
+    пишутся после его содержимого в data descriptor, поэтому содержимое
+    не нужно держать в памяти. В памяти остаётся только центральный
+    каталог - несколько десятков байт на файл. Для файлов и архивов
+    больше 4 ГБ и для архивов больше чем из 65535 файлов используется ZIP64.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self._entries: list[_Entry] = []
+
+    async def stream(self, files: AsyncIterator[ArchiveFile]) -> AsyncIterator[bytes]:
+        """Содержимое архива.
+
+        Raises:
+            ValueError: Размер содержимого файла не совпал с объявленным.
+        """
+        async for file in files:
+            time, date = _dos_datetime(file.last_modified)
+            entry = _Entry(
+                archive_name(file.name).encode(), self.offset, file.size, 0, time, date
+            )
+            yield self._write(self._local_header(entry))
+            size = 0
+            async for chunk in file.content:
+                size += len(chunk)
+                entry.crc = zlib.crc32(chunk, entry.crc)
+                yield self._write(chunk)
+            if size != file.size:
+                raise ValueError(
+                    f"{file.name}: ожидалось {file.size} байт, прочитано {size}"
+                )
+            yield self._write(self._data_descriptor(entry))
+            self._entries.append(entry)
+        yield self._write(self._central_directory())
+
+    def _write(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+
+    @staticmethod
+    def _local_header(entry: _Entry) -> bytes:
+        extra = b""
+        version, size = VERSION_ZIP32, 0
+        if entry.size >= ZIP32_LIMIT:
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            version, size = VERSION_ZIP64, 0xFFFFFFFF
+        header = struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50,
+            version,
+            FLAGS,
+            0,
+            entry.time,
+            entry.date,
+            0,
+            size,
+            size,
+            len(entry.name),
+            len(extra),
+        )
+        return header + entry.name + extra
+
+    @staticmethod
+    def _data_descriptor(entry: _Entry) -> bytes:
+        if entry.size >= ZIP32_LIMIT:
+            return struct.pack("<IIQQ", 0x08074B50, entry.crc, entry.size, entry.size)
+        return struct.pack("<IIII", 0x08074B50, entry.crc, entry.size, entry.size)
+
+    def _central_directory(self) -> bytes:
+        start = self.offset
+        records = []
+        for entry in self._entries:
+            extra = b""
+            size, offset = entry.size, entry.offset
+            if entry.size >= ZIP32_LIMIT:
+                extra += struct.pack("<QQ", entry.size, entry.size)
+                size = 0xFFFFFFFF
+            if entry.offset >= ZIP32_LIMIT:
+                extra += struct.pack("<Q", entry.offset)
+                offset = 0xFFFFFFFF
+            if extra:
+                extra = struct.pack("<HH", 0x0001, len(extra)) + extra
+            version = VERSION_ZIP64 if entry.zip64 else VERSION_ZIP32
+            records.append(
+                struct.pack(
+                    "<IHHHHHHIIIHHHHHII",
+                    0x02014B50,
+                    version,
+                    version,
+                    FLAGS,
+                    0,
+                    entry.time,
+                    entry.date,
+                    entry.crc,
+                    size,
+                    size,
+                    len(entry.name),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    0,
+                    offset,
+                )
+                + entry.name
+                + extra
+            )
+        directory = b"".join(records)
+        count, length = len(self._entries), len(directory)
+        end = b""
+        if (
+            count >= ZIP32_ENTRIES_LIMIT
+            or start >= ZIP32_LIMIT
+            or length >= ZIP32_LIMIT
+        ):
+            zip64_end = start + length
+            end += struct.pack(
+                "<IQHHIIQQQQ",
+                0x06064B50,
+                44,
+                VERSION_ZIP64,
+                VERSION_ZIP64,
+                0,
+                0,
+                count,
+                count,
+                length,
+                start,
+            )
+            end += struct.pack("<IIQI", 0x07064B50, 0, zip64_end, 1)
+        end += struct.pack(
+            "<IHHHHIIH",
+            0x06054B50,
+            0,
+            0,
+            0xFFFF if count >= ZIP32_ENTRIES_LIMIT else count,
+            0xFFFF if count >= ZIP32_ENTRIES_LIMIT else count,
+            0xFFFFFFFF if length >= ZIP32_LIMIT else length,
+            0xFFFFFFFF if start >= ZIP32_LIMIT else start,
+            0,
+        )
+        return directory + end
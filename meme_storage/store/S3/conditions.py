@@ -0,0 +1,67 @@
+"""Условные запросы HTTP (RFC 9110, раздел 13): ETag и Last-Modified."""
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Mapping, Optional
+
+CONDITIONAL_HEADERS = ("if-none-match", "if-modified-since")
+
+
+def format_http_date(value: datetime) -> str:
+    """Дата в формате заголовка HTTP (IMF-fixdate)."""
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def parse_http_date(value: str) -> Optional[datetime]:
+    """Разбирает дату из заголовка HTTP, None - если формат некорректен."""
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+def is_conditional(headers: Mapping[str, str]) -> bool:
+    """Содержит ли запрос заголовки условного GET."""
+    return any(name in headers for name in CONDITIONAL_HEADERS)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Слабое сравнение ETag со списком из заголовка If-None-Match."""
+    if header.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def is_not_modified(
+    headers: Mapping[str, str], etag: str, last_modified: datetime
+) -> bool:
+    """Можно ли ответить 304 Not Modified.
+
+    If-None-Match имеет приоритет, If-Modified-Since учитывается
+    только в его отсутствие.
+    """
+    if (if_none_match := headers.get("if-none-match")) is not None:
+        return etag_matches(if_none_match, etag)
+    if (if_modified_since := headers.get("if-modified-since")) is not None:
+        since = parse_http_date(if_modified_since)
+        return since is not None and last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def is_range_fresh(
+    headers: Mapping[str, str], etag: str, last_modified: datetime
+) -> bool:
+    """Проверка If-Range: можно ли отдавать запрошенный диапазон.
+
+    Для ETag используется строгое сравнение, слабый ETag не совпадает никогда.
+    """
+    if (if_range := headers.get("if-range")) is None:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return not etag.startswith("W/") and if_range == etag
+    date = parse_http_date(if_range)
+    return date is not None and last_modified.replace(microsecond=0) == date
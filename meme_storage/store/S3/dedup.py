@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import io
+import tempfile
+import time
+import weakref
+from typing import AsyncIterator, BinaryIO, Mapping, Optional
+from uuid import uuid4
+
+from base.base_accessor import BaseAccessor
+from core.settings import FileSettings
+from miniopy_async.commonconfig import CopySource
+from store.cache.metadata import NOT_FOUND_CODES, USER_METADATA_PREFIX
+
+BLOB_METADATA = "blob"
+HASH_CHUNK_SIZE = 1024 * 1024
+USAGE_RECHECK_INTERVAL = 60
+
+
+class DedupAccessor(BaseAccessor):
+    """Хранение содержимого по хэшу с подсчётом ссылок.
+
+    Содержимое хранится один раз под ключом `{blob_prefix}/{sha256}`, а имя,
+    под которым объект загрузил пользователь, становится пустым объектом со
+    ссылкой на хэш в метаданных. Каждую ссылку отмечает пустой объект
+    `{ref_prefix}/{sha256}/{имя}`, и число таких отметок - счётчик ссылок.
+    Отметки, в отличие от счётчика в метаданных, не требуют атомарного
+    инкремента, а повторная запись отметки безопасна. Блоб удаляется вместе
+    с последней отметкой.
+
+    Настройка `upload_dedup` решает только, как сохраняются новые загрузки.
+    Ссылки, записанные раньше, разрешаются и снимаются, даже если
+    дедупликацию выключили на ходу: иначе вместо содержимого отдавался бы
+    пустой объект-ссылка, а блоб и отметка оставались бы после удаления.
+    Искать ссылки в бакете, где нет ни одного блоба, не нужно, см. `in_use`.
+
+    Операции над одним блобом сериализуются блокировкой в пределах процесса,
+    а между процессами запись ссылки и удаление блоба согласуются через
+    порядок запросов, см. `release`.
+    """
+
+    @property
+    def settings(self) -> FileSettings:
+        return self.app.config.file
+
+    def _init(self):
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._used: set[str] = set()
+        self._checked: dict[str, float] = {}
+        self._checks: dict[str, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.upload_dedup
+
+    def blob_key(self, digest: str) -> str:
+        return f"{self.settings.upload_dedup_blob_prefix}/{digest}"
+
+    def ref_prefix(self, digest: str) -> str:
+        return f"{self.settings.upload_dedup_ref_prefix}/{digest}/"
+
+    async def in_use(self, bucket: str) -> bool:
+        """Могут ли в бакете быть объекты-ссылки.
+
+        Пока дедупликация выключена и в бакете нет блобов, ссылок в нём нет,
+        и чтение, запись и удаление объекта обходятся без HEAD за ссылкой.
+        Наличие блобов проверяется одним запросом LIST. Найденные блобы
+        запоминаются навсегда, а их отсутствие перепроверяется раз
+        в `USAGE_RECHECK_INTERVAL` секунд: блобы мог записать процесс,
+        в котором дедупликацию включили раньше.
+        """
+        if self.enabled or bucket in self._used:
+            return True
+        checked = self._checked.get(bucket)
+        if checked is not None and time.monotonic() - checked < USAGE_RECHECK_INTERVAL:
+            return False
+        if (task := self._checks.get(bucket)) is None:
+            task = self._checks[bucket] = asyncio.create_task(self._has_blobs(bucket))
+            task.add_done_callback(lambda _: self._checks.pop(bucket, None))
+        if await asyncio.shield(task):
+            self._used.add(bucket)
+            return True
+        self._checked[bucket] = time.monotonic()
+        return False
+
+    @staticmethod
+    def referenced(headers: Mapping[str, str]) -> Optional[str]:
+        """Хэш блоба из заголовков `x-amz-meta-*` объекта-ссылки."""
+        return headers.get(f"{USER_METADATA_PREFIX}{BLOB_METADATA}")
+
+    async def reference(self, bucket: str, object_name: str) -> Optional[str]:
+        """Хэш блоба, на который ссылается объект.
+
+        Returns:
+            Optional[str]: Хэш или None, если объекта нет или он не ссылка.
+        """
+        if not await self.in_use(bucket):
+            return None
+        metadata = await self.app.store.metadata_cache.stat(bucket, object_name)
+        if metadata is None:
+            return None
+        return self.referenced(metadata.user_metadata)
+
+    async def version(self, bucket: str, object_name: str) -> Optional[str]:
+        """Версия содержимого объекта, которая меняется с каждой его записью.
+
+        Для ссылки это хэш блоба: у пустых объектов-ссылок ETag одинаковый.
+
+        Returns:
+            Optional[str]: Версия или None, если объекта нет.
+        """
+        metadata = await self.app.store.metadata_cache.stat(bucket, object_name)
+        if metadata is None:
+            return None
+        return self.referenced(metadata.user_metadata) or metadata.etag.strip('"')
+
+    async def resolve(self, bucket: str, object_name: str) -> str:
+        """Ключ, под которым хранится содержимое объекта.
+
+        Проверяется независимо от `enabled`: объект мог быть загружен, пока
+        дедупликация была включена. Непустой объект, который уже лежит
+        в кэше под своим именем, - не ссылка, и S3 не спрашивается,
+        иначе метаданные берутся из кэша метаданных.
+        """
+        store = self.app.store
+        cached = store.memory_cache.peek(bucket, object_name) or (
+            store.disk_cache.peek(bucket, object_name)
+        )
+        if cached is not None and cached.size:
+            return object_name
+        if digest := await self.reference(bucket, object_name):
+            return self.blob_key(digest)
+        return object_name
+
+    async def store_stream(
+        self,
+        bucket: str,
+        object_name: str,
+        content: AsyncIterator[bytes],
+        content_type: str,
+        previous: Optional[str],
+    ) -> list[str]:
+        """Сохранение объекта из потока.
+
+        Поток хэшируется по мере чтения и копится в памяти, а после
+        `upload_part_size` байт - во временном файле: ключ блоба известен
+        только после чтения всего тела.
+
+        Args:
+            previous (Optional[str]): Хэш блоба, на который объект ссылался
+                до записи, см. `reference`.
+
+        Returns:
+            list[str]: Ключи удалённых блобов, на которые больше нет ссылок.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(self.settings.upload_part_size) as spool:
+            async for chunk in content:
+                digest.update(chunk)
+                size += len(chunk)
+                spool.write(chunk)
+            spool.seek(0)
+            return await self._store(
+                bucket,
+                object_name,
+                spool,
+                size,
+                digest.hexdigest(),
+                content_type,
+                previous,
+            )
+
+    async def store_file(
+        self,
+        bucket: str,
+        object_name: str,
+        file: BinaryIO,
+        size: int,
+        content_type: str,
+        previous: Optional[str],
+    ) -> list[str]:
+        """Сохранение объекта из уже полученного файла.
+
+        Файл читается один раз: как и поток в `store_stream`, содержимое
+        хэшируется по мере чтения и копится во временном файле, который
+        держится в памяти только до `upload_part_size` байт.
+
+        Args:
+            previous (Optional[str]): См. `store_stream`.
+
+        Returns:
+            list[str]: Ключи удалённых блобов, на которые больше нет ссылок.
+        """
+        with tempfile.SpooledTemporaryFile(self.settings.upload_part_size) as spool:
+            digest = await asyncio.to_thread(self._spool_file, file, spool)
+            return await self._store(
+                bucket, object_name, spool, size, digest, content_type, previous
+            )
+
+    async def release(self, bucket: str, object_name: str, digest: str) -> list[str]:
+        """Снимает ссылку объекта на блоб.
+
+        Другой процесс может в это же время записать новую ссылку на тот же
+        блоб. Писатель сначала ставит отметку и только потом проверяет,
+        что блоб есть, а если его уже удалили, загружает заново. Удаляющий
+        перед удалением копирует блоб на сервере S3 во временный ключ и после
+        удаления ещё раз читает отметки: если появилась новая, её писатель
+        мог застать блоб до удаления, и блоб восстанавливается из копии.
+        Если отметок нет, писатель, поставивший отметку позже, удаления
+        не пропустит. Если запрос упал посередине, временная копия остаётся
+        под префиксом блобов: лишний объект безопаснее потерянного.
+
+        Returns:
+            list[str]: Ключ блоба, если ссылок на него не осталось и он удалён.
+        """
+        client = self.app.store.minio.client
+        prefix = self.ref_prefix(digest)
+        key = self.blob_key(digest)
+        async with self._lock(bucket, digest):
+            await client.remove_object(bucket, f"{prefix}{object_name}")
+            if await client.list_objects(bucket, prefix=prefix):
+                return []
+            backup = f"{key}.{uuid4().hex}"
+            try:
+                await client.copy_object(bucket, backup, CopySource(bucket, key))
+            except Exception as e:
+                if getattr(e, "code", None) in NOT_FOUND_CODES:
+                    return []
+                raise
+            await client.remove_object(bucket, key)
+            released = [key]
+            if await client.list_objects(bucket, prefix=prefix):
+                await client.copy_object(bucket, key, CopySource(bucket, backup))
+                released = []
+            await client.remove_object(bucket, backup)
+        return released
+
+    async def _store(
+        self,
+        bucket: str,
+        object_name: str,
+        data: BinaryIO,
+        size: int,
+        digest: str,
+        content_type: str,
+        previous: Optional[str],
+    ) -> list[str]:
+        """Запись ссылки, а если блоба нет, то и блоба.
+
+        Отметка ставится до проверки блоба, см. `release`.
+        """
+        client = self.app.store.minio.client
+        async with self._lock(bucket, digest):
+            await self._put_empty(bucket, f"{self.ref_prefix(digest)}{object_name}")
+            if not await self._exists(bucket, self.blob_key(digest)):
+                await client.put_object(
+                    bucket_name=bucket,
+                    object_name=self.blob_key(digest),
+                    data=data,
+                    length=size,
+                    content_type=content_type,
+                    part_size=self.settings.upload_part_size,
+                    num_parallel_uploads=self.settings.upload_parts_in_flight,
+                )
+            await self._put_empty(
+                bucket, object_name, content_type, {BLOB_METADATA: digest}
+            )
+        self._used.add(bucket)
+        if previous is None or previous == digest:
+            return []
+        return await self.release(bucket, object_name, previous)
+
+    def _lock(self, bucket: str, digest: str) -> asyncio.Lock:
+        if (lock := self._locks.get((bucket, digest))) is None:
+            lock = self._locks[(bucket, digest)] = asyncio.Lock()
+        return lock
+
+    async def _has_blobs(self, bucket: str) -> bool:
+        prefix = f"{self.settings.upload_dedup_blob_prefix}/"
+        return bool(await self.app.store.minio.client.list_objects(bucket, prefix))
+
+    async def _exists(self, bucket: str, key: str) -> bool:
+        try:
+            await self.app.store.minio.client.stat_object(bucket, key)
+        except Exception as e:
+            if getattr(e, "code", None) in NOT_FOUND_CODES:
+                return False
+            raise
+        return True
+
+    async def _put_empty(
+        self,
+        bucket: str,
+        key: str,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[dict] = None,
+    ):
+        await self.app.store.minio.client.put_object(
+            bucket_name=bucket,
+            object_name=key,
+            data=io.BytesIO(b""),
+            length=0,
+            content_type=content_type,
+            metadata=metadata,
+        )
+
+    @staticmethod
+    def _spool_file(file: BinaryIO, spool: BinaryIO) -> str:
+        file.seek(0)
+        digest = hashlib.sha256()
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            spool.write(chunk)
+        file.seek(0)
+        spool.seek(0)
+        return digest.hexdigest()
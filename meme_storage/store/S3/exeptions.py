@@ -1,3 +1,5 @@
+from starlette import status
+
 from base.base_exception import ExceptionBase
 
 
@@ -18,3 +20,12 @@ class S3UnknownException(ExceptionBase):
 
 class S3BucketNotFoundException(ExceptionBase):
     args = ("Запрошенный бакет не найден в S3 сервере.",)
+
+
+class S3RangeNotSatisfiableException(ExceptionBase):
+    args = ("Запрошенный диапазон байт находится за пределами объекта.",)
+    status_code = status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+
+
+class S3DeleteObjectException(ExceptionBase):
+    args = ("Не удалось удалить объект из S3 сервера.",)
@@ -0,0 +1,214 @@
+"""Объединение одновременных скачиваний одного объекта (single-flight)."""
+
+import asyncio
+from typing import AsyncIterator, Callable, Optional
+
+_END = object()
+_DETACHED = object()
+
+Resume = Callable[[int], AsyncIterator[bytes]]
+
+
+class Flight:
+    """Одно чтение объекта из S3, раздаваемое нескольким клиентам.
+
+    Каждый подписчик получает собственную ограниченную очередь. Чтение
+    из S3 идёт со скоростью самого быстрого подписчика: подписчик, очередь
+    которого переполнена, отключается от общего потока и дочитывает объект
+    отдельным запросом с того места, где остановился. Начало объекта
+    (не больше `replay_limit` байт) хранится, чтобы к потоку можно было
+    присоединиться уже после начала чтения.
+
+    Attributes:
+        ready (asyncio.Future): Завершается, когда S3 вернул заголовки ответа.
+        headers (dict): Заголовки ответа клиенту, заполняются при старте.
+        joinable (bool): Можно ли ещё присоединиться к потоку.
+    """
+
+    def __init__(
+        self, replay_limit: int, queue_size: int, on_close: Callable[[], None]
+    ):
+        self.ready = asyncio.get_running_loop().create_future()
+        self.ready.add_done_callback(lambda future: future.exception())
+        self.headers: dict = {}
+        self.joinable = True
+        self._replay: list[bytes] = []
+        self._replay_size = 0
+        self._replay_limit = replay_limit
+        self._queue_size = queue_size
+        self._queues: dict[asyncio.Queue, None] = {}
+        self._space = asyncio.Event()
+        self._error: Optional[BaseException] = None
+        self._on_close = on_close
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, source: AsyncIterator[bytes], headers: dict):
+        self.headers.update(headers)
+        self.ready.set_result(None)
+        self._task = asyncio.create_task(self._pump(source))
+
+    def fail(self, error: BaseException):
+        """Чтение не началось.
+
+        Поток снимается с регистрации. Ожидающие запросы получают ошибку
+        S3, а если ведущий запрос отменён, например клиент отключился,
+        они не смогут присоединиться и прочитают объект сами.
+        """
+        self.close()
+        if isinstance(error, Exception):
+            self.ready.set_exception(error)
+        else:
+            self.ready.set_result(None)
+
+    def close(self):
+        """Запрещает новым запросам присоединяться к этому потоку."""
+        if self.joinable:
+            self.joinable = False
+            self._replay = []
+            self._on_close()
+
+    def subscribe(self, resume: Resume) -> Optional[AsyncIterator[bytes]]:
+        """Подписка на поток.
+
+        Очередь регистрируется сразу, а не при первой итерации,
+        чтобы ни один фрагмент не был потерян.
+
+        Args:
+            resume (Resume): Чтение объекта с заданного смещения,
+                если подписчик отстал или общий поток оборвался.
+
+        Returns:
+            Optional[AsyncIterator[bytes]]: Содержимое объекта или None,
+                если присоединиться уже нельзя.
+        """
+        if not self.joinable:
+            return None
+        return self._consume(self._register(), list(self._replay), resume)
+
+    async def follow(self, resume: Resume) -> Optional[AsyncIterator[bytes]]:
+        """Подписка запроса, присоединившегося к потоку.
+
+        Пока S3 не ответил, очередь регистрируется до ожидания ответа:
+        иначе небольшой объект мог бы быть прочитан целиком и поток закрыт
+        раньше, чем ожидающий запрос успеет подписаться.
+
+        Returns:
+            Optional[AsyncIterator[bytes]]: Содержимое объекта или None,
+                если ведущий запрос отменён до ответа S3 и объект нужно
+                прочитать самому.
+
+        Raises:
+            Exception: Ошибка, с которой не удалось начать чтение.
+        """
+        if self.ready.done():
+            return self.subscribe(resume)
+        queue = self._register()
+        try:
+            await asyncio.shield(self.ready)
+        except BaseException:
+            self._queues.pop(queue, None)
+            raise
+        if self._task is None:
+            self._queues.pop(queue, None)
+            return None
+        return self._consume(queue, [], resume)
+
+    def _register(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._queues[queue] = None
+        self._space.set()
+        return queue
+
+    async def _consume(
+        self, queue: asyncio.Queue, replay: list[bytes], resume: Resume
+    ) -> AsyncIterator[bytes]:
+        position = 0
+        try:
+            for chunk in replay:
+                position += len(chunk)
+                yield chunk
+            while (item := await queue.get()) is not _END:
+                self._space.set()
+                if item is _DETACHED:
+                    break
+                position += len(item)
+                yield item
+            else:
+                if self._error is None:
+                    return
+        finally:
+            self._queues.pop(queue, None)
+            self._space.set()
+        async for chunk in resume(position):
+            yield chunk
+
+    async def _pump(self, source: AsyncIterator[bytes]):
+        try:
+            async for chunk in source:
+                while self._queues and all(
+                    queue.qsize() >= self._queue_size for queue in self._queues
+                ):
+                    self._space.clear()
+                    await self._space.wait()
+                if self.joinable:
+                    self._replay_size += len(chunk)
+                    if self._replay_size <= self._replay_limit:
+                        self._replay.append(chunk)
+                    else:
+                        self.close()
+                for queue in list(self._queues):
+                    if queue.qsize() >= self._queue_size:
+                        del self._queues[queue]
+                        queue.put_nowait(_DETACHED)
+                    else:
+                        queue.put_nowait(chunk)
+                if not self._queues and not self.joinable:
+                    break
+        except Exception as error:
+            self._error = error
+        except BaseException as error:
+            self._error = error
+            raise
+        finally:
+            self.close()
+            await source.aclose()
+            for queue in self._queues:
+                queue.put_nowait(_END)
+
+
+class SingleFlight:
+    """Реестр активных чтений объектов.
+
+    Args:
+        replay_limit (int): Сколько байт начала объекта хранить для
+            присоединяющихся запросов.
+        queue_size (int): Максимум фрагментов в очереди одного подписчика.
+    """
+
+    def __init__(self, replay_limit: int, queue_size: int):
+        self.replay_limit = replay_limit
+        self.queue_size = queue_size
+        self._flights: dict[tuple[str, str], Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def join(self, bucket: str, object_name: str) -> Optional[Flight]:
+        flight = self._flights.get((bucket, object_name))
+        if flight is not None and flight.joinable:
+            return flight
+        return None
+
+    def lead(self, bucket: str, object_name: str) -> Flight:
+        key = (bucket, object_name)
+        flight = Flight(
+            self.replay_limit,
+            self.queue_size,
+            lambda: self._flights.get(key) is flight and self._flights.pop(key),
+        )
+        self._flights[key] = flight
+        return flight
+
+    def forget(self, bucket: str, object_name: str):
+        if flight := self._flights.get((bucket, object_name)):
+            flight.close()
@@ -0,0 +1,66 @@
+"""Подписанные ссылки для скачивания объектов напрямую из S3."""
+
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional
+
+from miniopy_async import Minio
+
+MAX_URLS = 10000
+
+
+class PresignedUrls:
+    """Кэш подписанных ссылок на скачивание объектов.
+
+    Подпись не требует запросов к S3, но считается заново на каждый вызов,
+    поэтому ссылка переиспользуется, пока до истечения её срока остаётся
+    больше `margin` секунд. Одна и та же ссылка для всех клиентов к тому же
+    позволяет браузерам и CDN кэшировать сам объект. Хранится не больше
+    `MAX_URLS` последних ссылок.
+    """
+
+    def __init__(self):
+        self._urls: OrderedDict[tuple, tuple[str, float]] = OrderedDict()
+
+    async def get(
+        self,
+        client: Minio,
+        bucket: str,
+        object_name: str,
+        headers: dict[str, str],
+        expires: int,
+        margin: int,
+        host: Optional[str] = None,
+    ) -> str:
+        """Ссылка на GET объекта.
+
+        Args:
+            client (Minio): Клиент, ключами которого подписывается ссылка.
+            bucket (str): Имя бакета.
+            object_name (str): Ключ объекта.
+            headers (dict[str, str]): Заголовки, которые S3 подставит
+                в ответ, например `response-content-disposition`.
+            expires (int): Срок действия ссылки в секундах.
+            margin (int): За сколько секунд до истечения ссылка заменяется.
+            host (Optional[str]): Адрес S3 для клиентов, если он отличается
+                от адреса, по которому к S3 обращается сервис.
+        """
+        key = (bucket, object_name, host, *sorted(headers.items()))
+        now = time.monotonic()
+        if (cached := self._urls.get(key)) and cached[1] - now > margin:
+            self._urls.move_to_end(key)
+            return cached[0]
+        url = await client.get_presigned_url(
+            "GET",
+            bucket,
+            object_name,
+            expires=timedelta(seconds=expires),
+            response_headers=dict(headers),
+            change_host=host,
+        )
+        self._urls.pop(key, None)
+        self._urls[key] = (url, now + expires)
+        while len(self._urls) > MAX_URLS:
+            self._urls.popitem(last=False)
+        return url
@@ -0,0 +1,117 @@
+"""Разбор заголовка HTTP Range (RFC 9110, раздел 14)."""
+
+from typing import AsyncIterator, Callable, NamedTuple, Optional
+from uuid import uuid4
+
+from store.S3.exeptions import S3RangeNotSatisfiableException
+
+MAX_RANGES = 16
+
+
+class ByteRange(NamedTuple):
+    """Диапазон байт объекта, границы включительно."""
+
+    start: int
+    end: int
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+    def content_range(self, size: int) -> str:
+        return f"bytes {self.start}-{self.end}/{size}"
+
+
+def parse_range_header(header: str, size: int) -> Optional[list[ByteRange]]:
+    """Разбирает заголовок Range для объекта заданного размера.
+
+    Пересекающиеся и смежные диапазоны объединяются.
+
+    Args:
+        header (str): Значение заголовка Range.
+        size (int): Размер объекта в байтах.
+
+    Returns:
+        Optional[list[ByteRange]]: Отсортированные диапазоны или None,
+            если заголовок некорректен и должен быть проигнорирован.
+
+    Raises:
+        S3RangeNotSatisfiableException: Ни один диапазон не попадает в объект.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs.strip():
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash or not (first + last).isdigit():
+            return None
+        if not first:
+            suffix = int(last)
+            if suffix and size:
+                ranges.append(ByteRange(max(size - suffix, 0), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start < size:
+            ranges.append(ByteRange(start, min(end, size - 1)))
+    if not ranges:
+        raise S3RangeNotSatisfiableException(
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    ranges.sort()
+    merged = [ranges[0]]
+    for current in ranges[1:]:
+        previous = merged[-1]
+        if current.start <= previous.end + 1:
+            merged[-1] = ByteRange(previous.start, max(previous.end, current.end))
+        else:
+            merged.append(current)
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+class MultipartByteranges:
+    """Разметка ответа multipart/byteranges для нескольких диапазонов.
+
+    Attributes:
+        boundary (str): Разделитель частей.
+        parts (list[tuple[bytes, ByteRange]]): Заголовок и диапазон каждой части.
+        closing (bytes): Завершающий разделитель.
+    """
+
+    def __init__(self, ranges: list[ByteRange], size: int, content_type: str):
+        self.boundary = uuid4().hex
+        self.parts = [
+            (
+                f"--{self.boundary}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Range: {byte_range.content_range(size)}\r\n\r\n".encode(),
+                byte_range,
+            )
+            for byte_range in ranges
+        ]
+        self.closing = f"--{self.boundary}--\r\n".encode()
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/byteranges; boundary={self.boundary}"
+
+    @property
+    def length(self) -> int:
+        """Полная длина тела ответа в байтах."""
+        parts = sum(len(head) + part.length + 2 for head, part in self.parts)
+        return parts + len(self.closing)
+
+    async def stream(
+        self, fetch: Callable[[ByteRange], AsyncIterator[bytes]]
+    ) -> AsyncIterator[bytes]:
+        """Тело ответа, части которого по очереди читаются через `fetch`."""
+        for head, byte_range in self.parts:
+            yield head
+            async for chunk in fetch(byte_range):
+                yield chunk
+            yield b"\r\n"
+        yield self.closing
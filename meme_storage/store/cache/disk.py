@@ -0,0 +1,365 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Callable, Optional
+from uuid import uuid4
+
+from base.base_accessor import BaseAccessor
+from core.settings import CacheSettings
+from store.S3.conditions import format_http_date, parse_http_date
+from store.S3.ranges import ByteRange
+
+CHUNK_SIZE = 64 * 1024
+TOUCH_INTERVAL = 60
+
+
+@dataclass(slots=True)
+class DiskEntry:
+    """Объект, сохранённый в локальном дисковом кэше.
+
+    Attributes:
+        path (str): Путь к файлу с содержимым объекта.
+        etag (str): ETag в кавычках, как он отдаётся клиенту.
+        last_modified (datetime): Время последнего изменения объекта.
+        stat (os.stat_result): Результат stat файла.
+        touched (float): Когда в последний раз обновлялось время доступа.
+        verified (bool): Сверен ли ETag с S3. Записи, восстановленные
+            при старте, сверяются при первом чтении.
+    """
+
+    path: str
+    etag: str
+    last_modified: datetime
+    stat: os.stat_result
+    touched: float = 0.0
+    verified: bool = True
+
+    @property
+    def size(self) -> int:
+        return self.stat.st_size
+
+
+class DiskFile:
+    """Открытый файл записи дискового кэша.
+
+    Файл открывается до начала ответа. Запись могут вытеснить или
+    инвалидировать, и её файл будет удалён, но уже открытый файл читается
+    до конца, пока его не закроют через `release`.
+
+    Attributes:
+        entry (DiskEntry): Запись кэша.
+        file (BinaryIO): Открытый файл записи.
+    """
+
+    __slots__ = ("entry", "file")
+
+    def __init__(self, entry: DiskEntry, file: BinaryIO):
+        self.entry = entry
+        self.file = file
+
+    @property
+    def etag(self) -> str:
+        return self.entry.etag
+
+    @property
+    def last_modified(self) -> datetime:
+        return self.entry.last_modified
+
+    @property
+    def size(self) -> int:
+        return self.entry.size
+
+    async def iter_range(self, byte_range: ByteRange) -> AsyncIterator[bytes]:
+        offset, remaining = byte_range.start, byte_range.length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(
+                os.pread, self.file.fileno(), min(CHUNK_SIZE, remaining), offset
+            )
+            if not chunk:
+                break
+            offset += len(chunk)
+            remaining -= len(chunk)
+            yield chunk
+
+    def read(self) -> bytes:
+        return os.pread(self.file.fileno(), self.size, 0)
+
+    def release(self):
+        self.file.close()
+
+
+class DiskCacheAccessor(BaseAccessor):
+    """Второй уровень кэша объектов на локальном диске.
+
+    Файлы отдаются потоком кусками по `CHUNK_SIZE`, которые читаются
+    в потоке. Starlette отдаёт файл без копирования только через расширение
+    ASGI `http.response.pathsend`, которого нет у uvicorn, так что FileResponse
+    не быстрее, а открыть файл он смог бы только после отправки заголовков:
+    удаление файла между ними обрывало бы ответ 200. Запись атомарна: содержимое пишется
+    во временный файл и переименовывается только после fsync. Рядом с каждым
+    объектом лежит файл `.json` с метаданными, по которым индекс
+    восстанавливается при старте. Вытесняются давно не читавшиеся объекты.
+
+    Каждая запись объекта попадает в новый файл, поэтому файлы удаляются
+    в потоке без ожидания и не могут задеть записанный позже объект.
+    """
+
+    @property
+    def settings(self) -> CacheSettings:
+        return self.app.config.cache
+
+    def _init(self):
+        self._entries: OrderedDict[tuple[str, str], DiskEntry] = OrderedDict()
+        self._epoch = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def connect(self):
+        if self.settings.disk_cache_enabled:
+            await asyncio.to_thread(self._rebuild)
+            await self._evict()
+            self.logger.info(
+                f"{self.__class__.__name__}: восстановлено {len(self._entries)}"
+                f" объектов, {self.size} байт"
+            )
+        self.logger.info(f"{self.__class__.__name__} успешно подключено")
+
+    @property
+    def epoch(self) -> int:
+        """Счётчик инвалидаций, см. `MemoryCacheAccessor.epoch`."""
+        return self._epoch
+
+    def admits(self, size: Optional[int]) -> bool:
+        """Может ли объект такого размера быть сохранён на диск."""
+        return (
+            self.settings.disk_cache_enabled
+            and size is not None
+            and size <= self.settings.disk_cache_max_object_size
+            and size <= self.settings.disk_cache_max_bytes
+        )
+
+    async def get(self, bucket: str, object_name: str) -> Optional[DiskFile]:
+        """Объект из кэша с уже открытым файлом.
+
+        Пока сервис не работал, объект могли изменить, поэтому запись,
+        восстановленная при старте, при первом чтении сверяется с S3
+        по ETag и при расхождении удаляется.
+
+        Returns:
+            Optional[DiskFile]: Открытый файл объекта, который нужно закрыть
+                через `release`, или None, если объекта в кэше нет.
+        """
+        if not self.settings.disk_cache_enabled:
+            return None
+        key = (bucket, object_name)
+        if (entry := self._entries.get(key)) is None or not (
+            entry.verified or await self._verify(key, entry)
+        ):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        now = time.monotonic()
+        touch = now - entry.touched > TOUCH_INTERVAL
+        if touch:
+            entry.touched = now
+        try:
+            file = await asyncio.to_thread(self._reopen, entry.path, touch)
+        except FileNotFoundError:
+            if self._entries.get(key) is entry:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return DiskFile(entry, file)
+
+    def peek(self, bucket: str, object_name: str) -> Optional[DiskEntry]:
+        """Сверенная с S3 запись без учёта в статистике и в порядке вытеснения."""
+        if not self.settings.disk_cache_enabled:
+            return None
+        entry = self._entries.get((bucket, object_name))
+        return entry if entry is not None and entry.verified else None
+
+    async def fill(
+        self,
+        content: AsyncIterator[bytes],
+        bucket: str,
+        object_name: str,
+        etag: str,
+        last_modified: datetime,
+        epoch: int,
+    ) -> AsyncIterator[bytes]:
+        """Пропускает поток через себя, одновременно записывая его на диск.
+
+        Объект попадает в кэш только если поток дочитан до конца
+        и с момента начала чтения не было инвалидаций.
+        """
+        path = self._path(bucket, object_name)
+        temp = f"{path}.tmp"
+        file = await asyncio.to_thread(self._open, temp)
+        try:
+            async for chunk in content:
+                await asyncio.to_thread(file.write, chunk)
+                yield chunk
+        except BaseException:
+            self._discard(self._abort, file, temp)
+            raise
+        if epoch != self._epoch:
+            await asyncio.to_thread(self._abort, file, temp)
+            return
+        meta = {
+            "bucket": bucket,
+            "object_name": object_name,
+            "etag": etag,
+            "last_modified": format_http_date(last_modified),
+        }
+        stat = await asyncio.to_thread(self._commit, file, temp, path, meta)
+        if epoch != self._epoch:
+            await asyncio.to_thread(self._unlink, path)
+            return
+        entry = DiskEntry(path, etag, last_modified, stat)
+        if previous := self._register((bucket, object_name), entry):
+            self._discard(self._unlink, previous.path)
+        await self._evict()
+
+    def invalidate(self, bucket: str, object_name: str):
+        self._epoch += 1
+        if (bucket, object_name) in self._entries:
+            self._drop((bucket, object_name))
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _path(self, bucket: str, object_name: str) -> str:
+        digest = hashlib.sha1(f"{bucket}/{object_name}".encode()).hexdigest()
+        return os.path.join(
+            self.settings.disk_cache_path, digest[:2], f"{digest}.{uuid4().hex}"
+        )
+
+    async def _verify(self, key: tuple[str, str], entry: DiskEntry) -> bool:
+        metadata = await self.app.store.metadata_cache.stat(*key)
+        if self._entries.get(key) is not entry:
+            return False
+        if metadata is None or metadata.etag != entry.etag:
+            self.invalidate(*key)
+            return False
+        entry.verified = True
+        return True
+
+    def _register(
+        self, key: tuple[str, str], entry: DiskEntry
+    ) -> Optional[DiskEntry]:
+        """Добавляет запись и возвращает прежнюю запись объекта, если она была."""
+        if previous := self._entries.pop(key, None):
+            self.size -= previous.size
+        self._entries[key] = entry
+        self.size += entry.size
+        return previous
+
+    def _drop(self, key: tuple[str, str]):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        self._discard(self._unlink, entry.path)
+
+    @staticmethod
+    def _discard(func: Callable[..., None], *args):
+        """Удаляет файлы в потоке, не дожидаясь этого."""
+        asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _evict(self):
+        evicted = []
+        while self.size > self.settings.disk_cache_max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+            evicted.append(entry.path)
+        if evicted:
+            await asyncio.to_thread(lambda: [self._unlink(path) for path in evicted])
+
+    @staticmethod
+    def _reopen(path: str, touch: bool) -> BinaryIO:
+        """Открывает файл записи на чтение, обновляя время доступа, если нужно."""
+        file = open(path, "rb")
+        if touch:
+            os.utime(file.fileno())
+        return file
+
+    @staticmethod
+    def _open(path: str) -> BinaryIO:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, "wb")
+
+    @classmethod
+    def _abort(cls, file: BinaryIO, temp: str):
+        file.close()
+        cls._unlink(temp)
+
+    @staticmethod
+    def _commit(file: BinaryIO, temp: str, path: str, meta: dict) -> os.stat_result:
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+        meta_temp = f"{temp}.json"
+        with open(meta_temp, "w") as meta_file:
+            json.dump(meta, meta_file)
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.replace(temp, path)
+        os.replace(meta_temp, f"{path}.json")
+        return os.stat(path)
+
+    @staticmethod
+    def _unlink(path: str):
+        for name in (path, f"{path}.json"):
+            try:
+                os.unlink(name)
+            except FileNotFoundError:
+                pass
+
+    def _rebuild(self):
+        """Восстанавливает индекс по содержимому каталога кэша.
+
+        Незавершённые временные файлы и объекты без метаданных удаляются.
+        """
+        root = self.settings.disk_cache_path
+        os.makedirs(root, exist_ok=True)
+        found = []
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.endswith(".tmp") or name.endswith(".tmp.json"):
+                    self._unlink(path)
+                    continue
+                if name.endswith(".json"):
+                    if not os.path.exists(path.removesuffix(".json")):
+                        self._unlink(path)
+                    continue
+                try:
+                    with open(f"{path}.json") as meta_file:
+                        meta = json.load(meta_file)
+                    last_modified = parse_http_date(meta["last_modified"])
+                    stat = os.stat(path)
+                except (OSError, ValueError, KeyError):
+                    self._unlink(path)
+                    continue
+                entry = DiskEntry(
+                    path, meta["etag"], last_modified, stat, verified=False
+                )
+                found.append(
+                    (stat.st_atime, (meta["bucket"], meta["object_name"]), entry)
+                )
+        for _, key, entry in sorted(found, key=lambda item: item[0]):
+            if previous := self._register(key, entry):
+                self._unlink(previous.path)
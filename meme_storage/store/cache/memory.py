@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from base.base_accessor import BaseAccessor
+from core.settings import CacheSettings
+from store.S3.ranges import ByteRange
+
+
+@dataclass(slots=True)
+class CachedObject:
+    """Объект, целиком хранящийся в памяти процесса.
+
+    Attributes:
+        body (bytes): Содержимое объекта.
+        etag (str): ETag в кавычках, как он отдаётся клиенту.
+        last_modified (datetime): Время последнего изменения объекта.
+    """
+
+    body: bytes
+    etag: str
+    last_modified: datetime
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+    async def iter_range(self, byte_range: ByteRange) -> AsyncIterator[bytes]:
+        yield self.body[byte_range.start : byte_range.end + 1]
+
+
+class MemoryCacheAccessor(BaseAccessor):
+    """LRU кэш горячих объектов, ограниченный суммарным размером в байтах.
+
+    Кэш живёт внутри процесса, поэтому инвалидация видна только
+    в этом же процессе: `S3Accessor` сбрасывает запись при каждой записи
+    или удалении объекта.
+    """
+
+    @property
+    def settings(self) -> CacheSettings:
+        return self.app.config.cache
+
+    def _init(self):
+        self._entries: OrderedDict[tuple[str, str], CachedObject] = OrderedDict()
+        self._epoch = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def epoch(self) -> int:
+        """Счётчик инвалидаций.
+
+        Загрузка, начатая до инвалидации, не должна попасть в кэш,
+        поэтому `put` принимает эпоху, в которой объект был прочитан.
+        """
+        return self._epoch
+
+    def admits(self, size: Optional[int]) -> bool:
+        """Может ли объект такого размера быть помещён в кэш."""
+        return (
+            self.settings.memory_cache_enabled
+            and size is not None
+            and size <= self.settings.memory_cache_max_object_size
+            and size <= self.settings.memory_cache_max_bytes
+        )
+
+    def get(self, bucket: str, object_name: str) -> Optional[CachedObject]:
+        if not self.settings.memory_cache_enabled:
+            return None
+        key = (bucket, object_name)
+        if (cached := self._entries.get(key)) is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return cached
+
+    def peek(self, bucket: str, object_name: str) -> Optional[CachedObject]:
+        """Объект из кэша без учёта в статистике и в порядке вытеснения."""
+        if not self.settings.memory_cache_enabled:
+            return None
+        return self._entries.get((bucket, object_name))
+
+    def put(self, bucket: str, object_name: str, cached: CachedObject, epoch: int):
+        if epoch != self._epoch or not self.admits(cached.size):
+            return
+        key = (bucket, object_name)
+        if previous := self._entries.pop(key, None):
+            self.size -= previous.size
+        self._entries[key] = cached
+        self.size += cached.size
+        while self.size > self.settings.memory_cache_max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    async def fill(
+        self,
+        content: AsyncIterator[bytes],
+        bucket: str,
+        object_name: str,
+        etag: str,
+        last_modified: datetime,
+        epoch: int,
+    ) -> AsyncIterator[bytes]:
+        """Пропускает поток через себя и кэширует объект, если он дочитан."""
+        chunks = []
+        async for chunk in content:
+            chunks.append(chunk)
+            yield chunk
+        cached = CachedObject(b"".join(chunks), etag, last_modified)
+        self.put(bucket, object_name, cached, epoch)
+
+    def invalidate(self, bucket: str, object_name: str):
+        self._epoch += 1
+        if cached := self._entries.pop((bucket, object_name), None):
+            self.size -= cached.size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
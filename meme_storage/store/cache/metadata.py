@@ -0,0 +1,175 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Mapping, Optional
+
+from base.base_accessor import BaseAccessor
+from core.settings import CacheSettings
+from store.S3.conditions import parse_http_date
+
+NOT_FOUND_CODES = ("NoSuchKey", "ResourceNotFound")
+USER_METADATA_PREFIX = "x-amz-meta-"
+
+
+@dataclass(slots=True)
+class ObjectMetadata:
+    """Метаданные объекта S3.
+
+    Attributes:
+        size (int): Размер объекта в байтах.
+        etag (str): ETag в кавычках, как он отдаётся клиенту.
+        content_type (str): Content-Type объекта.
+        last_modified (datetime): Время последнего изменения объекта.
+        user_metadata (dict[str, str]): Заголовки `x-amz-meta-*`
+            в нижнем регистре.
+    """
+
+    size: int
+    etag: str
+    content_type: str
+    last_modified: datetime
+    user_metadata: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_headers(
+        cls, headers: Mapping[str, str], size: Optional[int]
+    ) -> Optional["ObjectMetadata"]:
+        """Метаданные из заголовков ответа GetObject или HeadObject.
+
+        Returns:
+            Optional[ObjectMetadata]: None, если в ответе нет размера,
+                ETag или времени изменения.
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if size is None or not etag or not last_modified:
+            return None
+        return cls(
+            size,
+            etag,
+            headers.get("Content-Type", "application/octet-stream"),
+            parse_http_date(last_modified),
+            _user_metadata(headers),
+        )
+
+
+@dataclass(slots=True)
+class _Entry:
+    metadata: Optional[ObjectMetadata]
+    expires: float
+
+
+class MetadataCacheAccessor(BaseAccessor):
+    """Кэш метаданных объектов с ограниченным временем жизни.
+
+    Запись живёт `metadata_cache_ttl` секунд, а отсутствие объекта
+    запоминается на `metadata_cache_negative_ttl` секунд, чтобы повторные
+    запросы несуществующих ключей не доходили до S3. Свои записи и удаления
+    `S3Accessor` отражает в кэше сразу, изменения, сделанные другими
+    процессами, становятся видны не позже, чем истечёт время жизни записи.
+    """
+
+    @property
+    def settings(self) -> CacheSettings:
+        return self.app.config.cache
+
+    def _init(self):
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def epoch(self) -> int:
+        """Счётчик инвалидаций, как у `MemoryCacheAccessor.epoch`."""
+        return self._epoch
+
+    def get(self, bucket: str, object_name: str) -> Optional[_Entry]:
+        """Запись кэша, `metadata` которой None, если объекта нет."""
+        if not self.settings.metadata_cache_enabled:
+            return None
+        key = (bucket, object_name)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    async def stat(self, bucket: str, object_name: str) -> Optional[ObjectMetadata]:
+        """Метаданные объекта из кэша или из S3.
+
+        Returns:
+            Optional[ObjectMetadata]: None, если объекта нет.
+        """
+        if entry := self.get(bucket, object_name):
+            return entry.metadata
+        epoch = self._epoch
+        try:
+            stat = await self.app.store.minio.client.stat_object(
+                bucket_name=bucket,
+                object_name=object_name,
+            )
+        except Exception as e:
+            if getattr(e, "code", None) in NOT_FOUND_CODES:
+                self.put(bucket, object_name, None, epoch)
+                return None
+            raise
+        metadata = ObjectMetadata(
+            stat.size,
+            f'"{stat.etag}"',
+            stat.content_type,
+            stat.last_modified,
+            _user_metadata(stat.metadata or {}),
+        )
+        self.put(bucket, object_name, metadata, epoch)
+        return metadata
+
+    def put(
+        self,
+        bucket: str,
+        object_name: str,
+        metadata: Optional[ObjectMetadata],
+        epoch: int,
+    ):
+        """Запоминает метаданные объекта или, если `metadata` None, его отсутствие."""
+        if epoch != self._epoch or not self.settings.metadata_cache_enabled:
+            return
+        if metadata is None:
+            ttl = self.settings.metadata_cache_negative_ttl
+        else:
+            ttl = self.settings.metadata_cache_ttl
+        if ttl <= 0:
+            return
+        key = (bucket, object_name)
+        self._entries.pop(key, None)
+        self._entries[key] = _Entry(metadata, time.monotonic() + ttl)
+        while len(self._entries) > self.settings.metadata_cache_max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, bucket: str, object_name: str):
+        self._epoch += 1
+        self._entries.pop((bucket, object_name), None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def _user_metadata(headers: Mapping[str, str]) -> dict[str, str]:
+    return {
+        name.lower(): value
+        for name, value in headers.items()
+        if name.lower().startswith(USER_METADATA_PREFIX)
+    }
@@ -1,23 +1,254 @@
+import asyncio
+import time
 from typing import Optional
 
+import aiohttp
 
 from base.base_accessor import BaseAccessor
+from core.metrics import Metrics
 from core.settings import MinioSettings
 from miniopy_async import Minio
+from store.S3.exeptions import S3ConnectionErrorException
+from store.database.resilience import (
+    Backoff,
+    CircuitBreaker,
+    LatencyWindow,
+    is_replayable,
+    is_transient,
+)
+
+
+class PooledMinio(Minio):
+    """Клиент Minio, выполняющий все запросы через общий пул соединений.
+
+    miniopy_async создаёт новый `aiohttp.ClientSession` почти на каждый вызов,
+    поэтому каждый запрос к S3 начинается с нового TCP (и TLS) рукопожатия.
+    Здесь все запросы перенаправляются в одну долгоживущую сессию.
+
+    Потоковые запросы (`get_object`) должны явно передавать общую сессию,
+    тогда ответ возвращается без вычитывания тела. Для остальных запросов
+    тело читается сразу, чтобы соединение вернулось в пул.
+
+    Идемпотентные запросы, упавшие с сетевой ошибкой или ответом 5xx,
+    повторяются с задержкой `backoff`, если их тело можно отправить ещё раз
+    (см. `is_replayable`). Все запросы проходят через размыкатель цепи
+    `breaker`: пока S3 недоступен, они сразу завершаются
+    `S3ConnectionErrorException`. Если задано окно `hedge`, то GetObject,
+    не получивший заголовков ответа за квантиль времени ответа из окна,
+    дублируется, и используется тот ответ, что пришёл первым.
+
+    Длительность и ошибки каждого запроса записываются в метрики по имени
+    операции S3 API. Для потоковых запросов длительность - это время до
+    получения заголовков ответа, вместе с повторами.
+    """
+
+    def __init__(
+        self,
+        *args,
+        session: aiohttp.ClientSession,
+        metrics: Optional[Metrics] = None,
+        backoff: Optional[Backoff] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: Optional[LatencyWindow] = None,
+        hedge_min_delay: float = 0.0,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.session = session
+        self.metrics = metrics
+        self.backoff = backoff or Backoff(0, 0.0, 0.0)
+        self.breaker = breaker or CircuitBreaker(0, 0.0)
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+
+    async def _url_open(self, method, region, *args, session=None, **kwargs):
+        operation = s3_operation(method, kwargs)
+        start = time.perf_counter()
+        try:
+            return await self._request(
+                operation, method, region, args, session, kwargs
+            )
+        except Exception as e:
+            if self.metrics is not None:
+                code = getattr(e, "code", None) or e.__class__.__name__
+                self.metrics.s3_errors.inc((operation, code))
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.s3_duration.observe(
+                    (operation,), time.perf_counter() - start
+                )
+
+    async def _request(self, operation, method, region, args, session, kwargs):
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise S3ConnectionErrorException()
+            try:
+                if self.hedge is not None and operation == "GetObject":
+                    response = await self._hedged(method, region, args, session, kwargs)
+                else:
+                    response = await self._send(method, region, args, session, kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                if (
+                    not is_replayable(method, kwargs.get("body"))
+                    or attempt >= self.backoff.retries
+                ):
+                    raise
+                attempt += 1
+                if self.metrics is not None:
+                    self.metrics.s3_retries.inc((operation,))
+                await asyncio.sleep(self.backoff.delay(attempt))
+                continue
+            self.breaker.success()
+            return response
+
+    async def _send(self, method, region, args, session, kwargs):
+        if kwargs.get("headers"):
+            kwargs = {**kwargs, "headers": dict(kwargs["headers"])}
+        if session is self.session:
+            return await super()._url_open(
+                method, region, *args, session=session, **kwargs
+            )
+        response = await super()._url_open(
+            method, region, *args, session=self.session, **kwargs
+        )
+        await response.read()
+        return response
+
+    async def _hedged(self, method, region, args, session, kwargs):
+        """GetObject с дублированием медленного запроса.
+
+        Запросы, ответ которых не понадобился, отменяются, а если ответ
+        уже пришёл, освобождается. Это относится и к отмене самого вызова,
+        иначе ответ незавершённого запроса остался бы занимать соединение.
+        """
+
+        async def send():
+            start = time.perf_counter()
+            response = await self._send(method, region, args, session, kwargs)
+            self.hedge.add(time.perf_counter() - start)
+            return response
+
+        pending = {asyncio.ensure_future(send())}
+        try:
+            delay = self.hedge.value()
+            if delay is not None:
+                done, _ = await asyncio.wait(
+                    pending, timeout=max(delay, self.hedge_min_delay)
+                )
+                if not done:
+                    if self.metrics is not None:
+                        self.metrics.s3_hedges.inc(("GetObject",))
+                    pending.add(asyncio.ensure_future(send()))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    for task in succeeded[1:]:
+                        _release_response(task)
+                    return succeeded[0].result()
+                error = done.pop().exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_release_response)
+
+
+def _release_response(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is None:
+        task.result().release()
+
+
+def s3_operation(method: str, kwargs: dict) -> str:
+    """Имя операции S3 API по методу и параметрам запроса."""
+    query = kwargs.get("query_params") or {}
+    if not kwargs.get("object_name"):
+        if method == "GET" and "location" in query:
+            return "GetBucketLocation"
+        if method == "GET":
+            return "ListObjects" if "list-type" in query else "GetBucket"
+        if method == "POST" and "delete" in query:
+            return "DeleteObjects"
+        return {"HEAD": "HeadBucket", "PUT": "CreateBucket"}.get(method, method)
+    if "uploadId" in query:
+        return {
+            "PUT": "UploadPart",
+            "POST": "CompleteMultipartUpload",
+            "DELETE": "AbortMultipartUpload",
+        }.get(method, "ListParts")
+    if method == "POST" and "uploads" in query:
+        return "CreateMultipartUpload"
+    return {
+        "GET": "GetObject",
+        "HEAD": "HeadObject",
+        "PUT": "PutObject",
+        "DELETE": "DeleteObject",
+    }.get(method, method)
 
 
 class MinioAccessor(BaseAccessor):
     settings: Optional[MinioSettings] = None
-    client: Optional[Minio] = None
+    session: Optional[aiohttp.ClientSession] = None
+    client: Optional[PooledMinio] = None
+
+    @property
+    def circuit_open(self) -> bool:
+        """Отклоняются ли запросы к S3 размыкателем цепи."""
+        return self.client is not None and self.client.breaker.is_open
 
     async def connect(self):
-        self.settings = MinioSettings()
-        self.client = Minio(
+        self.settings = self.app.config.minio
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.settings.minio_pool_limit,
+                limit_per_host=self.settings.minio_pool_limit_per_host,
+                keepalive_timeout=self.settings.minio_keepalive_timeout,
+                ttl_dns_cache=self.settings.minio_dns_cache_ttl,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self.settings.minio_connect_timeout,
+                sock_read=self.settings.minio_read_timeout,
+            ),
+        )
+        self.client = PooledMinio(
             endpoint=self.settings.minio_endpoint,
             access_key=self.settings.minio_access_key,
             secret_key=self.settings.minio_secret_key,
+            secure=self.settings.minio_secure,
+            session=self.session,
+            metrics=self.app.metrics,
+            backoff=Backoff(
+                self.settings.minio_retries,
+                self.settings.minio_retry_backoff,
+                self.settings.minio_retry_backoff_max,
+            ),
+            breaker=CircuitBreaker(
+                self.settings.minio_breaker_threshold,
+                self.settings.minio_breaker_reset_timeout,
+            ),
+            hedge=(
+                LatencyWindow(self.settings.minio_hedge_quantile)
+                if self.settings.minio_hedge_reads
+                else None
+            ),
+            hedge_min_delay=self.settings.minio_hedge_min_delay,
         )
         for bucket in self.settings.minio_buckets:
             if not await self.client.bucket_exists(bucket):
                 await self.client.make_bucket(bucket)
         self.logger.info(f"{self.__class__.__name__} connected.")
+
+    async def disconnect(self):
+        if self.session:
+            await self.session.close()
+        self.logger.info(f"{self.__class__.__name__} disconnected.")
@@ -0,0 +1,146 @@
+"""Повторы, размыкатель цепи и хеджирование запросов к S3."""
+
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Optional
+
+import aiohttp
+from miniopy_async.error import InvalidResponseError, S3Error, ServerError
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+REPLAYABLE_BODIES = (bytes, bytearray, memoryview, str, type(None))
+RETRYABLE_CODES = ("InternalError", "ServiceUnavailable", "SlowDown", "RequestTimeout")
+LATENCY_WINDOW = 1000
+LATENCY_MIN_SAMPLES = 20
+LATENCY_REFRESH = 50
+
+
+def is_transient(error: BaseException) -> bool:
+    """Ошибка, после которой запрос имеет смысл повторить.
+
+    Это сетевые ошибки, тайм-ауты и ответы 5xx. Ошибки вида NoSuchKey или
+    AccessDenied означают, что S3 работает, и не повторяются.
+    """
+    if isinstance(
+        error, (aiohttp.ClientConnectionError, asyncio.TimeoutError, ConnectionError)
+    ):
+        return True
+    if isinstance(error, ServerError):
+        return error.status_code >= 500
+    if isinstance(error, InvalidResponseError):
+        return isinstance(error._code, int) and error._code >= 500
+    if isinstance(error, S3Error):
+        return error.code in RETRYABLE_CODES
+    return False
+
+
+def is_replayable(method: str, body: object) -> bool:
+    """Можно ли отправить запрос повторно.
+
+    Метод должен быть идемпотентным, а тело - уже прочитанным в память:
+    поток или файл при первой попытке вычитан, и повтор отправил бы
+    часть объекта или пустое тело.
+    """
+    return method in IDEMPOTENT_METHODS and isinstance(body, REPLAYABLE_BODIES)
+
+
+class Backoff:
+    """Экспоненциальная задержка между повторами с полным джиттером.
+
+    Задержка перед повтором `attempt` выбирается равномерно от нуля до
+    `min(cap, base * 2 ** (attempt - 1))`, чтобы повторы одновременно
+    упавших запросов не приходили в S3 одной волной.
+
+    Args:
+        retries (int): Повторов после первой попытки.
+        base (float): Верхняя граница первой задержки в секундах.
+        cap (float): Наибольшая задержка в секундах.
+    """
+
+    def __init__(self, retries: int, base: float, cap: float):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Размыкатель цепи для запросов к S3.
+
+    После `threshold` сетевых ошибок или ответов 5xx подряд цепь
+    размыкается, и запросы сразу отклоняются, не дожидаясь тайм-аутов.
+    Через `reset_timeout` секунд пропускается один пробный запрос: если он
+    успешен, цепь замыкается, иначе снова размыкается. Пока пробный запрос
+    не завершился, следующий пропускается не раньше чем ещё через
+    `reset_timeout` секунд.
+
+    Args:
+        threshold (int): Ошибок подряд до размыкания, 0 - не размыкать.
+        reset_timeout (float): Время в разомкнутом состоянии в секундах.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        self.opened_at = now
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.threshold and self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    """Квантиль времени ответа по последним `LATENCY_WINDOW` запросам.
+
+    Квантиль пересчитывается раз в `LATENCY_REFRESH` новых значений, а не
+    при каждом обращении.
+
+    Args:
+        quantile (float): Квантиль от 0 до 1.
+    """
+
+    def __init__(self, quantile: float):
+        self.quantile = quantile
+        self._samples: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._value: Optional[float] = None
+        self._added = 0
+
+    def add(self, value: float):
+        self._samples.append(value)
+        self._added += 1
+        if self._added >= LATENCY_REFRESH:
+            self._value = None
+
+    def value(self) -> Optional[float]:
+        """Квантиль или None, пока значений слишком мало."""
+        if len(self._samples) < LATENCY_MIN_SAMPLES:
+            return None
+        if self._value is None:
+            samples = sorted(self._samples)
+            index = min(int(self.quantile * len(samples)), len(samples) - 1)
+            self._value = samples[index]
+            self._added = 0
+        return self._value
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, NamedTuple, Optional
+
+from base.base_accessor import BaseAccessor
+from core.settings import ImageSettings
+from PIL import Image
+
+from store.images import render
+from store.images.exceptions import ImageProcessingException, ImageVariantException
+
+
+class Variant(NamedTuple):
+    """Параметры уменьшенной копии изображения."""
+
+    width: int
+    height: int
+    quality: int
+
+
+class Meme(NamedTuple):
+    """Параметры мема, собираемого из шаблона."""
+
+    top: str
+    bottom: str
+    quality: int
+
+
+class ImageAccessor(BaseAccessor):
+    """Обработка изображений в пуле процессов.
+
+    Декодирование и кодирование JPEG занимают процессор, поэтому
+    выполняются в отдельных процессах и не блокируют цикл событий.
+    Процессы запускаются через forkserver, чтобы не наследовать потоки
+    и соединения основного процесса.
+    """
+
+    pool: Optional[ProcessPoolExecutor] = None
+    tasks: int = 0
+
+    @property
+    def settings(self) -> ImageSettings:
+        return self.app.config.image
+
+    async def connect(self):
+        self.pool = self._create_pool()
+        self.logger.info(f"{self.__class__.__name__} успешно подключено")
+
+    async def disconnect(self):
+        if self.pool:
+            await asyncio.to_thread(self.pool.shutdown, cancel_futures=True)
+        self.logger.info(f"{self.__class__.__name__} успешно отключено")
+
+    def variant(
+        self, width: Optional[int], height: Optional[int], quality: Optional[int]
+    ) -> Variant:
+        """Проверка и нормализация параметров варианта.
+
+        Не заданная сторона ограничивается только `image_max_dimension`.
+        Стороны округляются вверх до `image_variant_sizes`, а качество -
+        до ближайшего из `image_variant_qualities`: иначе каждый запрос
+        с новыми параметрами рендерил бы и сохранял ещё один вариант.
+
+        Raises:
+            ImageVariantException: Параметры выходят за допустимые пределы.
+        """
+        limit = self.settings.image_max_dimension
+        if width is None and height is None:
+            raise ImageVariantException("Необходимо указать width или height.")
+        variant = Variant(
+            limit if width is None else width,
+            limit if height is None else height,
+            self.settings.image_default_quality if quality is None else quality,
+        )
+        if not (0 < variant.width <= limit and 0 < variant.height <= limit):
+            raise ImageVariantException(
+                f"Ширина и высота должны быть от 1 до {limit}."
+            )
+        if not 0 < variant.quality <= 95:
+            raise ImageVariantException("Качество должно быть от 1 до 95.")
+        return Variant(
+            self._snap_size(variant.width),
+            self._snap_size(variant.height),
+            self._snap_quality(variant.quality),
+        )
+
+    def meme(self, top: str, bottom: str, quality: Optional[int]) -> Meme:
+        """Проверка и нормализация параметров мема.
+
+        Raises:
+            ImageVariantException: Параметры выходят за допустимые пределы.
+        """
+        top, bottom = " ".join(top.split()), " ".join(bottom.split())
+        if not (top or bottom):
+            raise ImageVariantException("Необходимо указать top или bottom.")
+        limit = self.settings.image_meme_max_text
+        if len(top) > limit or len(bottom) > limit:
+            raise ImageVariantException(
+                f"Длина подписи не должна превышать {limit} символов."
+            )
+        meme = Meme(
+            top,
+            bottom,
+            self.settings.image_default_quality if quality is None else quality,
+        )
+        if not 0 < meme.quality <= 95:
+            raise ImageVariantException("Качество должно быть от 1 до 95.")
+        return meme._replace(quality=self._snap_quality(meme.quality))
+
+    def _snap_size(self, size: int) -> int:
+        limit = self.settings.image_max_dimension
+        sizes = self.settings.image_variant_sizes
+        return min((value for value in sizes if size <= value <= limit), default=limit)
+
+    def _snap_quality(self, quality: int) -> int:
+        return min(
+            self.settings.image_variant_qualities,
+            key=lambda value: (abs(value - quality), -value),
+            default=quality,
+        )
+
+    def derived_prefixes(self, object_name: str) -> list[str]:
+        """Префиксы ключей всех объектов, построенных из данного."""
+        return [self.variant_prefix(object_name), self.meme_prefix(object_name)]
+
+    def variant_prefix(self, object_name: str) -> str:
+        """Префикс ключей всех вариантов объекта."""
+        return f"{self.settings.image_variant_prefix}/{object_name}/"
+
+    def meme_prefix(self, template: str) -> str:
+        """Префикс ключей всех мемов из шаблона."""
+        return f"{self.settings.image_meme_prefix}/{template}/"
+
+    def variant_key(self, object_name: str, version: str, variant: Variant) -> str:
+        """Ключ варианта версии `version` объекта.
+
+        Версия в ключе нужна, чтобы после записи оригинала не отдавались
+        варианты прежнего содержимого и их не приходилось искать и удалять.
+        """
+        return (
+            f"{self.variant_prefix(object_name)}{version}/"
+            f"{variant.width}x{variant.height}_q{variant.quality}.jpg"
+        )
+
+    def meme_key(self, template: str, version: str, meme: Meme) -> str:
+        """Ключ мема - хэш версии шаблона, подписей и настроек отрисовки.
+
+        Версия шаблона и шрифт входят в хэш, поэтому после записи шаблона
+        или смены шрифта старые мемы не отдаются.
+        """
+        options = [version, *meme, self.settings.image_meme_font, render.MEME_VERSION]
+        digest = hashlib.sha256(json.dumps(options).encode()).hexdigest()[:32]
+        return f"{self.meme_prefix(template)}{digest}.jpg"
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """Выполняет функцию в пуле процессов.
+
+        Raises:
+            ImageProcessingException: Изображение не удалось обработать.
+        """
+        loop = asyncio.get_running_loop()
+        self.tasks += 1
+        try:
+            return await loop.run_in_executor(self.pool, func, *args)
+        except BrokenProcessPool as e:
+            self.logger.error(f"{self.__class__.__name__}: пул процессов упал")
+            self.pool = self._create_pool()
+            raise ImageProcessingException(exception=e)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise ImageProcessingException(exception=e)
+        finally:
+            self.tasks -= 1
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        method = "forkserver"
+        if method not in multiprocessing.get_all_start_methods():
+            method = "spawn"
+        return ProcessPoolExecutor(
+            self.settings.image_workers,
+            mp_context=multiprocessing.get_context(method),
+        )
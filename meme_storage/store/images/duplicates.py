@@ -0,0 +1,388 @@
+import asyncio
+import contextlib
+import fcntl
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+import numpy as np
+from base.base_accessor import BaseAccessor
+from core.settings import ImageSettings
+
+from store.images import render
+from store.images.exceptions import (
+    DuplicateImageException,
+    DuplicateIndexDisabledException,
+    ImageProcessingException,
+)
+
+HASH_BITS = 64
+INITIAL_CAPACITY = 1 << 16
+SEARCH_CHUNK = 1 << 20
+MAX_MATCHES = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    slot INTEGER PRIMARY KEY,
+    bucket TEXT NOT NULL,
+    name TEXT NOT NULL,
+    hash INTEGER NOT NULL,
+    UNIQUE (bucket, name)
+);
+"""
+
+
+@dataclass(slots=True)
+class Duplicate:
+    """Похожее изображение из индекса.
+
+    Attributes:
+        bucket (str): Имя бакета.
+        name (str): Ключ объекта.
+        distance (int): Число различающихся бит перцептивных хэшей.
+    """
+
+    bucket: str
+    name: str
+    distance: int
+
+
+class DuplicateIndexAccessor(BaseAccessor):
+    """Индекс перцептивных хэшей для поиска похожих изображений.
+
+    Хэши всех изображений лежат подряд в массиве uint64, отображённом
+    в память из файла `hashes.u64`, поэтому при старте ничего не читается,
+    а поиск - это XOR со всем массивом и подсчёт единичных бит через
+    `np.bitwise_count` кусками по `SEARCH_CHUNK` хэшей. Миллион хэшей
+    проверяется за единицы миллисекунд.
+
+    Какому объекту принадлежит ячейка массива, записано в SQLite рядом
+    с массивом. При удалении в освободившуюся ячейку переносится последняя,
+    так что массив остаётся без дыр. База - источник истины: если массив
+    не совпадает с ней после сбоя, он заполняется из базы заново.
+
+    Индекс общий для всех процессов сервиса. Ячейка выбирается внутри
+    транзакции SQLite, а массив пишется после её фиксации. Запись и поиск
+    идут под блокировкой файла `hashes.lock`, исключающей для записи
+    и разделяемой для поиска: два процесса не займут одну ячейку, не
+    перепишут её в обратном порядке, и поиск не увидит ячейку, уже
+    записанную в базу, но ещё не в массив. Число ячеек перед поиском
+    перечитывается из базы.
+
+    Хэшируются все загружаемые изображения: пока индекс включён, потоковая
+    и пакетная загрузка копят тело целиком до записи в S3, как и форма.
+    Все обращения к индексу выполняются в одном отдельном потоке.
+    """
+
+    @property
+    def settings(self) -> ImageSettings:
+        return self.app.config.image
+
+    def _init(self):
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._hashes: Optional[np.memmap] = None
+        self._lock_fd: Optional[int] = None
+        self.count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    async def connect(self):
+        if self.settings.image_phash_enabled:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="phash")
+            await self._run(self._open)
+        self.logger.info(f"{self.__class__.__name__} успешно подключено")
+
+    async def disconnect(self):
+        if self._db is not None:
+            await self._run(self._close)
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.logger.info(f"{self.__class__.__name__} успешно отключено")
+
+    async def hash(self, file: BinaryIO) -> int:
+        """Перцептивный хэш изображения из файла.
+
+        Raises:
+            ImageProcessingException: Изображение не удалось декодировать.
+        """
+        data = await asyncio.to_thread(_read, file)
+        return await self.app.store.images.run(render.perceptual_hash, data)
+
+    async def find(
+        self, file: BinaryIO, distance: Optional[int] = None
+    ) -> tuple[int, list[Duplicate]]:
+        """Перцептивный хэш изображения из файла и похожие на него.
+
+        Raises:
+            ImageProcessingException: Изображение не удалось декодировать.
+        """
+        if not self.enabled:
+            raise DuplicateIndexDisabledException()
+        value = await self.hash(file)
+        return value, await self.search(value, distance)
+
+    async def check(
+        self, bucket: str, object_name: str, file: BinaryIO
+    ) -> Optional[int]:
+        """Хэш загружаемого изображения для `put`.
+
+        Если включён `image_phash_reject`, загрузка изображения, у которого
+        в индексе есть похожее на другой объект, отклоняется. Изображение,
+        которое не удалось декодировать, загружается без хэша.
+
+        Returns:
+            Optional[int]: Хэш или None, если индекс выключен.
+
+        Raises:
+            DuplicateImageException: Похожее изображение уже загружено.
+        """
+        if not self.enabled:
+            return None
+        try:
+            value = await self.hash(file)
+        except ImageProcessingException:
+            return None
+        if self.settings.image_phash_reject:
+            duplicates = await self.search(value, exclude=(bucket, object_name))
+            if duplicates:
+                raise DuplicateImageException(
+                    f"Такое изображение уже загружено: "
+                    f"{duplicates[0].bucket}/{duplicates[0].name}."
+                )
+        return value
+
+    async def search(
+        self,
+        value: int,
+        distance: Optional[int] = None,
+        exclude: Optional[tuple[str, str]] = None,
+    ) -> list[Duplicate]:
+        """Изображения, хэши которых отличаются не больше чем в `distance` битах.
+
+        Args:
+            value (int): Перцептивный хэш.
+            distance (Optional[int]): Наибольшее число различающихся бит,
+                по умолчанию `image_phash_distance`.
+            exclude (Optional[tuple[str, str]]): Бакет и ключ объекта,
+                который не нужно возвращать.
+
+        Returns:
+            list[Duplicate]: Не больше `MAX_MATCHES` ближайших изображений.
+        """
+        if not self.enabled:
+            raise DuplicateIndexDisabledException()
+        if distance is None:
+            distance = self.settings.image_phash_distance
+        distance = max(0, min(distance, HASH_BITS))
+        matches = await self._run(self._search, value, distance, exclude)
+        return [Duplicate(*match) for match in matches]
+
+    async def get(self, bucket: str, object_name: str) -> Optional[int]:
+        """Хэш объекта из индекса."""
+        if not self.enabled:
+            raise DuplicateIndexDisabledException()
+        return await self._run(self._get, bucket, object_name)
+
+    async def put(self, bucket: str, object_name: str, value: Optional[int]):
+        """Записывает хэш объекта, если он есть."""
+        if value is not None and self.enabled:
+            await self._write(self._put, bucket, object_name, value)
+
+    async def remove(self, bucket: str, object_name: str):
+        if self.enabled:
+            await self._write(self._remove, bucket, object_name)
+
+    async def _write(self, func: Callable[..., Any], *args):
+        """Запись в индекс, ошибка которой не мешает самой операции."""
+        try:
+            await self._run(func, *args)
+        except (sqlite3.Error, OSError) as e:
+            self.logger.warning(f"{self.__class__.__name__}: не записано {e!r}")
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        root = self.settings.image_phash_path
+        os.makedirs(root, exist_ok=True)
+        self._lock_fd = os.open(
+            os.path.join(root, "hashes.lock"), os.O_RDWR | os.O_CREAT
+        )
+        db = sqlite3.connect(os.path.join(root, "slots.sqlite3"), timeout=30)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.executescript(SCHEMA)
+        self._db = db
+        path = os.path.join(root, "hashes.u64")
+        with self._locked(fcntl.LOCK_EX):
+            last = self._last()
+            self.count = last + 1
+            if not os.path.exists(path):
+                open(path, "wb").close()
+            short = os.path.getsize(path) < self.count * 8
+            self._map(path, max(INITIAL_CAPACITY, self.count))
+            if short or self.count and int(self._hashes[last]) != self._stored(last):
+                self._rebuild()
+                self.logger.warning(
+                    f"{self.__class__.__name__}: массив хэшей заполнен из базы заново"
+                )
+
+    def _map(self, path: str, capacity: int):
+        if self._hashes is not None:
+            self._hashes.flush()
+        if os.path.getsize(path) < capacity * 8:
+            os.truncate(path, capacity * 8)
+        capacity = os.path.getsize(path) // 8
+        self._hashes = np.memmap(path, np.uint64, "r+", shape=(capacity,))
+
+    def _close(self):
+        self._hashes.flush()
+        self._hashes = None
+        self._db.close()
+        self._db = None
+        os.close(self._lock_fd)
+        self._lock_fd = None
+
+    @contextlib.contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        """Блокировка индекса между процессами на время операции."""
+        fcntl.flock(self._lock_fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _last(self) -> int:
+        """Последняя занятая ячейка по базе или -1."""
+        (last,) = self._db.execute("SELECT MAX(slot) FROM slots").fetchone()
+        return -1 if last is None else last
+
+    def _refresh(self):
+        """Перечитывает число ячеек из базы: его мог изменить другой процесс."""
+        self.count = self._last() + 1
+        if self.count > len(self._hashes):
+            self._map(self._hashes.filename, self.count)
+
+    def _store(self, slot: int, value: int):
+        if slot >= len(self._hashes):
+            self._map(self._hashes.filename, max(len(self._hashes) * 2, slot + 1))
+        self._hashes[slot] = value
+
+    def _stored(self, slot: int) -> int:
+        (value,) = self._db.execute(
+            "SELECT hash FROM slots WHERE slot = ?", (slot,)
+        ).fetchone()
+        return _unsigned(value)
+
+    def _rebuild(self):
+        rows = self._db.execute("SELECT slot, hash FROM slots")
+        for slot, value in rows:
+            self._hashes[slot] = _unsigned(value)
+
+    def _search(
+        self, value: int, distance: int, exclude: Optional[tuple[str, str]]
+    ) -> list[tuple[str, str, int]]:
+        with self._locked(fcntl.LOCK_SH):
+            self._refresh()
+            slots, distances = self._scan(np.uint64(value), distance)
+        if len(slots) == 0:
+            return []
+        found = dict(zip(slots.tolist(), distances.tolist()))
+        rows = self._db.execute(
+            f"SELECT slot, bucket, name FROM slots"
+            f" WHERE slot IN ({','.join('?' * len(found))})",
+            list(found),
+        ).fetchall()
+        matches = sorted(
+            (found[slot], bucket, name)
+            for slot, bucket, name in rows
+            if (bucket, name) != exclude
+        )
+        return [(bucket, name, bits) for bits, bucket, name in matches[:MAX_MATCHES]]
+
+    def _scan(
+        self, query: np.uint64, distance: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Ячейки с хэшами не дальше `distance` и расстояния до них."""
+        slots, distances = [], []
+        for start in range(0, self.count, SEARCH_CHUNK):
+            chunk = self._hashes[start : min(start + SEARCH_CHUNK, self.count)]
+            bits = np.bitwise_count(chunk ^ query)
+            found = np.flatnonzero(bits <= distance)
+            slots.append(found + start)
+            distances.append(bits[found])
+        if not slots:
+            return np.empty(0, np.int64), np.empty(0, np.uint8)
+        slots, distances = np.concatenate(slots), np.concatenate(distances)
+        if len(slots) > MAX_MATCHES + 1:
+            nearest = np.argpartition(distances, MAX_MATCHES)[: MAX_MATCHES + 1]
+            slots, distances = slots[nearest], distances[nearest]
+        return slots, distances
+
+    def _get(self, bucket: str, object_name: str) -> Optional[int]:
+        row = self._db.execute(
+            "SELECT hash FROM slots WHERE bucket = ? AND name = ?",
+            (bucket, object_name),
+        ).fetchone()
+        return None if row is None else _unsigned(row[0])
+
+    def _put(self, bucket: str, object_name: str, value: int):
+        with self._locked(fcntl.LOCK_EX):
+            with self._db:
+                self._db.execute("BEGIN IMMEDIATE")
+                row = self._db.execute(
+                    "SELECT slot FROM slots WHERE bucket = ? AND name = ?",
+                    (bucket, object_name),
+                ).fetchone()
+                slot = self._last() + 1 if row is None else row[0]
+                self._db.execute(
+                    "INSERT INTO slots (slot, bucket, name, hash) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (bucket, name) DO UPDATE SET hash = excluded.hash",
+                    (slot, bucket, object_name, _signed(value)),
+                )
+            self._store(slot, value)
+            self.count = max(self.count, slot + 1)
+
+    def _remove(self, bucket: str, object_name: str):
+        with self._locked(fcntl.LOCK_EX):
+            with self._db:
+                self._db.execute("BEGIN IMMEDIATE")
+                row = self._db.execute(
+                    "SELECT slot FROM slots WHERE bucket = ? AND name = ?",
+                    (bucket, object_name),
+                ).fetchone()
+                if row is None:
+                    return
+                slot, last = row[0], self._last()
+                self._db.execute("DELETE FROM slots WHERE slot = ?", (slot,))
+                moved = None
+                if slot != last:
+                    moved = self._stored(last)
+                    self._db.execute(
+                        "UPDATE slots SET slot = ? WHERE slot = ?", (slot, last)
+                    )
+            if moved is not None:
+                self._store(slot, moved)
+            self.count = last
+
+
+def _read(file: BinaryIO) -> bytes:
+    file.seek(0)
+    data = file.read()
+    file.seek(0)
+    return data
+
+
+def _signed(value: int) -> int:
+    """Хэш в виде знакового целого, которое помещается в INTEGER SQLite."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
@@ -0,0 +1,24 @@
+from base.base_exception import ExceptionBase
+from starlette import status
+
+
+class ImageVariantException(ExceptionBase):
+    args = ("Некорректные параметры варианта изображения.",)
+
+
+class ImageProcessingException(ExceptionBase):
+    args = ("Не удалось обработать изображение.",)
+
+
+class DuplicateImageException(ExceptionBase):
+    args = ("Такое изображение уже загружено.",)
+    status_code = status.HTTP_409_CONFLICT
+
+
+class MemeLimitException(ExceptionBase):
+    args = ("Из этого шаблона создано слишком много мемов.",)
+    status_code = status.HTTP_403_FORBIDDEN
+
+
+class DuplicateIndexDisabledException(ExceptionBase):
+    args = ("Поиск похожих изображений недоступен: индекс выключен.",)
@@ -0,0 +1,185 @@
+"""Обработка изображений, выполняемая в процессах пула.
+
+Функции модуля вызываются через `ImageAccessor.run`, поэтому принимают
+и возвращают только сериализуемые значения.
+"""
+
+import functools
+import hashlib
+import io
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+MEME_VERSION = 1
+TEMPLATE_CACHE_SIZE = 16
+FONT_SIZE_STEP = 0.85
+MIN_FONT_SIZE = 12
+HASH_SAMPLE_SIZE = 32
+HASH_SIZE = 8
+
+_dct = np.cos(
+    np.pi
+    / (2 * HASH_SAMPLE_SIZE)
+    * np.outer(np.arange(HASH_SIZE), 2 * np.arange(HASH_SAMPLE_SIZE) + 1)
+)
+
+_templates: OrderedDict[bytes, Image.Image] = OrderedDict()
+
+
+def resize(data: bytes, width: int, height: int, quality: int) -> bytes:
+    """Уменьшает изображение так, чтобы оно вписалось в width x height.
+
+    Пропорции сохраняются, изображение никогда не увеличивается.
+    Ориентация из EXIF применяется к пикселям.
+
+    Args:
+        data (bytes): Исходное изображение.
+        width (int): Максимальная ширина.
+        height (int): Максимальная высота.
+        quality (int): Качество JPEG.
+
+    Returns:
+        bytes: Изображение в формате JPEG.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        side = max(width, height)
+        image.draft("RGB", (side, side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, height), Image.Resampling.LANCZOS)
+        return _encode(image, quality)
+
+
+def perceptual_hash(data: bytes) -> int:
+    """64-битный перцептивный хэш изображения (pHash).
+
+    Изображение в оттенках серого уменьшается до 32 x 32, и от него берутся
+    64 низкочастотные коэффициента двумерного DCT. Бит хэша равен единице,
+    если коэффициент больше их медианы. Низкие частоты описывают общую
+    композицию, поэтому у копий с другим размером, качеством сжатия или
+    небольшой обрезкой хэши отличаются в немногих битах.
+
+    Args:
+        data (bytes): Изображение.
+
+    Returns:
+        int: Хэш от 0 до 2 ** 64 - 1.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("L", (HASH_SAMPLE_SIZE * 2, HASH_SAMPLE_SIZE * 2))
+        image = ImageOps.exif_transpose(image).convert("L")
+        image = image.resize(
+            (HASH_SAMPLE_SIZE, HASH_SAMPLE_SIZE), Image.Resampling.LANCZOS
+        )
+    coefficients = _dct @ np.asarray(image, dtype=np.float64) @ _dct.T
+    bits = coefficients > np.median(coefficients)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def render_meme(
+    data: bytes, top: str, bottom: str, quality: int, font_path: Optional[str]
+) -> bytes:
+    """Накладывает подписи сверху и снизу на шаблон.
+
+    Подписи пишутся заглавными белыми буквами с чёрной обводкой, переносятся
+    по словам и уменьшаются, пока не займут не больше четверти высоты.
+    Декодированные шаблоны и загруженные шрифты кэшируются в процессе
+    пула, FreeType при этом сохраняет кэш отрисованных глифов шрифта.
+
+    Args:
+        data (bytes): Изображение шаблона.
+        top (str): Верхняя подпись.
+        bottom (str): Нижняя подпись.
+        quality (int): Качество JPEG.
+        font_path (Optional[str]): Путь к TrueType шрифту, None - встроенный.
+
+    Returns:
+        bytes: Изображение в формате JPEG.
+    """
+    image = _template(data).copy()
+    draw = ImageDraw.Draw(image)
+    _draw_caption(draw, image.size, top, font_path, at_top=True)
+    _draw_caption(draw, image.size, bottom, font_path, at_top=False)
+    return _encode(image, quality)
+
+
+def _template(data: bytes) -> Image.Image:
+    key = hashlib.blake2b(data, digest_size=16).digest()
+    if (image := _templates.get(key)) is not None:
+        _templates.move_to_end(key)
+        return image
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    _templates[key] = image
+    if len(_templates) > TEMPLATE_CACHE_SIZE:
+        _templates.popitem(last=False)
+    return image
+
+
+@functools.lru_cache(maxsize=64)
+def _font(font_path: Optional[str], size: int) -> ImageFont.FreeTypeFont:
+    if font_path is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(font_path, size)
+
+
+def _draw_caption(
+    draw: ImageDraw.ImageDraw,
+    size: tuple[int, int],
+    text: str,
+    font_path: Optional[str],
+    at_top: bool,
+):
+    words = text.upper().split()
+    if not words:
+        return
+    width, height = size
+    margin = max(width // 40, 2)
+    font_size = max(height // 8, MIN_FONT_SIZE)
+    while True:
+        font = _font(font_path, font_size)
+        stroke = max(font_size // 15, 1)
+        caption = "\n".join(_wrap(draw, words, font, width - 2 * margin))
+        left, upper, right, lower = draw.multiline_textbbox(
+            (0, 0), caption, font=font, stroke_width=stroke, align="center"
+        )
+        fits = right - left <= width - 2 * margin and lower - upper <= height // 4
+        if fits or font_size <= MIN_FONT_SIZE:
+            break
+        font_size = max(int(font_size * FONT_SIZE_STEP), MIN_FONT_SIZE)
+    draw.multiline_text(
+        (width / 2, margin if at_top else height - margin),
+        caption,
+        font=font,
+        fill="white",
+        stroke_width=stroke,
+        stroke_fill="black",
+        anchor="ma" if at_top else "md",
+        align="center",
+    )
+
+
+def _wrap(
+    draw: ImageDraw.ImageDraw,
+    words: list[str],
+    font: ImageFont.FreeTypeFont,
+    max_width: int,
+) -> list[str]:
+    lines = [words[0]]
+    for word in words[1:]:
+        candidate = f"{lines[-1]} {word}"
+        if draw.textlength(candidate, font=font) <= max_width:
+            lines[-1] = candidate
+        else:
+            lines.append(word)
+    return lines
+
+
+def _encode(image: Image.Image, quality: int) -> bytes:
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue()
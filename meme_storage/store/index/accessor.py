@@ -0,0 +1,438 @@
+import asyncio
+import base64
+import binascii
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Literal, Optional
+
+from base.base_accessor import BaseAccessor
+from core.settings import IndexSettings
+
+from store.index.exceptions import IndexCursorException, IndexDisabledException
+
+Sort = Literal["name", "uploaded", "size"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    uploaded REAL NOT NULL,
+    etag TEXT,
+    pass INTEGER NOT NULL,
+    PRIMARY KEY (bucket, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS objects_uploaded
+    ON objects (bucket, uploaded, name, size);
+CREATE INDEX IF NOT EXISTS objects_size
+    ON objects (bucket, size, name, uploaded);
+CREATE TABLE IF NOT EXISTS reconcile (
+    bucket TEXT PRIMARY KEY,
+    pass INTEGER NOT NULL DEFAULT 0,
+    start_after TEXT,
+    next_run REAL
+);
+"""
+UPSERT_WRITTEN = """
+INSERT INTO objects (bucket, name, size, uploaded, etag, pass)
+VALUES (
+    ?, ?, ?, ?, NULL,
+    COALESCE((SELECT pass FROM reconcile WHERE bucket = ?), 0)
+)
+ON CONFLICT (bucket, name) DO UPDATE SET
+    size = excluded.size, uploaded = excluded.uploaded, etag = NULL,
+    pass = excluded.pass
+"""
+UPSERT_LISTED = """
+INSERT INTO objects (bucket, name, size, uploaded, etag, pass)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (bucket, name) DO UPDATE SET
+    size = excluded.size, uploaded = excluded.uploaded, etag = excluded.etag,
+    pass = excluded.pass
+"""
+
+
+@dataclass(slots=True)
+class IndexedObject:
+    """Объект из индекса.
+
+    Attributes:
+        name (str): Ключ объекта.
+        size (int): Размер объекта в байтах.
+        uploaded (datetime): Время загрузки объекта.
+    """
+
+    name: str
+    size: int
+    uploaded: datetime
+
+
+class ObjectIndexAccessor(BaseAccessor):
+    """Локальный индекс объектов в SQLite, из которого отдаётся их список.
+
+    Запрос ListObjects к S3 отдаёт объекты только по порядку ключей и для
+    дальних страниц большого бакета перебирает всё, что до них. Индекс
+    хранит ключ, размер и время загрузки каждого объекта, а страницы
+    выбираются по курсору - значениям сортировки последнего объекта
+    предыдущей страницы - поиском по B-дереву, поэтому время выборки
+    страницы не зависит ни от её номера, ни от размера бакета. Для каждой
+    сортировки есть покрывающий индекс. Префикс при сортировке по имени
+    сужает тот же поиск, а при сортировке по времени или размеру
+    отфильтровывает строки по ходу просмотра индекса.
+
+    Загрузки и удаления `S3Accessor` отражает в индексе сразу. Изменения,
+    сделанные в обход сервиса, находит фоновая сверка: она читает бакет по
+    одной странице ListObjects раз в `index_reconcile_interval` секунд,
+    обновляет изменившиеся строки и отмечает номер прохода у встреченных.
+    В конце прохода удаляются строки, которые в нём не встретились и не
+    были записаны самим сервисом, а следующий проход начинается через
+    `index_reconcile_pass_interval` секунд. Служебные объекты (варианты,
+    мемы, блобы и отметки ссылок) в индекс не попадают.
+
+    Все обращения к базе выполняются в одном отдельном потоке.
+    """
+
+    @property
+    def settings(self) -> IndexSettings:
+        return self.app.config.index
+
+    def _init(self):
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._reconciler: Optional[asyncio.Task] = None
+        self._buckets: set[str] = set()
+        self._touched: dict[str, set[str]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    async def connect(self):
+        if self.settings.index_enabled:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="index")
+            await self._run(self._open)
+            self._reconciler = asyncio.create_task(self._reconcile())
+        self.logger.info(f"{self.__class__.__name__} успешно подключено")
+
+    async def disconnect(self):
+        if self._reconciler is not None:
+            self._reconciler.cancel()
+            await asyncio.gather(self._reconciler, return_exceptions=True)
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.logger.info(f"{self.__class__.__name__} успешно отключено")
+
+    def hidden(self, object_name: str) -> bool:
+        """Служебный ли объект: его нет в списке, архивах и удалении по префиксу."""
+        image = self.app.config.image
+        file = self.app.config.file
+        prefixes = (
+            image.image_variant_prefix,
+            image.image_meme_prefix,
+            file.upload_dedup_blob_prefix,
+            file.upload_dedup_ref_prefix,
+        )
+        return object_name.startswith(tuple(f"{prefix}/" for prefix in prefixes))
+
+    async def page(
+        self,
+        bucket: str,
+        prefix: str = "",
+        sort: Sort = "name",
+        descending: bool = False,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> tuple[list[IndexedObject], Optional[str]]:
+        """Страница списка объектов бакета.
+
+        Args:
+            bucket (str): Имя бакета.
+            prefix (str): Префикс ключей.
+            sort (Sort): Поле сортировки: ключ, время загрузки или размер.
+                Объекты с равными значениями упорядочены по ключу.
+            descending (bool): Сортировать по убыванию.
+            limit (Optional[int]): Объектов на странице, по умолчанию
+                `index_page_size`, не больше `index_max_page_size`.
+            cursor (Optional[str]): Курсор из предыдущей страницы.
+
+        Returns:
+            tuple[list[IndexedObject], Optional[str]]: Объекты и курсор
+                следующей страницы или None, если страница последняя.
+        """
+        if not self.enabled:
+            raise IndexDisabledException()
+        limit = limit or self.settings.index_page_size
+        limit = max(1, min(limit, self.settings.index_max_page_size))
+        after = _decode_cursor(cursor, sort, descending) if cursor else None
+        rows = await self._run(
+            self._select, bucket, prefix, sort, descending, limit + 1, after
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            name, size, uploaded = rows[-1]
+            value = {"name": name, "uploaded": uploaded, "size": size}[sort]
+            next_cursor = _encode_cursor(sort, descending, value, name)
+        objects = [
+            IndexedObject(name, size, datetime.fromtimestamp(uploaded, timezone.utc))
+            for name, size, uploaded in rows
+        ]
+        return objects, next_cursor
+
+    async def put(self, bucket: str, object_name: str, size: int):
+        """Отражает в индексе загрузку объекта."""
+        if self.enabled and not self.hidden(object_name):
+            self._touch(bucket, object_name)
+            await self._write(
+                UPSERT_WRITTEN, (bucket, object_name, size, time.time(), bucket)
+            )
+
+    async def remove(self, bucket: str, object_name: str):
+        """Отражает в индексе удаление объекта."""
+        if self.enabled and not self.hidden(object_name):
+            self._touch(bucket, object_name)
+            await self._write(
+                "DELETE FROM objects WHERE bucket = ? AND name = ?",
+                (bucket, object_name),
+            )
+
+    def _touch(self, bucket: str, object_name: str):
+        self._buckets.add(bucket)
+        if (touched := self._touched.get(bucket)) is not None:
+            touched.add(object_name)
+
+    async def _write(self, sql: str, parameters: tuple):
+        """Запись в индекс, ошибка которой не мешает самой операции.
+
+        Объект в S3 уже изменён, а строку, которую не удалось записать,
+        исправит следующий проход сверки.
+        """
+        try:
+            await self._run(self._execute, sql, parameters)
+        except sqlite3.Error as e:
+            self.logger.warning(f"{self.__class__.__name__}: не записано {e!r}")
+
+    async def _reconcile(self):
+        while True:
+            await asyncio.sleep(self.settings.index_reconcile_interval)
+            buckets = {*self.app.config.minio.minio_buckets, *self._buckets}
+            buckets.update(await self._run(self._reconciled_buckets))
+            for bucket in sorted(buckets):
+                try:
+                    await self._reconcile_page(bucket)
+                except Exception as e:
+                    self.logger.warning(
+                        f"{self.__class__.__name__}: сверка бакета {bucket}"
+                        f" отложена {e!r}"
+                    )
+                    await self._run(self._postpone, bucket)
+
+    async def _reconcile_page(self, bucket: str):
+        """Сверяет с бакетом следующую страницу его объектов."""
+        pass_number, start_after, next_run = await self._run(self._state, bucket)
+        if next_run is not None and time.time() < next_run:
+            return
+        touched = self._touched[bucket] = set()
+        try:
+            objects = await self.app.store.minio.client.list_objects(
+                bucket_name=bucket, recursive=True, start_after=start_after
+            )
+            listed = [item for item in objects if not self.hidden(item.object_name)]
+            known = {}
+            if listed:
+                known = await self._run(
+                    self._known, bucket, listed[0].object_name, listed[-1].object_name
+                )
+            changed = [
+                item for item in listed if known.get(item.object_name) != item.etag
+            ]
+            sizes = await asyncio.gather(
+                *(self._size(bucket, item) for item in changed)
+            )
+        finally:
+            del self._touched[bucket]
+        rows = [
+            (bucket, item.object_name, size, item.last_modified.timestamp(), item.etag)
+            for item, size in zip(changed, sizes)
+            if item.object_name not in touched
+        ]
+        seen = [
+            item.object_name
+            for item in listed
+            if known.get(item.object_name) == item.etag
+        ]
+        last = objects[-1].object_name if objects else None
+        await self._run(self._apply, bucket, pass_number, rows, seen, last)
+
+    async def _size(self, bucket: str, item: Any) -> int:
+        """Размер объекта, для ссылки на блоб - размер блоба."""
+        dedup = self.app.store.dedup
+        if item.size:
+            return item.size
+        if not (digest := await dedup.reference(bucket, item.object_name)):
+            return item.size
+        blob = await self.app.store.metadata_cache.stat(bucket, dedup.blob_key(digest))
+        return blob.size if blob else item.size
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        if directory := os.path.dirname(self.settings.index_path):
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.settings.index_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.executescript(SCHEMA)
+        self._db = db
+
+    def _execute(self, sql: str, parameters: tuple):
+        with self._db:
+            self._db.execute(sql, parameters)
+
+    def _select(
+        self,
+        bucket: str,
+        prefix: str,
+        sort: Sort,
+        descending: bool,
+        limit: int,
+        after: Optional[tuple[Any, str]],
+    ) -> list[tuple[str, int, float]]:
+        conditions = ["bucket = ?"]
+        parameters: list[Any] = [bucket]
+        if prefix:
+            conditions.append("name >= ?")
+            parameters.append(prefix)
+            if (end := _prefix_end(prefix)) is not None:
+                conditions.append("name < ?")
+                parameters.append(end)
+        comparison, direction = ("<", "DESC") if descending else (">", "ASC")
+        if sort == "name":
+            order = f"name {direction}"
+            if after is not None:
+                conditions.append(f"name {comparison} ?")
+                parameters.append(after[1])
+        else:
+            order = f"{sort} {direction}, name {direction}"
+            if after is not None:
+                conditions.append(f"({sort}, name) {comparison} (?, ?)")
+                parameters.extend(after)
+        parameters.append(limit)
+        return self._db.execute(
+            f"SELECT name, size, uploaded FROM objects"
+            f" WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?",
+            parameters,
+        ).fetchall()
+
+    def _reconciled_buckets(self) -> list[str]:
+        rows = self._db.execute("SELECT bucket FROM reconcile").fetchall()
+        return [bucket for bucket, in rows]
+
+    def _state(self, bucket: str) -> tuple[int, Optional[str], Optional[float]]:
+        with self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO reconcile (bucket) VALUES (?)", (bucket,)
+            )
+        return self._db.execute(
+            "SELECT pass, start_after, next_run FROM reconcile WHERE bucket = ?",
+            (bucket,),
+        ).fetchone()
+
+    def _known(self, bucket: str, first: str, last: str) -> dict[str, Optional[str]]:
+        return dict(
+            self._db.execute(
+                "SELECT name, etag FROM objects"
+                " WHERE bucket = ? AND name >= ? AND name <= ?",
+                (bucket, first, last),
+            )
+        )
+
+    def _apply(
+        self,
+        bucket: str,
+        pass_number: int,
+        rows: list[tuple],
+        seen: list[str],
+        last: Optional[str],
+    ):
+        """Записывает страницу сверки, а после последней завершает проход."""
+        with self._db:
+            self._db.executemany(
+                UPSERT_LISTED, [(*row, pass_number) for row in rows]
+            )
+            self._db.executemany(
+                "UPDATE objects SET pass = ? WHERE bucket = ? AND name = ?",
+                [(pass_number, bucket, name) for name in seen],
+            )
+            if last is not None:
+                self._db.execute(
+                    "UPDATE reconcile SET start_after = ?, next_run = NULL"
+                    " WHERE bucket = ?",
+                    (last, bucket),
+                )
+                return
+            self._db.execute(
+                "DELETE FROM objects WHERE bucket = ? AND pass < ?",
+                (bucket, pass_number),
+            )
+            self._db.execute(
+                "UPDATE reconcile SET pass = ?, start_after = NULL, next_run = ?"
+                " WHERE bucket = ?",
+                (
+                    pass_number + 1,
+                    time.time() + self.settings.index_reconcile_pass_interval,
+                    bucket,
+                ),
+            )
+
+    def _postpone(self, bucket: str):
+        with self._db:
+            self._db.execute(
+                "UPDATE reconcile SET next_run = ? WHERE bucket = ?",
+                (time.time() + self.settings.index_reconcile_pass_interval, bucket),
+            )
+
+
+def _prefix_end(prefix: str) -> Optional[str]:
+    """Наименьшая строка больше всех строк с префиксом `prefix`."""
+    while prefix:
+        if (code := ord(prefix[-1])) < 0x10FFFF:
+            return prefix[:-1] + chr(code + 1)
+        prefix = prefix[:-1]
+    return None
+
+
+def _encode_cursor(sort: Sort, descending: bool, value: Any, name: str) -> str:
+    data = json.dumps([sort, descending, value, name], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def _decode_cursor(cursor: str, sort: Sort, descending: bool) -> tuple[Any, str]:
+    """Значение сортировки и ключ последнего объекта предыдущей страницы.
+
+    Курсор действителен только для той же сортировки, с которой он получен.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        raise IndexCursorException()
+    if (
+        not isinstance(data, list)
+        or len(data) != 4
+        or data[:2] != [sort, descending]
+        or not isinstance(data[3], str)
+        or isinstance(data[2], bool)
+        or not isinstance(data[2], (str, int, float))
+    ):
+        raise IndexCursorException()
+    return data[2], data[3]
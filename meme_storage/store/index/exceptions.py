@@ -0,0 +1,9 @@
+from base.base_exception import ExceptionBase
+
+
+class IndexDisabledException(ExceptionBase):
+    args = ("Список объектов недоступен: индекс объектов выключен.",)
+
+
+class IndexCursorException(ExceptionBase):
+    args = ("Некорректный курсор страницы списка объектов.",)
@@ -1,7 +1,14 @@
 """A module describing services for working with data."""
 
 from store.S3.accessor import S3Accessor
+from store.S3.dedup import DedupAccessor
+from store.cache.disk import DiskCacheAccessor
+from store.cache.memory import MemoryCacheAccessor
+from store.cache.metadata import MetadataCacheAccessor
 from store.database.minio import MinioAccessor
+from store.images.accessor import ImageAccessor
+from store.images.duplicates import DuplicateIndexAccessor
+from store.index.accessor import ObjectIndexAccessor
 
 
 class Store:
@@ -14,6 +21,13 @@ class Store:
             app: The application
         """
         self.minio = MinioAccessor(app)
+        self.memory_cache = MemoryCacheAccessor(app)
+        self.disk_cache = DiskCacheAccessor(app)
+        self.metadata_cache = MetadataCacheAccessor(app)
+        self.images = ImageAccessor(app)
+        self.duplicates = DuplicateIndexAccessor(app)
+        self.dedup = DedupAccessor(app)
+        self.index = ObjectIndexAccessor(app)
         self.s3 = S3Accessor(app)
 
 
@@ -1,11 +1,25 @@
 from core.app import ApplicationImage
 from store.S3.helper import S3Accessor
+from store.S3.dedup import DedupAccessor
+from store.cache.disk import DiskCacheAccessor
+from store.cache.memory import MemoryCacheAccessor
+from store.cache.metadata import MetadataCacheAccessor
 from store.database.minio import MinioAccessor
+from store.images.accessor import ImageAccessor
+from store.images.duplicates import DuplicateIndexAccessor
+from store.index.accessor import ObjectIndexAccessor
 
 class Store:
     """Data management service"""
 
     minio: MinioAccessor
+    memory_cache: MemoryCacheAccessor
+    disk_cache: DiskCacheAccessor
+    metadata_cache: MetadataCacheAccessor
+    images: ImageAccessor
+    duplicates: DuplicateIndexAccessor
+    dedup: DedupAccessor
+    index: ObjectIndexAccessor
     s3: S3Accessor
 
     def __init__(self, app: ApplicationImage):
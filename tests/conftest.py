@@ -0,0 +1,129 @@
+"""Общие фикстуры тестов.
+
+Сервис запускается целиком, через `setup_app`, поверх S3-совместимого
+сервера в памяти из `benchmarks/fake_s3.py`. Запросы выполняются напрямую
+через ASGI, без сети между клиентом и приложением.
+"""
+
+import io
+import sys
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, NamedTuple
+
+import httpx
+import pytest
+from PIL import Image, ImageDraw
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "meme_storage"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fake_s3 import FakeS3  # noqa: E402
+
+BUCKET = "memes"
+JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + bytes(range(256)) * 40
+
+
+class Service(NamedTuple):
+    """Запущенное приложение и клиент к нему."""
+
+    app: Any
+    client: httpx.AsyncClient
+
+
+MakeService = Callable[..., Awaitable[Service]]
+
+
+def picture(seed: int) -> bytes:
+    """Настоящий JPEG с полосами, положение которых зависит от `seed`."""
+    image = Image.new("L", (128, 128), 255)
+    draw = ImageDraw.Draw(image)
+    for i in range(seed % 7 + 1):
+        x = (seed * 37 + i * 23) % 112
+        draw.rectangle((x, 0, x + 8 + i * 3, 127), fill=(seed * 53 + i * 71) % 200)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+async def upload(client: httpx.AsyncClient, name: str, body: bytes = JPEG):
+    response = await client.post(f"/upload/{BUCKET}/{name}", content=body)
+    assert response.status_code == 200, response.text
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+def env(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Callable[..., None]:
+    """Переменные среды сервиса; файлы кэшей и индексов - во временном каталоге."""
+    values = {
+        "LEVEL": "WARNING",
+        "GURU": "False",
+        "TRACEBACK": "False",
+        "CONFIG_RELOAD_INTERVAL": "0",
+        "MINIO_SECURE": "False",
+        "MINIO_BUCKETS": f'["{BUCKET}"]',
+        "DISK_CACHE_PATH": str(tmp_path / "cache"),
+        "IMAGE_PHASH_PATH": str(tmp_path / "phash"),
+        "INDEX_PATH": str(tmp_path / "index.sqlite3"),
+    }
+
+    def setenv(**overrides: str):
+        for name, value in {**values, **overrides}.items():
+            monkeypatch.setenv(name, value)
+
+    setenv()
+    return setenv
+
+
+@pytest.fixture
+async def s3(env: Callable[..., None]) -> AsyncIterator[FakeS3]:
+    server = FakeS3()
+    port = await server.start()
+    env(MINIO_ENDPOINT=f"127.0.0.1:{port}")
+    yield server
+    await server.stop()
+
+
+@pytest.fixture
+async def make_service(
+    s3: FakeS3, env: Callable[..., None]
+) -> AsyncIterator[MakeService]:
+    """Фабрика приложений, запущенных с заданными настройками."""
+    from core.setup import setup_app
+
+    started = []
+
+    async def make(**settings: str) -> Service:
+        env(**settings)
+        app = setup_app()
+        await app.router.startup()
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test"
+        )
+        started.append(Service(app, client))
+        return started[-1]
+
+    yield make
+    for app, client in reversed(started):
+        await client.aclose()
+        await app.router.shutdown()
+
+
+@pytest.fixture
+async def service(make_service: MakeService) -> Service:
+    return await make_service()
+
+
+@pytest.fixture
+def client(service: Service) -> httpx.AsyncClient:
+    return service.client
+
+
+def pytest_configure(config: pytest.Config):
+    config.addinivalue_line(
+        "filterwarnings", "ignore:\\s*on_event is deprecated:DeprecationWarning"
+    )
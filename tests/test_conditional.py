@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from conftest import BUCKET, JPEG, MakeService, upload
+from store.S3.conditions import (
+    format_http_date,
+    is_not_modified,
+    is_range_fresh,
+    parse_http_date,
+)
+
+pytestmark = pytest.mark.anyio
+
+ETAG = '"abc"'
+MODIFIED = datetime(2024, 5, 1, 12, 0, 0, 500_000, tzinfo=timezone.utc)
+DATE = "Wed, 01 May 2024 12:00:00 GMT"
+
+
+def test_http_dates_round_trip():
+    assert format_http_date(MODIFIED.replace(microsecond=0)) == DATE
+    assert parse_http_date(DATE) == MODIFIED.replace(microsecond=0)
+    assert parse_http_date("yesterday") is None
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, False),
+        ({"if-none-match": ETAG}, True),
+        ({"if-none-match": 'W/"abc"'}, True),
+        ({"if-none-match": '"x", "abc"'}, True),
+        ({"if-none-match": "*"}, True),
+        ({"if-none-match": '"x"'}, False),
+        ({"if-modified-since": DATE}, True),
+        ({"if-modified-since": "Wed, 01 May 2024 11:59:59 GMT"}, False),
+        ({"if-modified-since": "garbage"}, False),
+        ({"if-none-match": '"x"', "if-modified-since": DATE}, False),
+    ],
+)
+def test_is_not_modified(headers, expected):
+    assert is_not_modified(headers, ETAG, MODIFIED) is expected
+
+
+@pytest.mark.parametrize(
+    "if_range, expected",
+    [
+        (None, True),
+        (ETAG, True),
+        ('W/"abc"', False),
+        ('"x"', False),
+        (DATE, True),
+        ("Wed, 01 May 2024 11:00:00 GMT", False),
+    ],
+)
+def test_is_range_fresh(if_range, expected):
+    headers = {} if if_range is None else {"if-range": if_range}
+    assert is_range_fresh(headers, ETAG, MODIFIED) is expected
+
+
+@pytest.mark.parametrize("settings", [{}, {"METADATA_CACHE_ENABLED": "True"}])
+async def test_conditional_download(make_service: MakeService, settings: dict):
+    _, client = await make_service(**settings)
+    await upload(client, "a.jpg")
+    url = f"/download/{BUCKET}/a.jpg"
+    response = await client.get(url)
+    etag, modified = response.headers["etag"], response.headers["last-modified"]
+
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b"" and response.headers["etag"] == etag
+    response = await client.get(url, headers={"If-Modified-Since": modified})
+    assert response.status_code == 304
+    earlier = format_http_date(parse_http_date(modified) - timedelta(seconds=1))
+    response = await client.get(url, headers={"If-Modified-Since": earlier})
+    assert response.status_code == 200 and response.content == JPEG
+
+
+async def test_stale_if_range_gets_whole_object(make_service: MakeService):
+    _, client = await make_service()
+    await upload(client, "a.jpg")
+    url = f"/download/{BUCKET}/a.jpg"
+    etag = (await client.get(url)).headers["etag"]
+
+    response = await client.get(url, headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206 and response.content == JPEG[:10]
+    await upload(client, "a.jpg", JPEG + b"\0")
+    response = await client.get(url, headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 200 and response.content == JPEG + b"\0"
+
+
+@pytest.mark.parametrize(
+    "settings", [{"MEMORY_CACHE_ENABLED": "True"}, {"DISK_CACHE_ENABLED": "True"}]
+)
+async def test_cached_objects_answer_conditional_requests(
+    make_service: MakeService, settings: dict
+):
+    _, client = await make_service(**settings)
+    await upload(client, "a.jpg")
+    url = f"/download/{BUCKET}/a.jpg"
+    etag = (await client.get(url)).headers["etag"]
+    assert (await client.get(url)).content == JPEG
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from conftest import BUCKET, JPEG, ROOT, MakeService
+
+pytestmark = pytest.mark.anyio
+
+
+def test_import_does_not_read_environment():
+    env = {
+        name: value
+        for name, value in os.environ.items()
+        if name not in ("LEVEL", "GURU", "TRACEBACK")
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", "import core.setup, core.middelware, image.views"],
+        cwd=ROOT / "meme_storage",
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+
+async def test_each_app_has_own_config(make_service: MakeService):
+    first = await make_service(SIZE="1000")
+    second = await make_service(SIZE="2000")
+    assert first.app.config is not second.app.config
+    assert first.app.config.file.size == 1000
+    assert second.app.config.file.size == 2000
+
+
+async def test_shutdown_unsubscribes_listeners(make_service: MakeService):
+    service = await make_service()
+    assert service.app.config._listeners
+    await service.app.router.shutdown()
+    assert not service.app.config._listeners
+
+
+async def test_reload_reaches_views_and_middleware(
+    make_service: MakeService, monkeypatch: pytest.MonkeyPatch
+):
+    app, client = await make_service(SIZE=str(len(JPEG)), APP_PORT="8005")
+    form = {"bucket": BUCKET, "object_name": "a.jpg"}
+    response = await client.post(
+        "/upload", data=form, files={"file": ("a.jpg", JPEG, "image/jpeg")}
+    )
+    assert response.status_code == 200
+
+    monkeypatch.setenv("SIZE", str(len(JPEG) - 1))
+    monkeypatch.setenv("APP_PORT", "8006")
+    assert app.config.reload()
+    assert app.settings.app_port == 8006
+    response = await client.post(
+        "/upload", data=form, files={"file": ("a.jpg", JPEG, "image/jpeg")}
+    )
+    assert response.status_code == 413
+    response = await client.post(f"/upload/{BUCKET}/b.jpg", content=JPEG)
+    assert response.status_code == 413
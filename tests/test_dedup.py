@@ -0,0 +1,197 @@
+import asyncio
+import io
+import zipfile
+from random import Random
+
+import pytest
+from conftest import BUCKET, JPEG, FakeS3, MakeService, upload
+from store.S3.exeptions import S3FileNotFoundException
+
+pytestmark = pytest.mark.anyio
+
+OTHER = JPEG + b"\0"
+
+
+def keys(s3: FakeS3, prefix: str = "") -> list[str]:
+    return sorted(key for key in s3.buckets[BUCKET] if key.startswith(prefix))
+
+
+async def test_no_reference_lookups_without_dedup(
+    s3: FakeS3, make_service: MakeService
+):
+    _, client = await make_service()
+    await upload(client, "a.jpg")
+
+    s3.log.clear()
+    await upload(client, "a.jpg")
+    assert s3.log == [("PUT", f"{BUCKET}/a.jpg")]
+
+    s3.log.clear()
+    response = await client.get(f"/download/{BUCKET}/a.jpg")
+    assert response.content == JPEG
+    assert s3.log == [("GET", f"{BUCKET}/a.jpg")]
+
+    s3.log.clear()
+    response = await client.delete(f"/delete/{BUCKET}/a.jpg")
+    assert response.status_code == 200
+    assert s3.log == [("HEAD", f"{BUCKET}/a.jpg"), ("DELETE", f"{BUCKET}/a.jpg")]
+
+
+async def test_missing_object_is_not_found(make_service: MakeService):
+    _, client = await make_service()
+    response = await client.delete(f"/delete/{BUCKET}/missing.jpg")
+    assert S3FileNotFoundException.args[0] in response.json()["message"]
+    files = {"file": ("a.jpg", JPEG, "image/jpeg")}
+    response = await client.put(f"/update/{BUCKET}/missing.jpg", files=files)
+    assert S3FileNotFoundException.args[0] in response.json()["message"]
+
+
+async def test_identical_uploads_share_one_blob(
+    s3: FakeS3, make_service: MakeService
+):
+    _, client = await make_service(UPLOAD_DEDUP="True")
+    await upload(client, "a.jpg")
+    await upload(client, "b.jpg")
+    assert len(keys(s3, "_blobs/")) == 1
+    assert len(keys(s3, "_refs/")) == 2
+    assert s3.buckets[BUCKET]["a.jpg"].body == b""
+
+    await upload(client, "b.jpg", OTHER)
+    assert len(keys(s3, "_blobs/")) == 2
+    response = await client.delete(f"/delete/{BUCKET}/a.jpg")
+    assert response.status_code == 200
+    assert len(keys(s3, "_blobs/")) == 1
+    response = await client.get(f"/download/{BUCKET}/b.jpg")
+    assert response.content == OTHER
+
+
+async def test_references_resolve_after_dedup_is_disabled(
+    s3: FakeS3, make_service: MakeService, env
+):
+    app, client = await make_service(UPLOAD_DEDUP="True")
+    await upload(client, "a.jpg")
+    env(UPLOAD_DEDUP="False")
+    assert app.config.reload()
+
+    response = await client.get(f"/download/{BUCKET}/a.jpg")
+    assert response.content == JPEG
+    await upload(client, "a.jpg", OTHER)
+    assert keys(s3, "_blobs/") == keys(s3, "_refs/") == []
+    response = await client.get(f"/download/{BUCKET}/a.jpg")
+    assert response.content == OTHER
+
+
+async def test_other_process_sees_existing_blobs(
+    s3: FakeS3, make_service: MakeService
+):
+    _, writer = await make_service(UPLOAD_DEDUP="True")
+    await upload(writer, "a.jpg")
+    _, reader = await make_service(UPLOAD_DEDUP="False")
+    response = await reader.get(f"/download/{BUCKET}/a.jpg")
+    assert response.content == JPEG
+    response = await reader.delete(f"/delete/{BUCKET}/a.jpg")
+    assert response.status_code == 200
+    assert keys(s3) == []
+
+
+async def test_prefix_delete_looks_up_only_empty_objects(
+    s3: FakeS3, make_service: MakeService, env
+):
+    app, client = await make_service(UPLOAD_DEDUP="True")
+    await upload(client, "p-ref.jpg")
+    env(UPLOAD_DEDUP="False")
+    assert app.config.reload()
+    await upload(client, "p-plain.jpg")
+
+    s3.log.clear()
+    response = await client.post(f"/delete/batch/{BUCKET}", json={"prefix": "p-"})
+    assert response.status_code == 200
+    heads = [key for method, key in s3.log if method == "HEAD"]
+    assert [key for key in heads if key.startswith(f"{BUCKET}/p-")] == [
+        f"{BUCKET}/p-ref.jpg"
+    ]
+    assert keys(s3) == []
+
+
+async def test_archive_follows_references_from_get(
+    s3: FakeS3, make_service: MakeService
+):
+    _, client = await make_service(UPLOAD_DEDUP="True")
+    await upload(client, "a.jpg")
+    await upload(client, "b.jpg", OTHER)
+
+    s3.log.clear()
+    response = await client.post(
+        f"/download/archive/{BUCKET}", json={"object_names": ["a.jpg", "b.jpg"]}
+    )
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.read("a.jpg") == JPEG
+    assert archive.read("b.jpg") == OTHER
+    assert {method for method, key in s3.log if key != BUCKET} == {"GET"}
+
+
+async def test_form_upload_is_stored_as_blob(s3: FakeS3, make_service: MakeService):
+    _, client = await make_service(UPLOAD_DEDUP="True")
+    response = await client.post(
+        "/upload",
+        data={"bucket": BUCKET, "object_name": "a.jpg"},
+        files={"file": ("a.jpg", JPEG, "image/jpeg")},
+    )
+    assert response.status_code == 200
+    (blob,) = keys(s3, "_blobs/")
+    assert s3.buckets[BUCKET][blob].body == JPEG
+
+
+@pytest.mark.parametrize("after_delete", [False, True])
+async def test_reference_written_by_other_process_during_release(
+    s3: FakeS3,
+    make_service: MakeService,
+    monkeypatch: pytest.MonkeyPatch,
+    after_delete: bool,
+):
+    deleter, deleter_client = await make_service(UPLOAD_DEDUP="True")
+    _, writer = await make_service(UPLOAD_DEDUP="True")
+    await upload(deleter_client, "a.jpg")
+    (blob,) = keys(s3, "_blobs/")
+    client = deleter.store.minio.client
+    remove_object = client.remove_object
+
+    async def racing_remove(bucket_name: str, object_name: str):
+        if object_name == blob and not after_delete:
+            await upload(writer, "b.jpg")
+        await remove_object(bucket_name, object_name)
+        if object_name == blob and after_delete:
+            await upload(writer, "b.jpg")
+
+    monkeypatch.setattr(client, "remove_object", racing_remove)
+    response = await deleter_client.delete(f"/delete/{BUCKET}/a.jpg")
+    assert response.status_code == 200
+
+    assert keys(s3, "_blobs/") == [blob]
+    response = await writer.get(f"/download/{BUCKET}/b.jpg")
+    assert response.content == JPEG
+
+
+async def test_concurrent_writers_never_lose_blobs(
+    s3: FakeS3, make_service: MakeService
+):
+    workers = [
+        (await make_service(UPLOAD_DEDUP="True")).client for _ in range(3)
+    ]
+    random = Random(0)
+
+    async def run(client):
+        for _ in range(30):
+            name = f"{random.randrange(4)}.jpg"
+            if random.random() < 0.6:
+                await upload(client, name, random.choice([JPEG, OTHER]))
+            else:
+                await client.delete(f"/delete/{BUCKET}/{name}")
+
+    await asyncio.gather(*(run(client) for client in workers))
+    objects = s3.buckets[BUCKET]
+    for name in keys(s3):
+        if digest := objects[name].metadata.get("x-amz-meta-blob"):
+            assert f"_blobs/{digest}" in objects, name
+            assert f"_refs/{digest}/{name}" in objects, name
+    assert all(key.count(".") == 0 for key in keys(s3, "_blobs/"))
@@ -0,0 +1,89 @@
+import asyncio
+import os
+
+import pytest
+from conftest import BUCKET, JPEG, MakeService, upload
+
+pytestmark = pytest.mark.anyio
+
+
+async def cached_service(make_service: MakeService):
+    service = await make_service(DISK_CACHE_ENABLED="True")
+    await upload(service.client, "a.jpg")
+    response = await service.client.get(f"/download/{BUCKET}/a.jpg")
+    assert response.content == JPEG
+    assert service.app.store.disk_cache.stats()["entries"] == 1
+    return service
+
+
+async def send_response(response) -> list[dict]:
+    """Отправляет ответ как ASGI сервер и возвращает отправленные сообщения."""
+    messages = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "headers": []}
+    await response(scope, receive, send)
+    return messages
+
+
+async def test_file_removed_after_headers_is_still_served(make_service: MakeService):
+    app, _ = await cached_service(make_service)
+    disk_cache = app.store.disk_cache
+    (entry,) = disk_cache._entries.values()
+    response = await app.store.s3._download(BUCKET, "a.jpg")
+    disk_cache.invalidate(BUCKET, "a.jpg")
+    while os.path.exists(entry.path):
+        await asyncio.sleep(0.01)
+
+    start, *body = await send_response(response)
+    assert start["status"] == 200
+    assert b"".join(message.get("body", b"") for message in body) == JPEG
+
+
+async def test_ranges_are_read_from_the_cached_file(make_service: MakeService):
+    app, client = await cached_service(make_service)
+    hits = app.store.disk_cache.hits
+    response = await client.get(
+        f"/download/{BUCKET}/a.jpg", headers={"Range": "bytes=10-19"}
+    )
+    assert response.status_code == 206
+    assert response.content == JPEG[10:20]
+    assert app.store.disk_cache.hits == hits + 1
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [{}, {"Range": "bytes=0-3,10-13"}, {"Range": f"bytes={len(JPEG)}-"}],
+)
+async def test_cached_file_is_closed_after_response(
+    make_service: MakeService, monkeypatch: pytest.MonkeyPatch, headers: dict
+):
+    app, client = await cached_service(make_service)
+    disk_cache = app.store.disk_cache
+    get = disk_cache.get
+    opened = []
+
+    async def tracked_get(bucket: str, object_name: str):
+        file = await get(bucket, object_name)
+        opened.append(file)
+        return file
+
+    monkeypatch.setattr(disk_cache, "get", tracked_get)
+    response = await client.get(f"/download/{BUCKET}/a.jpg", headers=headers)
+    etag = response.headers.get("etag")
+    if etag:
+        await client.get(f"/download/{BUCKET}/a.jpg", headers={"If-None-Match": etag})
+    assert opened and all(file.file.closed for file in opened)
+
+
+async def test_missing_file_falls_back_to_s3(make_service: MakeService):
+    app, client = await cached_service(make_service)
+    (entry,) = app.store.disk_cache._entries.values()
+    os.unlink(entry.path)
+    response = await client.get(f"/download/{BUCKET}/a.jpg")
+    assert response.content == JPEG
@@ -0,0 +1,147 @@
+import asyncio
+import os
+from random import Random
+
+import pytest
+from conftest import BUCKET, MakeService, picture, upload
+from image.schemas import OkSchema
+
+pytestmark = pytest.mark.anyio
+
+
+A, B = picture(1), picture(4)
+
+
+async def test_stream_uploads_are_hashed(make_service: MakeService):
+    _, client = await make_service(IMAGE_PHASH_ENABLED="True")
+    await upload(client, "a.jpg", A)
+    await upload(client, "b.jpg", A)
+    response = await client.get(f"/duplicates/{BUCKET}/a.jpg?distance=0")
+    assert [item["object_name"] for item in response.json()["duplicates"]] == ["b.jpg"]
+
+
+async def test_reject_mode_covers_every_upload_endpoint(make_service: MakeService):
+    _, client = await make_service(
+        IMAGE_PHASH_ENABLED="True", IMAGE_PHASH_REJECT="True"
+    )
+    await upload(client, "a.jpg", A)
+    await upload(client, "a.jpg", A)
+
+    response = await client.post(f"/upload/{BUCKET}/b.jpg", content=A)
+    assert response.status_code == 409
+    response = await client.post(
+        "/upload",
+        data={"bucket": BUCKET, "object_name": "b.jpg"},
+        files={"file": ("b.jpg", A, "image/jpeg")},
+    )
+    assert response.status_code == 409
+    files = [
+        ("files", ("b.jpg", A, "image/jpeg")),
+        ("files", ("c.jpg", B, "image/jpeg")),
+    ]
+    response = await client.post(f"/upload/batch?bucket={BUCKET}", files=files)
+    statuses = {r["object_name"]: r["status"] for r in response.json()["results"]}
+    assert statuses["c.jpg"] == OkSchema().status != statuses["b.jpg"]
+
+    response = await client.get(f"/download/{BUCKET}/b.jpg")
+    assert response.status_code != 200
+    response = await client.get(f"/download/{BUCKET}/c.jpg")
+    assert response.content == B
+
+
+async def test_workers_share_the_index(make_service: MakeService):
+    indexes = [
+        (await make_service(IMAGE_PHASH_ENABLED="True")).app.store.duplicates
+        for _ in range(3)
+    ]
+    random = Random(0)
+    expected: dict[str, int] = {}
+
+    async def run(worker: int, index):
+        # Порядок записей одного ключа из разных процессов не определён,
+        # поэтому ключи у процессов свои, а ячейки массива - общие.
+        for _ in range(60):
+            name = f"{worker}-{random.randrange(15)}.jpg"
+            if random.random() < 0.7:
+                value = random.getrandbits(64)
+                expected[name] = value
+                await index.put(BUCKET, name, value)
+            else:
+                expected.pop(name, None)
+                await index.remove(BUCKET, name)
+
+    await asyncio.gather(*(run(*item) for item in enumerate(indexes)))
+    for index in indexes:
+        for name, value in expected.items():
+            assert await index.get(BUCKET, name) == value
+            found = await index.search(value, 0)
+            assert (BUCKET, name) in [(item.bucket, item.name) for item in found]
+        assert len(await index.search(0, 64)) == len(expected)
+
+
+async def test_search_by_distance(make_service: MakeService):
+    app, client = await make_service(IMAGE_PHASH_ENABLED="True")
+    index = app.store.duplicates
+    value = 0x0123_4567_89AB_CDEF
+    for name, flipped in (("a", 0), ("b", 0b1), ("c", 0b111), ("d", (1 << 64) - 1)):
+        await index.put(BUCKET, name, value ^ flipped)
+    found = await index.search(value, 3)
+    assert [(item.name, item.distance) for item in found] == [
+        ("a", 0),
+        ("b", 1),
+        ("c", 3),
+    ]
+    assert [item.name for item in await index.search(value, 0, (BUCKET, "a"))] == []
+    assert len(await index.search(value, 100)) == 4
+
+    await upload(client, "e.jpg", A)
+    response = await client.post(
+        "/duplicates?distance=0", files={"file": ("a.jpg", A, "image/jpeg")}
+    )
+    assert response.json()["phash"] == f"{await index.get(BUCKET, 'e.jpg'):016x}"
+    assert [item["object_name"] for item in response.json()["duplicates"]] == ["e.jpg"]
+
+
+async def test_remove_moves_the_last_slot(make_service: MakeService):
+    app, _ = await make_service(IMAGE_PHASH_ENABLED="True")
+    index = app.store.duplicates
+    for slot, name in enumerate("abc"):
+        await index.put(BUCKET, name, slot + 1)
+    await index.remove(BUCKET, "a")
+    await index.remove(BUCKET, "missing")
+    assert index.count == 2
+    assert [int(value) for value in index._hashes[:2]] == [3, 2]
+    for value, name in ((2, "b"), (3, "c")):
+        assert [item.name for item in await index.search(value, 0)] == [name]
+
+
+@pytest.mark.parametrize("damage", ["truncate", "overwrite"])
+async def test_hashes_are_rebuilt_from_the_database(
+    make_service: MakeService, damage: str
+):
+    app, _ = await make_service(IMAGE_PHASH_ENABLED="True")
+    index = app.store.duplicates
+    values = {f"{slot}.jpg": (slot + 1) << 8 for slot in range(5)}
+    for name, value in values.items():
+        await index.put(BUCKET, name, value)
+    await index.disconnect()
+    path = os.path.join(app.config.image.image_phash_path, "hashes.u64")
+    if damage == "truncate":
+        os.truncate(path, 16)
+    else:
+        with open(path, "r+b") as file:
+            file.write(bytes(len(values) * 8))
+
+    await index.connect()
+    assert index.count == len(values)
+    for name, value in values.items():
+        assert [item.name for item in await index.search(value, 0)] == [name]
+
+
+async def test_index_survives_restart(make_service: MakeService):
+    app, _ = await make_service(IMAGE_PHASH_ENABLED="True")
+    await app.store.duplicates.put(BUCKET, "a.jpg", 42)
+    await app.router.shutdown()
+    app, _ = await make_service(IMAGE_PHASH_ENABLED="True")
+    found = await app.store.duplicates.search(42, 0)
+    assert [(item.bucket, item.name) for item in found] == [(BUCKET, "a.jpg")]
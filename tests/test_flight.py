@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+from conftest import BUCKET, JPEG, FakeS3, Service, upload
+from store.S3.flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+CHUNKS = [bytes([i]) * 10 for i in range(8)]
+
+
+async def source(chunks: list[bytes], gate: asyncio.Event = None):
+    for chunk in chunks:
+        if gate is not None:
+            await gate.wait()
+        yield chunk
+
+
+def resume_from(chunks: list[bytes], calls: list[int]):
+    data = b"".join(chunks)
+
+    async def resume(offset: int):
+        calls.append(offset)
+        yield data[offset:]
+
+    return resume
+
+
+async def read(content) -> bytes:
+    return b"".join([chunk async for chunk in content])
+
+
+async def body(response) -> bytes:
+    return await read(response.body_iterator)
+
+
+async def test_subscribers_share_one_read():
+    flights = SingleFlight(replay_limit=1024, queue_size=16)
+    flight = flights.lead("b", "k")
+    calls = []
+    first = flight.subscribe(resume_from(CHUNKS, calls))
+    flight.start(source(CHUNKS), {})
+    second = flights.join("b", "k").subscribe(resume_from(CHUNKS, calls))
+    data = b"".join(CHUNKS)
+    assert await asyncio.gather(read(first), read(second)) == [data, data]
+    assert calls == []
+    assert len(flights) == 0
+
+
+async def test_slow_subscriber_detaches_and_resumes():
+    flights = SingleFlight(replay_limit=0, queue_size=2)
+    flight = flights.lead("b", "k")
+    calls = []
+    fast = flight.subscribe(resume_from(CHUNKS, calls))
+    slow = flight.subscribe(resume_from(CHUNKS, calls))
+    flight.start(source(CHUNKS), {})
+    assert await read(fast) == b"".join(CHUNKS)
+    assert await read(slow) == b"".join(CHUNKS)
+    assert len(calls) == 1
+
+
+async def test_cancelled_pump_makes_subscribers_resume():
+    flights = SingleFlight(replay_limit=1024, queue_size=16)
+    flight = flights.lead("b", "k")
+    calls = []
+    gate = asyncio.Event()
+    content = flight.subscribe(resume_from(CHUNKS, calls))
+    flight.start(source(CHUNKS, gate), {})
+    await asyncio.sleep(0)
+    flight._task.cancel()
+    gate.set()
+    assert await read(content) == b"".join(CHUNKS)
+    assert calls == [0]
+    assert len(flights) == 0
+
+
+def block_first_fetch(monkeypatch: pytest.MonkeyPatch, accessor, error=None):
+    """Первое чтение из S3 ждёт, пока его не отменят, или падает с `error`."""
+    fetch = accessor._fetch_object
+    started = asyncio.Event()
+    proceed = asyncio.Event()
+    calls = []
+
+    async def fetch_object(bucket: str, object_name: str):
+        calls.append(object_name)
+        if len(calls) == 1:
+            started.set()
+            await proceed.wait()
+            if error is not None:
+                raise error
+        return await fetch(bucket, object_name)
+
+    monkeypatch.setattr(accessor, "_fetch_object", fetch_object)
+    return started, proceed, calls
+
+
+async def test_concurrent_downloads_share_one_get(s3: FakeS3, service: Service):
+    await upload(service.client, "a.jpg")
+    accessor = service.app.store.s3
+    s3.log.clear()
+    responses = await asyncio.gather(
+        *(accessor._download_object(BUCKET, "a.jpg") for _ in range(5))
+    )
+    assert [await body(response) for response in responses] == [JPEG] * 5
+    assert s3.log.count(("GET", f"{BUCKET}/a.jpg")) == 1
+
+
+async def test_cancelled_leader_lets_joiner_read(
+    service: Service, monkeypatch: pytest.MonkeyPatch
+):
+    await upload(service.client, "a.jpg")
+    accessor = service.app.store.s3
+    started, _, calls = block_first_fetch(monkeypatch, accessor)
+
+    leader = asyncio.create_task(accessor._download_object(BUCKET, "a.jpg"))
+    await started.wait()
+    joiner = asyncio.create_task(accessor._download_object(BUCKET, "a.jpg"))
+    await asyncio.sleep(0)
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+    response = await asyncio.wait_for(joiner, 5)
+    assert await body(response) == JPEG
+    assert len(calls) == 2
+    assert len(accessor.flights) == 0
+
+
+async def test_cancelled_joiner_does_not_affect_others(
+    service: Service, monkeypatch: pytest.MonkeyPatch
+):
+    await upload(service.client, "a.jpg")
+    accessor = service.app.store.s3
+    started, proceed, calls = block_first_fetch(monkeypatch, accessor)
+
+    leader = asyncio.create_task(accessor._download_object(BUCKET, "a.jpg"))
+    await started.wait()
+    cancelled = asyncio.create_task(accessor._download_object(BUCKET, "a.jpg"))
+    joiner = asyncio.create_task(accessor._download_object(BUCKET, "a.jpg"))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    proceed.set()
+
+    responses = await asyncio.wait_for(asyncio.gather(leader, joiner), 5)
+    assert [await body(response) for response in responses] == [JPEG] * 2
+    assert len(calls) == 1
+
+
+async def test_failed_leader_fails_joiners(
+    service: Service, monkeypatch: pytest.MonkeyPatch
+):
+    await upload(service.client, "a.jpg")
+    accessor = service.app.store.s3
+    error = ConnectionResetError("S3 недоступен")
+    started, proceed, _ = block_first_fetch(monkeypatch, accessor, error)
+
+    leader = asyncio.create_task(accessor._download_object(BUCKET, "a.jpg"))
+    await started.wait()
+    joiner = asyncio.create_task(accessor._download_object(BUCKET, "a.jpg"))
+    await asyncio.sleep(0)
+    proceed.set()
+
+    results = await asyncio.gather(leader, joiner, return_exceptions=True)
+    assert results == [error, error]
+    assert len(accessor.flights) == 0
@@ -0,0 +1,53 @@
+import pytest
+from conftest import BUCKET, FakeS3, MakeService, Service, picture, upload
+from store.images.accessor import Meme, Variant
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize(
+    "width, height, quality, expected",
+    [
+        (100, 100, None, Variant(128, 128, 80)),
+        (64, None, 81, Variant(64, 2048, 80)),
+        (1, 2048, 1, Variant(64, 2048, 60)),
+        (1500, 300, 88, Variant(2048, 512, 95)),
+        (200, 200, 70, Variant(256, 256, 80)),
+    ],
+)
+async def test_variants_are_snapped(service: Service, width, height, quality, expected):
+    assert service.app.store.images.variant(width, height, quality) == expected
+
+
+async def test_sizes_above_the_limit_snap_to_it(make_service: MakeService):
+    app, _ = await make_service(IMAGE_MAX_DIMENSION="300")
+    assert app.store.images.variant(257, 10, None) == Variant(300, 64, 80)
+
+
+async def test_meme_quality_is_snapped(service: Service):
+    meme = service.app.store.images.meme("top", "", 93)
+    assert meme == Meme("top", "", 95)
+
+
+async def test_close_variant_requests_share_one_object(
+    s3: FakeS3, make_service: MakeService
+):
+    _, client = await make_service()
+    await upload(client, "a.jpg", picture(1))
+    for width in (100, 110, 128):
+        response = await client.get(f"/thumb/{BUCKET}/a.jpg?width={width}")
+        assert response.status_code == 200
+    assert len([key for key in s3.buckets[BUCKET] if key.startswith("_variants/")]) == 1
+
+
+async def test_memes_are_capped_per_template(make_service: MakeService):
+    _, client = await make_service(IMAGE_MEME_MAX_PER_TEMPLATE="2")
+    await upload(client, "t.jpg", picture(1))
+    await upload(client, "u.jpg", picture(2))
+    for caption in ("a", "b", "a"):
+        response = await client.get(f"/meme/{BUCKET}/t.jpg?top={caption}")
+        assert response.status_code == 200
+    response = await client.get(f"/meme/{BUCKET}/t.jpg?top=c")
+    assert response.status_code == 403
+    response = await client.get(f"/meme/{BUCKET}/u.jpg?top=c")
+    assert response.status_code == 200
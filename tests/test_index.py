@@ -0,0 +1,126 @@
+import httpx
+import pytest
+from conftest import BUCKET, JPEG, FakeS3, MakeService, upload
+
+pytestmark = pytest.mark.anyio
+
+INDEXED = {"INDEX_ENABLED": "True", "INDEX_RECONCILE_INTERVAL": "3600"}
+NAMES = ["b.jpg", "a-2.jpg", "c.jpg", "a-1.jpg", "d.jpg"]
+
+
+async def listing(client: httpx.AsyncClient, **params) -> list[str]:
+    """Ключи всех страниц списка, пройденных по курсорам."""
+    names = []
+    while True:
+        response = await client.get(f"/list/{BUCKET}", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["objects"]) <= params.get("limit", 100)
+        names += [item["object_name"] for item in page["objects"]]
+        if page["next_cursor"] is None:
+            return names
+        params = {**params, "cursor": page["next_cursor"]}
+
+
+async def upload_all(client: httpx.AsyncClient):
+    for size, name in enumerate(NAMES):
+        await upload(client, name, JPEG + b"\0" * (len(NAMES) - size))
+
+
+@pytest.mark.parametrize(
+    "sort, expected",
+    [
+        ("name", sorted(NAMES)),
+        ("uploaded", NAMES),
+        ("size", NAMES[::-1]),
+    ],
+)
+@pytest.mark.parametrize("limit", [1, 2, 100])
+async def test_pages_cover_every_object_once(
+    make_service: MakeService, sort: str, expected: list[str], limit: int
+):
+    _, client = await make_service(**INDEXED)
+    await upload_all(client)
+    assert await listing(client, sort=sort, limit=limit) == expected
+    descending = await listing(client, sort=sort, order="desc", limit=limit)
+    assert descending == expected[::-1]
+
+
+async def test_prefix_narrows_every_sort(make_service: MakeService):
+    _, client = await make_service(**INDEXED)
+    await upload_all(client)
+    for sort in ("name", "uploaded", "size"):
+        names = await listing(client, prefix="a-", sort=sort, limit=1)
+        assert sorted(names) == ["a-1.jpg", "a-2.jpg"]
+
+
+async def test_writes_between_pages(make_service: MakeService):
+    _, client = await make_service(**INDEXED)
+    await upload_all(client)
+    page = (await client.get(f"/list/{BUCKET}", params={"limit": 2})).json()
+    assert [item["object_name"] for item in page["objects"]] == ["a-1.jpg", "a-2.jpg"]
+
+    await upload(client, "a-0.jpg")
+    await upload(client, "e.jpg")
+    await client.delete(f"/delete/{BUCKET}/c.jpg")
+    await upload(client, "b.jpg", JPEG)
+    rest = await listing(client, limit=2, cursor=page["next_cursor"])
+    assert rest == ["b.jpg", "d.jpg", "e.jpg"]
+
+
+async def test_cursor_is_tied_to_its_sort(make_service: MakeService):
+    _, client = await make_service(**INDEXED)
+    await upload_all(client)
+    url = f"/list/{BUCKET}"
+    cursor = (await client.get(url, params={"limit": 1})).json()["next_cursor"]
+    for params in (
+        {"cursor": cursor, "sort": "size"},
+        {"cursor": cursor, "order": "desc"},
+        {"cursor": "not a cursor"},
+        {"cursor": "W10="},
+    ):
+        response = await client.get(url, params=params)
+        assert response.status_code == 400
+
+
+async def test_listing_needs_the_index(make_service: MakeService):
+    _, client = await make_service()
+    assert (await client.get(f"/list/{BUCKET}")).status_code == 400
+
+
+async def test_internal_objects_are_hidden(make_service: MakeService):
+    app, client = await make_service(**INDEXED)
+    await upload(client, "a.jpg")
+    prefix = app.config.image.image_variant_prefix
+    await app.store.index.put(BUCKET, f"{prefix}/a.jpg", 1)
+    assert await listing(client) == ["a.jpg"]
+
+
+async def test_reconcile_finds_writes_that_bypass_the_service(
+    s3: FakeS3, make_service: MakeService
+):
+    app, client = await make_service(**INDEXED, INDEX_RECONCILE_PASS_INTERVAL="0")
+    await upload(client, "a.jpg")
+    await upload(client, "b.jpg")
+    s3.put(BUCKET, "c.jpg", JPEG)
+    s3.put(BUCKET, f"{app.config.image.image_variant_prefix}/c.jpg", JPEG)
+    del s3.buckets[BUCKET]["a.jpg"]
+    index = app.store.index
+    for _ in range(2):
+        await index._reconcile_page(BUCKET)
+    # Строку, записанную сервисом во время прохода, удаляет только следующий.
+    assert await listing(client) == ["a.jpg", "b.jpg", "c.jpg"]
+    for _ in range(2):
+        await index._reconcile_page(BUCKET)
+    assert await listing(client) == ["b.jpg", "c.jpg"]
+    objects, _ = await index.page(BUCKET)
+    assert [item.size for item in objects] == [len(JPEG)] * 2
+
+
+async def test_workers_share_the_index(make_service: MakeService):
+    _, first = await make_service(**INDEXED)
+    _, second = await make_service(**INDEXED)
+    await upload(first, "a.jpg")
+    await upload(second, "b.jpg")
+    await first.delete(f"/delete/{BUCKET}/a.jpg")
+    assert await listing(first) == await listing(second) == ["b.jpg"]
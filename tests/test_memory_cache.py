@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+
+import pytest
+from conftest import BUCKET, JPEG, FakeS3, MakeService, Service, upload
+from store.cache.memory import CachedObject
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+def cached(size: int) -> CachedObject:
+    return CachedObject(b"\0" * size, '"etag"', NOW)
+
+
+async def test_lru_is_bounded_by_bytes(make_service: MakeService):
+    app, _ = await make_service(
+        MEMORY_CACHE_ENABLED="True",
+        MEMORY_CACHE_MAX_BYTES="100",
+        MEMORY_CACHE_MAX_OBJECT_SIZE="60",
+    )
+    cache = app.store.memory_cache
+    cache.put(BUCKET, "a", cached(40), cache.epoch)
+    cache.put(BUCKET, "b", cached(40), cache.epoch)
+    assert cache.get(BUCKET, "a") is not None
+    cache.put(BUCKET, "c", cached(40), cache.epoch)
+    assert cache.get(BUCKET, "b") is None
+    assert cache.get(BUCKET, "a") is not None and cache.get(BUCKET, "c") is not None
+    assert cache.size == 80 and cache.evictions == 1
+
+    cache.put(BUCKET, "d", cached(61), cache.epoch)
+    assert cache.peek(BUCKET, "d") is None
+    cache.put(BUCKET, "a", cached(10), cache.epoch)
+    assert cache.size == 50
+
+
+async def test_put_started_before_invalidation_is_dropped(service: Service):
+    cache = service.app.store.memory_cache
+    epoch = cache.epoch
+    cache.invalidate(BUCKET, "other")
+    cache.put(BUCKET, "a", cached(10), epoch)
+    assert cache.peek(BUCKET, "a") is None
+
+
+async def test_hits_skip_s3(s3: FakeS3, make_service: MakeService):
+    app, client = await make_service(MEMORY_CACHE_ENABLED="True")
+    await upload(client, "a.jpg")
+    await client.get(f"/download/{BUCKET}/a.jpg")
+    s3.log.clear()
+    response = await client.get(f"/download/{BUCKET}/a.jpg")
+    assert response.content == JPEG
+    response = await client.get(
+        f"/download/{BUCKET}/a.jpg", headers={"Range": "bytes=1-2"}
+    )
+    assert response.content == JPEG[1:3]
+    assert s3.log == []
+    assert app.store.memory_cache.stats()["hits"] == 2
+
+
+async def test_write_during_download_is_not_cached(make_service: MakeService):
+    app, client = await make_service(MEMORY_CACHE_ENABLED="True")
+    await upload(client, "a.jpg")
+    response = await app.store.s3._download(BUCKET, "a.jpg")
+    await upload(client, "a.jpg", JPEG + b"\0")
+    assert b"".join([chunk async for chunk in response.body_iterator]) == JPEG
+
+    assert app.store.memory_cache.peek(BUCKET, "a.jpg") is None
+    response = await client.get(f"/download/{BUCKET}/a.jpg")
+    assert response.content == JPEG + b"\0"
@@ -0,0 +1,82 @@
+import pytest
+from conftest import BUCKET, JPEG, FakeS3, MakeService, upload
+from store.cache import metadata as metadata_module
+
+pytestmark = pytest.mark.anyio
+
+CACHED = {"METADATA_CACHE_ENABLED": "True", "METADATA_CACHE_TTL": "5"}
+
+
+def heads(s3: FakeS3, name: str) -> int:
+    return s3.log.count(("HEAD", f"{BUCKET}/{name}"))
+
+
+async def test_repeated_stats_hit_the_cache(s3: FakeS3, make_service: MakeService):
+    app, client = await make_service(**CACHED)
+    await upload(client, "a.jpg")
+    s3.log.clear()
+    cache = app.store.metadata_cache
+    first = await cache.stat(BUCKET, "a.jpg")
+    assert await cache.stat(BUCKET, "a.jpg") is first
+    assert first.size == len(JPEG)
+    assert heads(s3, "a.jpg") == 1
+
+
+async def test_missing_objects_are_cached_until_written(
+    s3: FakeS3, make_service: MakeService
+):
+    _, client = await make_service(**CACHED, METADATA_CACHE_NEGATIVE_TTL="5")
+    for _ in range(2):
+        response = await client.delete(f"/delete/{BUCKET}/a.jpg")
+        assert response.status_code != 200
+    assert heads(s3, "a.jpg") == 1
+
+    await upload(client, "a.jpg")
+    response = await client.delete(f"/delete/{BUCKET}/a.jpg")
+    assert response.status_code == 200
+
+
+async def test_entries_expire(
+    s3: FakeS3, make_service: MakeService, monkeypatch: pytest.MonkeyPatch
+):
+    app, client = await make_service(**CACHED)
+    await upload(client, "a.jpg")
+    cache = app.store.metadata_cache
+    s3.log.clear()
+    now = metadata_module.time.monotonic()
+    monkeypatch.setattr(metadata_module.time, "monotonic", lambda: now)
+    await cache.stat(BUCKET, "a.jpg")
+    monkeypatch.setattr(metadata_module.time, "monotonic", lambda: now + 6)
+    await cache.stat(BUCKET, "a.jpg")
+    assert heads(s3, "a.jpg") == 2
+
+
+async def test_entries_are_bounded(make_service: MakeService):
+    app, client = await make_service(**CACHED, METADATA_CACHE_MAX_ENTRIES="2")
+    cache = app.store.metadata_cache
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        await upload(client, name)
+        await cache.stat(BUCKET, name)
+    assert cache.get(BUCKET, "a.jpg") is None
+    assert cache.stats()["entries"] == 2 and cache.evictions == 1
+
+
+async def test_stat_racing_a_write_is_not_cached(
+    make_service: MakeService, monkeypatch: pytest.MonkeyPatch
+):
+    app, client = await make_service(**CACHED)
+    await upload(client, "a.jpg")
+    minio = app.store.minio.client
+    stat_object = minio.stat_object
+
+    async def racing_stat(bucket_name: str, object_name: str):
+        stat = await stat_object(bucket_name=bucket_name, object_name=object_name)
+        await upload(client, "a.jpg", JPEG + b"\0")
+        return stat
+
+    monkeypatch.setattr(minio, "stat_object", racing_stat)
+    stale = await app.store.metadata_cache.stat(BUCKET, "a.jpg")
+    assert stale.size == len(JPEG)
+    monkeypatch.setattr(minio, "stat_object", stat_object)
+    fresh = await app.store.metadata_cache.stat(BUCKET, "a.jpg")
+    assert fresh.size == len(JPEG) + 1
@@ -0,0 +1,78 @@
+import pytest
+from conftest import BUCKET, JPEG, MakeService
+from core.routing import RouteIndex
+from fastapi import APIRouter, status
+
+pytestmark = pytest.mark.anyio
+
+
+def make_routes():
+    router = APIRouter()
+    for path, method in (
+        ("/upload", "POST"),
+        ("/upload/batch", "POST"),
+        ("/upload/{bucket}/{name}", "POST"),
+        ("/files/{path:path}", "GET"),
+    ):
+        router.add_api_route(path, lambda: None, methods=[method])
+    return router.routes
+
+
+@pytest.mark.parametrize(
+    "method, path, expected",
+    [
+        ("POST", "/upload", "/upload"),
+        ("POST", "/upload/batch", "/upload/batch"),
+        ("POST", "/upload/batch/a.jpg", "/upload/{bucket}/{name}"),
+        ("POST", "/uploadfoo", None),
+        ("GET", "/upload", None),
+        ("GET", "/files/a/b/c", "/files/{path}"),
+    ],
+)
+def test_route_index_match(method, path, expected):
+    route = RouteIndex().match(make_routes(), method, path)
+    assert (route and route.path_format) == expected
+
+
+@pytest.mark.parametrize(
+    "method, path, expected",
+    [
+        ("POST", "/upload/x/y", status.HTTP_200_OK),
+        ("GET", "/upload/x/y", status.HTTP_405_METHOD_NOT_ALLOWED),
+        ("POST", "/upload/x/y/z", status.HTTP_404_NOT_FOUND),
+    ],
+)
+def test_route_index_status(method, path, expected):
+    assert RouteIndex().status(make_routes(), method, path) == expected
+
+
+async def test_stream_route_under_batch_bucket_gets_stream_limits(
+    make_service: MakeService,
+):
+    _, client = await make_service(SIZE=str(len(JPEG)), MINIO_BUCKETS='["batch"]')
+    response = await client.post("/upload/batch/a.jpg", content=b"not a jpeg" * 64)
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    response = await client.post("/upload/batch/a.jpg", content=JPEG + b"\0")
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    response = await client.post("/upload/batch/a.jpg", content=JPEG)
+    assert response.status_code == status.HTTP_200_OK
+
+
+async def test_unknown_path_with_upload_prefix_is_not_guarded(
+    make_service: MakeService,
+):
+    _, client = await make_service(SIZE="16")
+    response = await client.post("/uploadfoo", content=b"\0" * 1024)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_batch_upload_is_limited_by_batch_size(make_service: MakeService):
+    image = JPEG * 8
+    _, client = await make_service(
+        SIZE=str(len(image)), UPLOAD_BATCH_SIZE=str(len(image))
+    )
+    files = [("files", (f"{i}.jpg", image, "image/jpeg")) for i in range(3)]
+    response = await client.post(f"/upload/batch?bucket={BUCKET}", files=files)
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    response = await client.post(f"/upload/batch?bucket={BUCKET}", files=files[:1])
+    assert response.status_code == status.HTTP_200_OK
@@ -0,0 +1,84 @@
+import pytest
+from conftest import BUCKET, JPEG, FakeS3, MakeService, upload
+from miniopy_async.error import S3Error
+from store.S3.exeptions import S3RangeNotSatisfiableException
+from store.S3.ranges import ByteRange, parse_range_header
+
+pytestmark = pytest.mark.anyio
+
+OTHER = JPEG + b"\0"
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-9", [ByteRange(0, 9)]),
+        ("bytes=90-", [ByteRange(90, 99)]),
+        ("bytes=-5", [ByteRange(95, 99)]),
+        ("bytes=95-200", [ByteRange(95, 99)]),
+        ("bytes=5-6,0-1", [ByteRange(0, 1), ByteRange(5, 6)]),
+        ("bytes=5-6,0-9", [ByteRange(0, 9)]),
+        ("bytes=0-1,2-3", [ByteRange(0, 3)]),
+        ("bytes=9-0", None),
+        ("items=0-9", None),
+        (",".join(f"bytes={i * 2}-{i * 2}" for i in range(17)), None),
+    ],
+)
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 100) == expected
+
+
+def test_unsatisfiable_range():
+    with pytest.raises(S3RangeNotSatisfiableException):
+        parse_range_header("bytes=100-", 100)
+
+
+async def test_multiple_ranges(make_service: MakeService):
+    _, client = await make_service()
+    await upload(client, "a.jpg")
+    response = await client.get(
+        f"/download/{BUCKET}/a.jpg", headers={"Range": "bytes=0-3,100-103"}
+    )
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges")
+    assert JPEG[0:4] in response.content and JPEG[100:104] in response.content
+    assert int(response.headers["content-length"]) == len(response.content)
+
+
+async def test_object_replaced_before_range_get_is_sent_whole(
+    s3: FakeS3, make_service: MakeService
+):
+    _, client = await make_service(METADATA_CACHE_ENABLED="True")
+    _, writer = await make_service()
+    await upload(client, "a.jpg")
+    await client.get(f"/download/{BUCKET}/a.jpg", headers={"Range": "bytes=0-0"})
+    await upload(writer, "a.jpg", OTHER)
+
+    response = await client.get(
+        f"/download/{BUCKET}/a.jpg", headers={"Range": "bytes=0-9"}
+    )
+    assert response.status_code == 200
+    assert response.content == OTHER
+    assert response.headers["etag"] == f'"{s3.buckets[BUCKET]["a.jpg"].etag}"'
+
+
+async def test_object_replaced_between_ranges_aborts_body(
+    make_service: MakeService, monkeypatch: pytest.MonkeyPatch
+):
+    app, client = await make_service()
+    _, writer = await make_service()
+    await upload(client, "a.jpg")
+    accessor = app.store.s3
+    get_object = accessor._get_object
+
+    async def racing_get(bucket, object_name, byte_range=None, etag=None):
+        response = await get_object(bucket, object_name, byte_range, etag)
+        await upload(writer, "a.jpg", OTHER)
+        return response
+
+    monkeypatch.setattr(accessor, "_get_object", racing_get)
+    with pytest.raises(ExceptionGroup) as caught:
+        await client.get(
+            f"/download/{BUCKET}/a.jpg", headers={"Range": "bytes=0-3,100-103"}
+        )
+    assert caught.group_contains(S3Error, match="PreconditionFailed", depth=1)
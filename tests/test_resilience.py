@@ -0,0 +1,133 @@
+import asyncio
+
+import aiohttp
+import pytest
+from store.database.minio import PooledMinio
+from store.database.resilience import (
+    LATENCY_MIN_SAMPLES,
+    Backoff,
+    LatencyWindow,
+    is_replayable,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeResponse:
+    def __init__(self):
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+class SlowSends:
+    """Запросы, каждый из которых ждёт своего события."""
+
+    def __init__(self, client: PooledMinio, monkeypatch: pytest.MonkeyPatch):
+        self.gates: list[asyncio.Event] = []
+        self.cancelled: list[int] = []
+        self.responses: list[FakeResponse] = []
+        monkeypatch.setattr(client, "_send", self.send)
+
+    async def send(self, method, region, args, session, kwargs):
+        index = len(self.gates)
+        self.gates.append(asyncio.Event())
+        try:
+            await self.gates[index].wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        self.responses.append(FakeResponse())
+        return self.responses[-1]
+
+
+def make_client(**kwargs) -> PooledMinio:
+    return PooledMinio("localhost:9000", session=None, **kwargs)
+
+
+def hedging_client(delay: float = 0.01) -> PooledMinio:
+    hedge = LatencyWindow(0.5)
+    for _ in range(LATENCY_MIN_SAMPLES):
+        hedge.add(delay)
+    return make_client(hedge=hedge)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def start_hedged(client: PooledMinio) -> asyncio.Task:
+    return asyncio.create_task(client._hedged("GET", "us-east-1", (), None, {}))
+
+
+@pytest.mark.parametrize("hedged", [False, True])
+async def test_cancelled_hedged_read_cancels_requests(
+    monkeypatch: pytest.MonkeyPatch, hedged: bool
+):
+    client = hedging_client()
+    sends = SlowSends(client, monkeypatch)
+    task = start_hedged(client)
+    await (asyncio.sleep(0.05) if hedged else settle())
+    assert len(sends.gates) == (2 if hedged else 1)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await settle()
+    assert sorted(sends.cancelled) == list(range(len(sends.gates)))
+
+
+async def test_hedged_read_keeps_first_response(monkeypatch: pytest.MonkeyPatch):
+    client = hedging_client()
+    sends = SlowSends(client, monkeypatch)
+    task = start_hedged(client)
+    await asyncio.sleep(0.05)
+    sends.gates[1].set()
+    assert await task is sends.responses[0]
+    await settle()
+    assert sends.cancelled == [0]
+
+
+async def test_simultaneous_hedged_responses(monkeypatch: pytest.MonkeyPatch):
+    client = hedging_client()
+    sends = SlowSends(client, monkeypatch)
+    task = start_hedged(client)
+    await asyncio.sleep(0.05)
+    for gate in sends.gates:
+        gate.set()
+    winner = await task
+    assert len(sends.responses) == 2
+    assert [response.released for response in sends.responses].count(True) == 1
+    assert not winner.released
+
+
+@pytest.mark.parametrize(
+    "method, body, expected",
+    [
+        ("GET", None, True),
+        ("PUT", b"part", True),
+        ("PUT", iter([b"part"]), False),
+        ("POST", b"<Delete/>", False),
+    ],
+)
+def test_is_replayable(method, body, expected):
+    assert is_replayable(method, body) is expected
+
+
+@pytest.mark.parametrize("body, attempts", [(b"part", 3), (iter([b"part"]), 1)])
+async def test_put_is_retried_only_with_replayable_body(
+    monkeypatch: pytest.MonkeyPatch, body, attempts: int
+):
+    client = make_client(backoff=Backoff(2, 0.0, 0.0))
+    calls = []
+
+    async def send(method, region, args, session, kwargs):
+        calls.append(method)
+        raise aiohttp.ClientConnectionError()
+
+    monkeypatch.setattr(client, "_send", send)
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await client._request("PutObject", "PUT", "us-east-1", (), None, {"body": body})
+    assert len(calls) == attempts